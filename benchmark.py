@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from pathlib import Path
+import argparse
+import concurrent.futures
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from blob_store import BlobStore
+from conversation_context import ConversationContext
+from fake_model import FakeModelClient
+from gpt_participant import GptParticipant
+from headless_frontend import HeadlessChatFrontend, HeadlessScreen
+from interbud_app import InterBudApp
+from keyboard_participant import KeyboardChatParticipant
+from participant_interface import ChatParticipantInterface
+
+# Headless benchmark suite. Every scenario runs the real app components with a
+# HeadlessChatFrontend instead of a terminal and a FakeModelClient instead of the model API,
+# and returns its measurements as a dict. The results of all scenarios are written as one JSON
+# document, so runs of different versions can be compared.
+
+# Participant counting the messages it receives. Messages the bus coalesced into one delivery
+# are counted separately (one per line).
+class CountingParticipant(ChatParticipantInterface):
+    def __init__(self, label, expected_messages):
+        super(CountingParticipant, self).__init__(label)
+        self.expected_messages = expected_messages
+        self.messages = 0
+        self.deliveries = 0
+        self.done = threading.Event()
+
+    def send_message(self, send_datetime, sender, message):
+        self.deliveries += 1
+        self.messages += message.count("\n") + 1
+        if self.messages >= self.expected_messages:
+            self.done.set()
+
+    def run(self):
+        pass
+
+def summarize(samples):
+    """
+    Returns statistics (in milliseconds) for a list of durations in seconds.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000,
+        "min_ms": samples[0] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+def benchmark_fanout(messages=20000, participants=4):
+    """
+    Publishes messages through InterBudApp.process_message and measures the time until every
+    participant received all of them. The frontend is running and drawing as well.
+    """
+    frontend = HeadlessChatFrontend()
+    app = InterBudApp(None, None, frontend=frontend)
+    frontend_thread = threading.Thread(target=frontend.run)
+    frontend_thread.start()
+    sinks = []
+    for index in range(participants):
+        sink = CountingParticipant(f"Sink{index}", messages)
+        app.add_chat_partner(sink.label, sink)
+        sinks.append(sink)
+
+    started = time.perf_counter()
+    date = datetime.now()
+    for index in range(messages):
+        app.process_message(date, "Bench", f"message {index}")
+    published = time.perf_counter()
+    for sink in sinks:
+        sink.done.wait(60)
+    finished = time.perf_counter()
+
+    result = {
+        "messages": messages,
+        "participants": participants,
+        "publish_seconds": published - started,
+        "delivery_seconds": finished - started,
+        "messages_per_second": messages / (finished - started),
+        "deliveries": sum(sink.deliveries for sink in sinks),
+        "complete": all(sink.done.is_set() for sink in sinks),
+    }
+    app.quit_app()
+    frontend_thread.join()
+    return result
+
+def benchmark_history_render(history_lines=(1000, 10000, 100000), height=50, width=120, repeats=20):
+    """
+    Measures the cost of the history window in ChatFrontend for histories of different sizes:
+    adding the messages, drawing a frame with warm and cold layout caches (the latter is what a
+    terminal resize costs), and wrapping the whole history. All values are also given per 1000
+    history lines.
+    """
+    results = []
+    date = datetime.now()
+    for lines in history_lines:
+        frontend = HeadlessChatFrontend(HeadlessScreen(height, width), history_limit=lines)
+        # Messages of 1 to 8 rows, mixing short lines with long lines that need wrapping
+        messages = []
+        total_rows = 0
+        while total_rows < lines:
+            rows = 1 + len(messages) % 8
+            text = "\n".join(("word " * (10 + 30 * (row % 3)))[:width * 2] for row in range(rows))
+            messages.append(text)
+            total_rows += rows
+
+        started = time.perf_counter()
+        for message in messages:
+            frontend.apply_queue_item((date, "Bench", message, False))
+        add_seconds = time.perf_counter() - started
+
+        warm = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            frontend.draw_history()
+            warm.append(time.perf_counter() - started)
+        cold = []
+        for _ in range(repeats):
+            frontend.layout.clear()
+            started = time.perf_counter()
+            frontend.draw_history()
+            cold.append(time.perf_counter() - started)
+
+        frontend.layout.clear()
+        content_width = frontend.history_width - 2
+        started = time.perf_counter()
+        for record in frontend.history_messages:
+            frontend.message_rows(record, content_width)
+        wrap_seconds = time.perf_counter() - started
+
+        thousands = lines / 1000
+        results.append({
+            "history_lines": lines,
+            "messages": len(messages),
+            "add_ms": add_seconds * 1000,
+            "add_ms_per_1k_lines": add_seconds * 1000 / thousands,
+            "warm_frame": summarize(warm),
+            "cold_frame": summarize(cold),
+            "full_wrap_ms": wrap_seconds * 1000,
+            "full_wrap_ms_per_1k_lines": wrap_seconds * 1000 / thousands,
+        })
+    return {"height": height, "width": width, "sizes": results}
+
+def benchmark_keystrokes(keys=300, line_length=60, max_fps=30):
+    """
+    Measures the time from a key press until a frame shows it in the input field, through
+    KeyboardChatParticipant and ChatFrontend (including the frame rate cap).
+    """
+    screen = HeadlessScreen()
+    frontend = HeadlessChatFrontend(screen, max_fps=max_fps)
+    keyboard = KeyboardChatParticipant("User", screen)
+    keyboard.register_update_input_callback(frontend.update_input)
+    frontend_thread = threading.Thread(target=frontend.run)
+    frontend_thread.start()
+    keyboard.run()
+
+    samples = []
+    missed = 0
+    text = ""
+    for index in range(keys):
+        if len(text) >= line_length:
+            key, text = "\n", ""
+        else:
+            key = "abcdefghijklmnopqrstuvwxyz"[index % 26]
+            text += key
+        expected = "> " + text
+        started = time.perf_counter()
+        screen.press_keys([key])
+        if frontend.wait_for_frame(lambda f: f.drawn_input_rows and f.drawn_input_rows[0].rstrip() == expected, timeout=5):
+            samples.append(time.perf_counter() - started)
+        else:
+            missed += 1
+
+    screen.press_keys([chr(4)])  # CTRL-D ends the keyboard thread
+    keyboard.thread.join()
+    frontend.quit()
+    frontend_thread.join()
+    return {"keys": keys, "max_fps": max_fps, "missed": missed, "latency": summarize(samples)}
+
+def benchmark_tool_loop(tool_calls=(0, 1, 4, 16), turns=20, stream=True, tool_name="list_folder"):
+    """
+    Measures the duration of GptParticipant._process_messages for a user message that the
+    fake model answers with N tool calls followed by a text reply.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as base_folder:
+        for count in tool_calls:
+            client = FakeModelClient(tool_calls=count, tool_name=tool_name)
+            participant = GptParticipant("GPT", None, base_file_folder=Path(base_folder), stream=stream, client=client)
+            samples = []
+            for turn in range(turns):
+                started = time.perf_counter()
+                participant._process_messages([{"role": "user", "content": f"Turn {turn}"}])
+                samples.append(time.perf_counter() - started)
+            participant.tool_executor.shutdown()
+            participant.shell_pool.close()
+            results.append({"tool_calls": count, "requests": client.requests, "turn": summarize(samples)})
+    return {"stream": stream, "tool_name": tool_name, "turns": turns, "results": results}
+
+def benchmark_turn(turns=20, tool_calls=1, max_fps=30):
+    """
+    Measures complete turns through the running app: from the <Enter> key press submitting a
+    message until a frame shows the model's reply.
+    """
+    screen = HeadlessScreen()
+    frontend = HeadlessChatFrontend(screen, max_fps=max_fps)
+    client = FakeModelClient(reply="Reply", tool_calls=tool_calls)
+    working_directory = os.getcwd()
+    samples = []
+    missed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        # The GPT participant works in 'gpt_managed_files' below the current directory
+        os.chdir(directory)
+        try:
+            app = InterBudApp(screen, None, frontend=frontend, client=client)
+            app_thread = threading.Thread(target=app.run)
+            app_thread.start()
+            for turn in range(turns):
+                screen.press_keys(list(f"turn {turn}"))
+                frontend.wait_for_frame(lambda f: f.drawn_input_rows and f.drawn_input_rows[0].rstrip() == f"> turn {turn}", timeout=5)
+                first_id = frontend.next_message_id
+                started = time.perf_counter()
+                screen.press_keys(["\n"])
+                shown = frontend.wait_for_frame(lambda f: any(
+                    record.message_id >= first_id and record.sender == "GPT" and record.text == "Reply"
+                    for record in list(f.history_messages)[-(tool_calls + 3):]), timeout=10)
+                if shown:
+                    samples.append(time.perf_counter() - started)
+                else:
+                    missed += 1
+            screen.press_keys([chr(4)])  # CTRL-D quits the app
+            app_thread.join()
+        finally:
+            os.chdir(working_directory)
+    return {"turns": turns, "tool_calls": tool_calls, "max_fps": max_fps, "missed": missed, "latency": summarize(samples)}
+
+def resident_bytes():
+    # Current resident set size of the process (Linux only), None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def session_messages(messages, tool_output_length):
+    """
+    Yields (sender, display text, context message) for a synthetic session: user messages,
+    tool calls with their (large) outputs, of which every fourth repeats an earlier one (e.g.,
+    the same file read again), and replies. Every text is a separate string object.
+    """
+    for index in range(messages):
+        kind = index % 4
+        if kind == 0:
+            text = f"Please look at file_{index % 50}.py and fix test {index}"
+            yield "User", text, {"role": "user", "content": text}
+        elif kind == 1:
+            arguments = json.dumps({"relative_path": f"file_{index % 50}.py"})
+            call = {"id": f"call_{index}", "type": "function", "function": {"name": "read_file", "arguments": arguments}}
+            yield "GPT", f"Calling function read_file with arguments {arguments}", {"role": "assistant", "content": None, "tool_calls": [call]}
+        elif kind == 2:
+            source = index % 50 if index % 16 == 2 else index
+            output = "".join(f"{source}: line {line} of the file\n" for line in range(tool_output_length // 24))
+            yield None, None, {"tool_call_id": f"call_{index - 1}", "role": "tool", "name": "read_file", "content": output}
+        else:
+            text = f"I changed line {index} as requested. " * 40
+            yield "GPT", text, {"role": "assistant", "content": "".join(text)}
+
+def build_previous(session, date):
+    # The previous representation: history entries with a rendered prefix, a message dict per
+    # context entry
+    history = []
+    context = []
+    for index, (sender, text, message) in enumerate(session):
+        if text is not None:
+            history.append((index, f"[{date.strftime('%H:%M:%S')}] {sender}: ", "".join(text)))
+        message = json.loads(json.dumps(message))
+        context.append([message, ConversationContext.count_tokens(message)])
+    return history, context
+
+def build_records(session, date, spill_directory=None):
+    # The compact records: ChatRecords, ContextRecords and a BlobStore
+    store = BlobStore(spill_directory=spill_directory)
+    frontend = HeadlessChatFrontend(history_limit=len(session), blob_store=store)
+    context = ConversationContext("System prompt", token_budget=10 ** 9, blob_store=store)
+    for sender, text, message in session:
+        if text is not None:
+            frontend.apply_queue_item((date, sender, "".join(text), False))
+        context.append(json.loads(json.dumps(message)))
+    return frontend.history_messages, context, store
+
+MEMORY_BUILDS = {"previous": build_previous, "records": build_records}
+
+def build_memory(representation, messages, tool_output_length, spill_directory=None):
+    date = datetime.now()
+    session = list(session_messages(messages, tool_output_length))
+    arguments = (session, date, spill_directory) if representation == "records" else (session, date)
+    return session, MEMORY_BUILDS[representation], arguments
+
+def measure_traced(representation, messages, tool_output_length, spill_directory=None):
+    # Returns the bytes traced by tracemalloc that the structures of 'representation' hold.
+    session, build, arguments = build_memory(representation, messages, tool_output_length, spill_directory)
+    gc.collect()
+    tracemalloc.start()
+    kept = build(*arguments)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    gc.collect()
+    return traced
+
+def measure_resident(representation, messages, tool_output_length, spill_directory=None):
+    # Returns the growth of the resident set size while the structures of 'representation'
+    # are built. Run in a new process (see 'benchmark_memory'), so memory freed by an earlier
+    # measurement cannot be reused, and without tracemalloc, whose bookkeeping is resident too.
+    session, build, arguments = build_memory(representation, messages, tool_output_length, spill_directory)
+    gc.collect()
+    before = resident_bytes()
+    kept = build(*arguments)
+    gc.collect()
+    after = resident_bytes()
+    return after - before if before is not None and after is not None else None
+
+def benchmark_memory(messages=10000, tool_output_length=4096, spill=False):
+    """
+    Measures the memory the chat history and the conversation context hold for a long session,
+    per 10k messages: the compact records (ChatRecord, ContextRecord and a BlobStore, spilling
+    to a temporary file with 'spill') against the previous representation (history entries
+    with a rendered prefix and a message dict per context entry).
+
+    The traced bytes are measured in this process. The resident bytes are measured in a fresh
+    process for every representation, so that neither measurement depends on the other.
+    """
+    traced = {}
+    resident = {}
+    with tempfile.TemporaryDirectory() as directory:
+        spill_directory = directory if spill else None
+        for representation in MEMORY_BUILDS:
+            traced[representation] = measure_traced(representation, messages, tool_output_length, spill_directory)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                resident[representation] = executor.submit(measure_resident, representation, messages, tool_output_length, spill_directory).result()
+
+    scale = 10000 / messages
+    return {
+        "messages": messages,
+        "tool_output_length": tool_output_length,
+        "spill": spill,
+        "previous_traced_bytes_per_10k": int(traced["previous"] * scale),
+        "records_traced_bytes_per_10k": int(traced["records"] * scale),
+        "previous_resident_bytes_per_10k": int(resident["previous"] * scale) if resident["previous"] is not None else None,
+        "records_resident_bytes_per_10k": int(resident["records"] * scale) if resident["records"] is not None else None,
+        "traced_ratio": traced["records"] / traced["previous"],
+    }
+
+SCENARIOS = {
+    "fanout": benchmark_fanout,
+    "history_render": benchmark_history_render,
+    "keystrokes": benchmark_keystrokes,
+    "memory": benchmark_memory,
+    "tool_loop": benchmark_tool_loop,
+    "turn": benchmark_turn,
+}
+
+# Smaller parameters for a quick check
+QUICK_PARAMETERS = {
+    "fanout": {"messages": 2000},
+    "history_render": {"history_lines": (1000, 10000), "repeats": 5},
+    "keystrokes": {"keys": 60},
+    "memory": {"messages": 2000},
+    "tool_loop": {"tool_calls": (0, 4), "turns": 5},
+    "turn": {"turns": 5},
+}
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the InterBud headless benchmarks and prints the results as JSON')
+    parser.add_argument('--scenarios', help='Comma separated scenarios to run (default: all)', default=','.join(SCENARIOS))
+    parser.add_argument('--quick', help='Run with smaller parameters', action='store_true')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+
+    report = {
+        "time": datetime.now().isoformat(timespec='seconds'),
+        "revision": revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "scenarios": {},
+    }
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        parameters = QUICK_PARAMETERS[name] if args.quick else {}
+        started = time.perf_counter()
+        report["scenarios"][name] = SCENARIOS[name](**parameters)
+        report["scenarios"][name]["wall_seconds"] = time.perf_counter() - started
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,134 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+
+# Reference to a text held by a BlobStore. Equal texts share one BlobRef (and one copy of the
+# data). The encoded text is kept in 'data', or at 'offset' in the store's spill file.
+class BlobRef(object):
+    __slots__ = ("digest", "length", "size", "data", "offset", "__weakref__")
+
+    def __init__(self, digest, length, size, data=None, offset=None):
+        self.digest = digest
+        self.length = length
+        self.size = size
+        self.data = data
+        self.offset = offset
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"BlobRef({self.digest.hex()[:12]}, {self.length} characters)"
+
+
+# Content-addressed store for large texts such as tool outputs and long messages. Texts of at
+# least 'inline_limit' characters are stored once, keyed by their SHA-256 digest, and replaced by
+# a BlobRef; shorter texts are returned unchanged. Records of the conversation context and of
+# the chat history hold the references, so a text shown in the history and sent to the model
+# exists once in memory. A blob lives as long as a reference to it does.
+# With a spill directory, blob data is appended to a temporary file there instead of being kept
+# in memory, and read back through a memory map. The file only grows: data in it is never freed,
+# but a text that is stored again after its references were collected reuses the data already
+# written. The file is removed when the store is closed.
+class BlobStore(object):
+    def __init__(self, inline_limit=1024, spill_directory=None):
+        self.inline_limit = inline_limit
+        self.blobs = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+        self.spill_file = None
+        self.spill_size = 0
+        self.spill_map = None
+        # digest -> offset of the data in the spill file
+        self.spilled = {}
+        if spill_directory is not None:
+            self.spill_to(spill_directory)
+
+    def spill_to(self, directory):
+        """
+        Stores the data of new blobs in a file in 'directory' instead of in memory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(dir=directory, prefix="interbud-blobs-")
+
+    def put(self, text):
+        """
+        Stores a text.
+
+        Returns:
+        - str or BlobRef: The text itself if it is short (or None), a reference otherwise.
+        """
+        if text is None or isinstance(text, BlobRef) or len(text) < self.inline_limit:
+            return text
+        data = text.encode("utf-8", "surrogatepass")
+        digest = hashlib.sha256(data).digest()
+        with self.lock:
+            ref = self.blobs.get(digest)
+            if ref is not None:
+                return ref
+            if self.spill_file is not None:
+                offset = self.spilled.get(digest)
+                if offset is None:
+                    offset = self.spilled[digest] = self.spill_size
+                    self.spill_file.seek(self.spill_size)
+                    self.spill_file.write(data)
+                    self.spill_size += len(data)
+                ref = BlobRef(digest, len(text), len(data), offset=offset)
+            else:
+                ref = BlobRef(digest, len(text), len(data), data=data)
+            self.blobs[digest] = ref
+            return ref
+
+    def _read(self, ref, size):
+        size = min(size, ref.size)
+        if ref.data is not None:
+            return ref.data[:size]
+        with self.lock:
+            end = ref.offset + ref.size
+            if self.spill_map is None or len(self.spill_map) < end:
+                # The map is extended to cover the blobs written since it was created
+                self.spill_file.flush()
+                if self.spill_map is not None:
+                    self.spill_map.close()
+                self.spill_map = mmap.mmap(self.spill_file.fileno(), self.spill_size, access=mmap.ACCESS_READ)
+            return self.spill_map[ref.offset:ref.offset + size]
+
+    def get(self, value):
+        """
+        Returns the text of a BlobRef (other values are returned unchanged).
+        """
+        if not isinstance(value, BlobRef):
+            return value
+        return self._read(value, value.size).decode("utf-8", "surrogatepass")
+
+    def prefix(self, value, length):
+        # Returns the first 'length' characters of a text or blob without reading all of it.
+        if not isinstance(value, BlobRef):
+            return value[:length]
+        return self._read(value, length * 4).decode("utf-8", "ignore")[:length]
+
+    def stats(self):
+        with self.lock:
+            refs = list(self.blobs.values())
+        return {
+            "blobs": len(refs),
+            "memory_bytes": sum(ref.size for ref in refs if ref.data is not None),
+            "spilled_bytes": self.spill_size,
+        }
+
+    def close(self):
+        with self.lock:
+            if self.spill_map is not None:
+                self.spill_map.close()
+                self.spill_map = None
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+
+
+# The store used by default, shared by the conversation contexts and the chat history
+shared_store = BlobStore()
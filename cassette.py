@@ -0,0 +1,188 @@
+from types import SimpleNamespace
+import hashlib
+import json
+import threading
+import time
+
+# Model API record/replay. A cassette is a JSON lines file holding one recorded chat completion
+# per line: the request, its content hash, the response (or the chunks of a streamed response)
+# and the recorded timing. RecordingClient wraps a real OpenAI client and appends every
+# completion to a cassette, ReplayClient serves the recorded completions without network
+# access. Both expose the 'chat.completions.create' interface used by GptParticipant, and
+# 'chat.completions.with_raw_response.create': the rate limit headers of recorded responses
+# are stored in the cassette and returned again when they are replayed, so the rate limiter
+# sees the same limits.
+
+# Response headers kept in a cassette (the rate limit headers; others may hold cookies etc.)
+RECORDED_HEADER_PREFIXES = ("x-ratelimit-", "retry-after")
+
+def request_key(request):
+    """
+    Returns the content hash identifying a chat completion request.
+    """
+    relevant = {name: request.get(name) for name in ("model", "messages", "tools", "stream")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def to_namespace(value):
+    # Recursively converts recorded JSON data into objects with attribute access, mirroring the
+    # response objects of the OpenAI client.
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(item) for item in value]
+    return value
+
+
+class Cassette(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def append(self, interaction):
+        line = json.dumps(interaction, ensure_ascii=False) + "\n"
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def recorded_headers(headers):
+    return {name.lower(): value for name, value in (headers or {}).items() if name.lower().startswith(RECORDED_HEADER_PREFIXES)}
+
+
+class _Completions(object):
+    def __init__(self, create, create_raw):
+        self.create = create
+        self.with_raw_response = SimpleNamespace(create=create_raw)
+
+
+# Raw response of the cassette clients, like the one of the OpenAI client: the headers and
+# 'parse()' returning the response (or stream).
+class _RawResponse(object):
+    def __init__(self, headers, response):
+        self.headers = headers
+        self.response = response
+
+    def parse(self):
+        return self.response
+
+
+# Client wrapper recording every chat completion of the wrapped client into a cassette.
+class RecordingClient(object):
+    def __init__(self, client, cassette):
+        self.client = client
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_Completions(self._create, self._create_raw))
+
+    def _create(self, **request):
+        started = time.monotonic()
+        return self._record(request, self.client.chat.completions.create(**request), started, {})
+
+    def _create_raw(self, **request):
+        started = time.monotonic()
+        raw_completions = getattr(self.client.chat.completions, "with_raw_response", None)
+        if raw_completions is None:
+            return _RawResponse({}, self._create(**request))
+        raw_response = raw_completions.create(**request)
+        headers = recorded_headers(raw_response.headers)
+        return _RawResponse(headers, self._record(request, raw_response.parse(), started, headers))
+
+    def _record(self, request, response, started, headers):
+        interaction = {"key": request_key(request), "request": request}
+        if headers:
+            interaction["headers"] = headers
+        if not request.get("stream"):
+            interaction["response"] = response.model_dump()
+            interaction["timing"] = {"total": time.monotonic() - started}
+            self.cassette.append(interaction)
+            return response
+        return self._record_stream(response, interaction, started)
+
+    def _record_stream(self, stream, interaction, started):
+        chunks = []
+        offsets = []
+        for chunk in stream:
+            chunks.append(chunk.model_dump())
+            offsets.append(time.monotonic() - started)
+            yield chunk
+        interaction["chunks"] = chunks
+        interaction["timing"] = {"offsets": offsets}
+        self.cassette.append(interaction)
+
+
+# Client serving recorded chat completions. Requests are looked up by their content hash; if a
+# request was not recorded and 'strict' is not set, the next not yet served interaction in
+# recording order is used instead, which keeps a replay going when, e.g., tool outputs contain
+# timestamps. 'latency_scale' controls the timing: 0 replays at full speed, 1 reproduces the
+# recorded latencies (time to first chunk and the gaps between chunks), other values scale
+# them. 'extra_latency' adds a fixed delay in seconds before every response.
+class ReplayClient(object):
+    def __init__(self, cassette, latency_scale=0.0, extra_latency=0.0, strict=False):
+        self.interactions = cassette.load()
+        self.by_key = {}
+        for position, interaction in enumerate(self.interactions):
+            self.by_key.setdefault(interaction["key"], []).append(position)
+        self.served = set()
+        self.next_position = 0
+        self.latency_scale = latency_scale
+        self.extra_latency = extra_latency
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Completions(self._create, self._create_raw))
+
+    def find(self, request):
+        """
+        Returns the recorded interaction answering a request.
+        """
+        with self.lock:
+            candidates = [position for position in self.by_key.get(request_key(request), []) if position not in self.served]
+            if not candidates and self.by_key.get(request_key(request)):
+                # All recordings of this request were served already, serve the last one again.
+                candidates = self.by_key[request_key(request)][-1:]
+            if not candidates and not self.strict:
+                while self.next_position < len(self.interactions) and self.next_position in self.served:
+                    self.next_position += 1
+                if self.next_position < len(self.interactions):
+                    candidates = [self.next_position]
+            if not candidates:
+                raise LookupError("No recorded response for this request")
+            position = candidates[0]
+            self.served.add(position)
+            return self.interactions[position]
+
+    def delays(self, interaction):
+        """
+        Returns the delays before the response (or before each chunk of a streamed response).
+        """
+        timing = interaction.get("timing", {})
+        if "offsets" in timing:
+            offsets = [0.0] + timing["offsets"]
+            delays = [(offsets[i + 1] - offsets[i]) * self.latency_scale for i in range(len(offsets) - 1)]
+        else:
+            delays = [timing.get("total", 0.0) * self.latency_scale]
+        if delays:
+            delays[0] += self.extra_latency
+        return delays
+
+    def _create(self, **request):
+        return self._respond(self.find(request))
+
+    def _create_raw(self, **request):
+        interaction = self.find(request)
+        return _RawResponse(interaction.get("headers", {}), self._respond(interaction))
+
+    def _respond(self, interaction):
+        delays = self.delays(interaction)
+        if "chunks" not in interaction:
+            time.sleep(delays[0])
+            return to_namespace(interaction["response"])
+        return self._replay_stream(interaction["chunks"], delays)
+
+    def _replay_stream(self, chunks, delays):
+        for chunk, delay in zip(chunks, delays):
+            if delay > 0:
+                time.sleep(delay)
+            yield to_namespace(chunk)
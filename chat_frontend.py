@@ -1,110 +1,557 @@
+from bisect import bisect_left
+from collections import deque
 import curses
 import queue
+import threading
+import time
+from text_layout import LayoutCache, text_width, wrap_text
+from line_editor import clip_to_width, scroll_start
+from blob_store import shared_store
+from history_index import HISTORY_FILTERS, HistoryIndex
+from message_records import ChatRecord
+
+# Queue item that only wakes up the frontend loop to draw a new frame
+REDRAW = "redraw"
+
+# Queue item asking the frontend to scroll or search the history (see 'navigate_history')
+class HistoryCommand(object):
+    __slots__ = ("action", "argument")
+
+    def __init__(self, action, argument=None):
+        self.action = action
+        self.argument = argument
 
 class ChatFrontend:
-    def __init__(self, stdscr):
+    def __init__(self, stdscr, history_limit=20000, max_fps=30, max_input_rows=5, metrics=None, show_status_bar=True, blob_store=shared_store, user_labels=("User",), max_queued_messages=1024):
         self.message_queue = queue.Queue()
         self.running = False
-        self.last_input_text = ""
+        self.closed = False
+
+        # At most 'max_queued_messages' (final or in-progress) messages wait for the frontend
+        # thread; 'enqueue_message' and 'update_partial_message' block while that many are
+        # queued. A frontend that cannot keep up so holds up the message bus delivery to it,
+        # where the inbox' overflow policy applies. Other queue items (redraws, history
+        # commands) are not limited, they never block the keyboard thread.
+        self.queue_slots = threading.Semaphore(max_queued_messages)
+        self.enqueue_lock = threading.Lock()
+
+        # Status bar row between the history and the input field (e.g., the measurements of the
+        # last turn). Every drawn frame is recorded as a render span if 'metrics' is given.
+        self.metrics = metrics
+        self.status_rows = 1 if show_status_bar else 0
+        self.status_text = ""
+        self.status_changed = True
+
+        # Input field state as reported by the keyboard participant. It is only drawn by the
+        # frontend thread; the rows drawn last are remembered so only changed cells are redrawn.
+        # The state and its 'input_changed' flag are set and taken together under
+        # 'input_lock', so a state stored while a frame is drawn is drawn by the next frame.
+        self.input_lock = threading.Lock()
+        self.input_state = (("",), (0, 0))
+        self.input_rows = 1
+        self.max_input_rows = max_input_rows
+        self.input_scroll = 0
+        self.drawn_input_rows = []
+        self.input_changed = True
+
+        # Chat history as ChatRecords; long texts are kept in the blob store and only read when
+        # they are wrapped. Only the newest 'history_limit' messages are kept. Messages are
+        # wrapped lazily when they are drawn (see LayoutCache), and only the rows visible in the
+        # history window are drawn. Redraws happen at most 'max_fps' times per second, all
+        # messages that arrived in between are drawn in one frame.
+        self.history_messages = deque(maxlen=history_limit)
+        self.blob_store = blob_store
+        self.next_message_id = 0
+        self.layout = LayoutCache()
+        self.frame_interval = 1.0 / max_fps
+        self.last_frame_time = 0.0
+        # Set once the first frame is drawn; slow setup work waits for it (see InterBudApp)
+        self.first_frame = threading.Event()
+
+        # Scrollback and search. Every message is added to the history index as it arrives
+        # (message ids are the index' message numbers). 'scroll_anchor' is None while the view
+        # follows the newest messages, otherwise (message_id, hidden_rows): the view ends
+        # with that message, of which the last 'hidden_rows' rows are below the view. The view
+        # only shows the messages passing 'history_filter' (see HISTORY_FILTERS).
+        self.history_index = HistoryIndex(user_labels)
+        self.scroll_anchor = None
+        self.history_filter = "all"
+        self.search_query = None
+        self.search_matches = []
+        self.current_match = None
+        self.highlighted_rows = (0, 0)
 
         # Initialize curses
         self.stdscr = stdscr
+        self.setup_terminal()
+
+        # Create two sub-windows: One that displays chat history and one for user input
+        self.history_win = None
+        self.input_win = None
+        self.layout_windows()
+
+        # In-progress message (e.g., a reply that is still being streamed)
+        self.partial_date = None
+        self.partial_sender = None
+        self.partial_text = ""
+        self.partial_prefix = ""
+
+    # Terminal access. All curses calls that need a real terminal go through these methods, so a
+    # headless frontend (see headless_frontend.py) can replace them.
+    def setup_terminal(self):
         curses.noecho()
         curses.cbreak()
         self.stdscr.keypad(True)
+        # Report a single ESC key press (cancel) quickly instead of waiting a second for a
+        # possible escape sequence
+        if hasattr(curses, "set_escdelay"):
+            curses.set_escdelay(25)
 
-        # Create two sub-windows: One that displays chat history and one for user input
+    def new_window(self, height, width, y, x):
+        return curses.newwin(height, width, y, x)
+
+    def update_screen(self):
+        curses.doupdate()
+
+    def layout_windows(self):
+        # (Re)creates the history and input windows for the current terminal size.
         self.height, self.width = self.stdscr.getmaxyx()
-        self.history_height = self.height - 3
+        self.input_height = self.input_rows + 2
+        self.history_height = self.height - self.input_height - self.status_rows
         self.history_width = self.width
-        self.input_height = 3
         self.input_width = self.width
         self.history_start_y = 0
         self.history_start_x = 0
-        self.input_start_y = self.height - 3
+        self.input_start_y = self.height - self.input_height
         self.input_start_x = 0
 
-        # Create history pad
-        self.history_pad = curses.newpad(1000, self.history_width)  # Large height for the pad to allow scrolling
-        self.history_pad.scrollok(True)
-        self.history_pad.idlok(True)
-
         # Create history window border
-        self.history_win = curses.newwin(self.history_height, self.history_width, self.history_start_y, self.history_start_x)
+        self.history_win = self.new_window(self.history_height, self.history_width, self.history_start_y, self.history_start_x)
         self.history_win.border()
 
         # Create input window
-        self.input_win = curses.newwin(self.input_height, self.input_width, self.input_start_y, self.input_start_x)
+        self.input_win = self.new_window(self.input_height, self.input_width, self.input_start_y, self.input_start_x)
         self.input_win.border()
-        self.input_win.move(1, 2)
-        self.input_win.addstr("> ")
+        self.input_win.keypad(True)
+        self.drawn_input_rows = []
+        with self.input_lock:
+            self.input_changed = True
+
+        # Create status bar window
+        self.status_win = None
+        if self.status_rows:
+            self.status_win = self.new_window(self.status_rows, self.width, self.history_height, 0)
+        self.status_changed = True
 
         # Refresh the main window and sub-windows
+        self.stdscr.clear()
         self.stdscr.refresh()
         self.history_win.refresh()
-        self.input_win.refresh()
+        self.draw_status()
+        self.draw_input(self.take_input_state())
+        self.update_screen()
+
+    def visible_history_rows(self, rows):
+        # Collects the newest 'rows' rows (followed by the in-progress message, if any) by
+        # walking the history backwards, so only the messages in view are wrapped. When the
+        # view is scrolled, the walk starts at the anchor message instead.
+        content_width = self.history_width - 2
+        lines = []
+        self.highlighted_rows = (0, 0)
+        if self.scroll_anchor is None:
+            if self.partial_sender is not None:
+                lines = wrap_text(self.partial_text, max(content_width - text_width(self.partial_prefix), 1))
+                lines = [self.partial_prefix + line for line in lines[-rows:]]
+            position = len(self.history_messages) - 1
+        else:
+            message_id, hidden_rows = self.scroll_anchor
+            position = self.history_position(message_id)
+            record = self.history_messages[position]
+            message_rows = self.message_rows(record, content_width)
+            lines = message_rows[max(len(message_rows) - hidden_rows - rows, 0):len(message_rows) - hidden_rows]
+            if message_id == self.current_match:
+                self.highlighted_rows = (0, len(lines))
+            position -= 1
+        while position >= 0 and len(lines) < rows:
+            record = self.history_messages[position]
+            position -= 1
+            if not self.shown_in_history(record):
+                continue
+            missing = rows - len(lines)
+            message_rows = self.message_rows(record, content_width)[-missing:]
+            lines = message_rows + lines
+            if record.message_id == self.current_match:
+                self.highlighted_rows = (0, len(message_rows))
+            elif self.highlighted_rows[1]:
+                self.highlighted_rows = (self.highlighted_rows[0] + len(message_rows), self.highlighted_rows[1] + len(message_rows))
+        return lines
+
+    def message_rows(self, record, width):
+        # Returns the wrapped rows of a history message
+        rows = self.layout.lookup(record.message_id, width)
+        if rows is None:
+            rows = self.layout.get_rows(record.message_id, record.prefix(), self.blob_store.get(record.text), width)
+        return rows
+
+    def draw_history(self):
+        # Every row is padded to the full width, so stale text is overwritten without clearing
+        # the window and curses only sends the changed cells. The rows of the current search
+        # match are highlighted. Rows can be wider than the window when the message prefix
+        # alone fills it (a very narrow window or a long sender name); they are clipped, so
+        # nothing is written over the border.
+        visible_rows = self.history_height - 2
+        content_width = self.history_width - 2
+        lines = self.visible_history_rows(visible_rows)
+        first_highlighted, last_highlighted = self.highlighted_rows
+        for row in range(visible_rows):
+            line = lines[row] if row < len(lines) else ""
+            width = text_width(line)
+            if width > content_width:
+                line = clip_to_width(line, content_width)
+                width = text_width(line)
+            attributes = curses.A_REVERSE if first_highlighted <= row < last_highlighted else curses.A_NORMAL
+            self.history_win.addstr(row + 1, 1, line + " " * (content_width - width), attributes)
+        self.history_win.noutrefresh()
+
+    def shown_in_history(self, record):
+        return self.history_filter == "all" or self.history_index.category(record.message_id) in HISTORY_FILTERS[self.history_filter]
+
+    def history_position(self, message_id):
+        # Position of a message in 'history_messages' (ids are consecutive)
+        return message_id - self.history_messages[0].message_id
+
+    def anchor_from_top(self, position):
+        # Returns the scroll anchor of a view starting with the message at 'position' (or None
+        # if the view would reach the newest message).
+        rows = self.history_height - 2
+        content_width = self.history_width - 2
+        shown = 0
+        while position < len(self.history_messages):
+            record = self.history_messages[position]
+            position += 1
+            if not self.shown_in_history(record):
+                continue
+            shown += len(self.message_rows(record, content_width))
+            if shown >= rows and position < len(self.history_messages):
+                return (record.message_id, shown - rows)
+        return None
 
-        self.history_cursor_y = 1  # Start cursor position for history pad
-        self.history_pad_offset = 0
+    def scroll_up(self, rows):
+        if not self.history_messages:
+            return
+        content_width = self.history_width - 2
+        if self.scroll_anchor is None:
+            position = len(self.history_messages)
+            hidden_rows = rows
+        else:
+            message_id, hidden_rows = self.scroll_anchor
+            position = self.history_position(message_id) + 1
+            hidden_rows += rows
+        # Walk back until the new bottom message is found
+        while position > 0:
+            record = self.history_messages[position - 1]
+            if self.shown_in_history(record):
+                message_rows = len(self.message_rows(record, content_width))
+                if hidden_rows < message_rows:
+                    self.scroll_anchor = (record.message_id, hidden_rows)
+                    return
+                hidden_rows -= message_rows
+            position -= 1
+        self.scroll_to_top()
 
-    def split_string_into_chunks(self, text, max_length=40):
-        words = text.split()
-        chunks = []
-        current_chunk = []
+    def scroll_down(self, rows):
+        if self.scroll_anchor is None:
+            return
+        content_width = self.history_width - 2
+        message_id, hidden_rows = self.scroll_anchor
+        hidden_rows -= rows
+        position = self.history_position(message_id) + 1
+        while hidden_rows < 0:
+            while position < len(self.history_messages) and not self.shown_in_history(self.history_messages[position]):
+                position += 1
+            if position >= len(self.history_messages):
+                self.scroll_anchor = None
+                return
+            record = self.history_messages[position]
+            message_id = record.message_id
+            hidden_rows += len(self.message_rows(record, content_width))
+            position += 1
+        self.scroll_anchor = (message_id, hidden_rows)
 
-        for word in words:
-            if len(word) > max_length:
-                # If a single word is longer than the max length, split it forcefully
-                for i in range(0, len(word), max_length):
-                    chunks.append(word[i:i+max_length])
+    def scroll_to_top(self):
+        self.scroll_anchor = self.anchor_from_top(0) if self.history_messages else None
+
+    def search_history(self, query):
+        # Incremental search: shows the newest match of the query.
+        self.search_query = query
+        first_id = self.history_messages[0].message_id if self.history_messages else 0
+        categories = None if self.history_filter == "all" else HISTORY_FILTERS[self.history_filter]
+        self.search_matches = self.history_index.search(query, categories, first_id)
+        self.show_match(self.search_matches[-1] if self.search_matches else None)
+
+    def show_match(self, message_id):
+        self.current_match = message_id
+        if message_id is not None and self.history_messages and message_id >= self.history_messages[0].message_id:
+            self.scroll_anchor = self.anchor_from_top(self.history_position(message_id))
+
+    def step_match(self, step):
+        # Moves to the next older (-1) or newer (+1) match
+        if not self.search_matches:
+            return
+        if self.current_match is None:
+            index = len(self.search_matches) - 1
+        else:
+            index = bisect_left(self.search_matches, self.current_match) + step
+        self.show_match(self.search_matches[min(max(index, 0), len(self.search_matches) - 1)])
+
+    def navigate_history(self, action, argument=None):
+        """
+        Scrolls or searches the history; called from the keyboard thread, applied with the
+        next frame.
+
+        Parameters:
+        - action: str, one of "page_up", "page_down", "top", "bottom", "search" (argument:
+          the query), "previous_match", "next_match", "end_search" (argument: whether to go
+          back to the newest messages) and "cycle_filter".
+        """
+        self.message_queue.put(HistoryCommand(action, argument))
+
+    def apply_history_command(self, command):
+        page = max(self.history_height - 3, 1)
+        action = command.action
+        if action == "page_up":
+            self.scroll_up(page)
+        elif action == "page_down":
+            self.scroll_down(page)
+        elif action == "top":
+            self.scroll_to_top()
+        elif action == "bottom":
+            self.scroll_anchor = None
+        elif action == "search":
+            self.search_history(command.argument or "")
+        elif action == "previous_match":
+            self.step_match(-1)
+        elif action == "next_match":
+            self.step_match(1)
+        elif action == "end_search":
+            self.search_query = None
+            self.search_matches = []
+            self.current_match = None
+            if command.argument:
+                self.scroll_anchor = None
+        elif action == "cycle_filter":
+            names = list(HISTORY_FILTERS)
+            self.history_filter = names[(names.index(self.history_filter) + 1) % len(names)]
+            # The anchor message may be hidden now, the view starts over at the newest messages
+            self.scroll_anchor = None
+            if self.search_query is not None:
+                self.search_history(self.search_query)
+        self.status_changed = True
+
+    def history_status(self):
+        # Scroll, filter and search state shown at the start of the status bar
+        parts = []
+        if self.search_query is not None:
+            if self.search_matches:
+                index = bisect_left(self.search_matches, self.current_match) + 1 if self.current_match is not None else 0
+                parts.append(f"Search: {index}/{len(self.search_matches)}")
             else:
-                # Check if adding the word would exceed the max length
-                if sum(len(w) for w in current_chunk) + len(current_chunk) + len(word) <= max_length:
-                    current_chunk.append(word)
-                else:
-                    # Add the current chunk to the list and start a new chunk
-                    chunks.append(' '.join(current_chunk))
-                    current_chunk = [word]
+                parts.append("Search: no matches")
+        if self.history_filter != "all":
+            parts.append(f"Filter: {self.history_filter}")
+        if self.scroll_anchor is not None:
+            parts.append("Scrolled (End: newest)")
+        return " | ".join(parts)
 
-        # Add the last chunk if there are any words left
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
+    def message_prefix(self, date, sender):
+        return f"[{date.strftime('%H:%M:%S')}] {sender}: "
 
-        return chunks
+    def draw_partial_message(self, date, sender, message):
+        # The in-progress message is shown below the history until it is replaced by the final
+        # message of the same sender.
+        if not message:
+            self.partial_sender = None
+            self.partial_text = ""
+            return
+        self.partial_date = date
+        self.partial_sender = sender
+        self.partial_text = message
+        self.partial_prefix = self.message_prefix(date, sender)
+
+    def apply_queue_item(self, item):
+        date, sender, message, partial = item
+        if partial:
+            self.draw_partial_message(date, sender, message)
+        elif message:
+            # The final message replaces the sender's in-progress message. Another
+            # participant's in-progress message stays below the new lines.
+            if sender == self.partial_sender:
+                self.draw_partial_message(date, sender, None)
+            if len(self.history_index) <= self.next_message_id:
+                # Not indexed in 'enqueue_message' (e.g., loaded history)
+                self.history_index.add(sender, message)
+            self.history_messages.append(ChatRecord.create(self.next_message_id, date, sender, message, self.blob_store))
+            self.next_message_id += 1
+            self.history_index.trim(self.history_messages[0].message_id)
+            if self.scroll_anchor is not None and self.scroll_anchor[0] < self.history_messages[0].message_id:
+                # The anchor message was dropped from the history
+                self.scroll_to_top()
 
     def run(self):
         self.running = True
+        # The first frame is drawn right away, without waiting for a message
+        self.message_queue.put(REDRAW)
 
         while self.running:
-            # If there are messages in the queue (format (datetime, sender, message)), add them to
-            # the chat history pad.
-            try:
-                date, sender, message = self.message_queue.get(timeout=1)
-                if message:
-                    lines = message.split('\n')
-                    for line in lines:
-                        chunks = self.split_string_into_chunks(line, 160)
-                        for chunk in chunks:
-                            self.history_pad.addstr(self.history_cursor_y, 1, f"[{date.strftime('%H:%M:%S')}] {sender}: {chunk}")
-                            self.history_cursor_y += 1
-                            if self.history_cursor_y >= self.history_height - 1:
-                                self.history_pad_offset += 1
-                        self.history_pad.refresh(self.history_pad_offset, 0, self.history_start_y + 1, self.history_start_x + 1, self.history_start_y + self.history_height - 2, self.history_start_x + self.history_width - 2)
-
-                    self.update_input("", self.last_input_text)
-            except queue.Empty:
-                continue
+            # Wait for the next message in the queue (format (datetime, sender, message, partial)),
+            # then wait for the next frame and collect everything that arrived in the meantime.
+            items = [self.message_queue.get()]
+            delay = self.last_frame_time + self.frame_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            while True:
+                try:
+                    items.append(self.message_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in items:
+                if item is None:
+                    self.running = False
+                    break
+                if isinstance(item, HistoryCommand):
+                    self.apply_history_command(item)
+                elif item != REDRAW:
+                    self.queue_slots.release()
+                    self.apply_queue_item(item)
+            if not self.running:
+                break
+
+            frame_start = time.monotonic()
+            input_rows = min(len(self.input_state[0]), self.max_input_rows)
+            if self.stdscr.getmaxyx() != (self.height, self.width) or input_rows != self.input_rows:
+                self.input_rows = input_rows
+                self.layout_windows()
+            self.draw_history()
+            self.draw_status()
+            self.draw_input(self.take_input_state())
+            self.update_screen()
+            self.first_frame.set()
+            self.last_frame_time = time.monotonic()
+            if self.metrics is not None:
+                self.metrics.record_span("render", "render", frame_start, self.last_frame_time - frame_start, args={"items": len(items)})
     
     def quit(self):
         self.running = False
+        self.closed = True
+        self.message_queue.put(None)  # Wake up the frontend loop
     
+    def load_history(self, messages):
+        # Fills the history with (datetime, sender, message) tuples, e.g., from a resumed session.
+        # Must be called before 'run'.
+        for date, sender, message in messages:
+            self.apply_queue_item((date, sender, message, False))
+        self.message_queue.put(REDRAW)
+
+    def resize(self):
+        # Called when the terminal size changed. The next frame lays out the windows again.
+        self.message_queue.put(REDRAW)
+
     def enqueue_message(self, date, sender, message):
-        self.message_queue.put((date, sender, message))
+        # Messages are indexed right away, so the frontend thread only has to add them to the
+        # history. Several threads enqueue messages (the message bus, the app, a daemon
+        # connection); indexing and queueing happen under one lock, so the messages are queued
+        # in the order of their numbers in the index, which the history numbers them by.
+        if not self._reserve_queue_slot():
+            return
+        with self.enqueue_lock:
+            if message:
+                self.history_index.add(sender, message)
+            self.message_queue.put((date, sender, message, False))
+
+    def update_partial_message(self, date, sender, message):
+        # Shows the text a participant has produced so far. Passing an empty message removes
+        # the in-progress message again.
+        if self._reserve_queue_slot():
+            self.message_queue.put((date, sender, message, True))
+
+    def _reserve_queue_slot(self):
+        # Waits until fewer than 'max_queued_messages' messages are queued. Returns False if
+        # the frontend quit in the meantime.
+        while not self.queue_slots.acquire(timeout=0.1):
+            if self.closed:
+                return False
+        return True
     
-    def update_input(self, label, text):
-        self.last_input_text = text
-        self.input_win.clear()
-        self.input_win.border()
-        self.input_win.move(1, 2)
-        self.input_win.addstr(f"> {text}")
-        self.input_win.refresh()
+    def update_input(self, label, text, cursor=None):
+        # Called from the keyboard thread: only stores the new state, drawing happens in the
+        # frontend thread. 'cursor' is a (row, column) position in the text, by default its end.
+        lines = tuple(text.split("\n"))
+        if cursor is None:
+            cursor = (len(lines) - 1, len(lines[-1]))
+        with self.input_lock:
+            self.input_state = (lines, cursor)
+            self.input_changed = True
+        self.message_queue.put(REDRAW)
+
+    def update_status(self, text):
+        # Sets the text of the status bar; it is drawn with the next frame.
+        self.status_text = text
+        self.status_changed = True
+        self.message_queue.put(REDRAW)
+
+    def draw_status(self):
+        if self.status_win is None or not self.status_changed:
+            return
+        self.status_changed = False
+        # The last cell is left empty, curses fails to write the bottom right cell of a window
+        content_width = self.width - 1
+        history_status = self.history_status()
+        status_text = f"{history_status} | {self.status_text}" if history_status and self.status_text else history_status or self.status_text
+        text = clip_to_width(" " + status_text, content_width)
+        self.status_win.addstr(0, 0, text + " " * (content_width - text_width(text)), curses.A_REVERSE)
+        self.status_win.noutrefresh()
+
+    def take_input_state(self):
+        # Returns the input state to draw, or None if it was drawn already.
+        with self.input_lock:
+            if not self.input_changed:
+                return None
+            self.input_changed = False
+            return self.input_state
+
+    def draw_input(self, input_state):
+        if input_state is None:
+            return
+        lines, (cursor_row, cursor_col) = input_state
+
+        # Show the rows around the cursor and scroll the cursor row horizontally
+        content_width = self.input_width - 5
+        first_row = max(min(cursor_row - self.input_rows + 1, len(lines) - self.input_rows), 0)
+        self.input_scroll = scroll_start(lines[cursor_row], cursor_col, content_width, self.input_scroll)
+        rows = []
+        for row in range(first_row, first_row + self.input_rows):
+            if row >= len(lines):
+                rows.append(" " * (content_width + 2))
+                continue
+            prompt = "> " if row == 0 else "  "
+            start = self.input_scroll if row == cursor_row else 0
+            visible = clip_to_width(lines[row][start:], content_width)
+            rows.append(prompt + visible + " " * (content_width - text_width(visible)))
+
+        # Redraw only the part of each row that differs from what was drawn before
+        for y, row in enumerate(rows):
+            drawn = self.drawn_input_rows[y] if y < len(self.drawn_input_rows) else None
+            if row == drawn:
+                continue
+            common = 0
+            if drawn is not None:
+                limit = min(len(row), len(drawn))
+                while common < limit and row[common] == drawn[common]:
+                    common += 1
+            self.input_win.addstr(y + 1, 2 + text_width(row[:common]), row[common:])
+        self.drawn_input_rows = rows
+
+        cursor_x = 4 + text_width(lines[cursor_row][self.input_scroll:cursor_col])
+        self.input_win.move(1 + cursor_row - first_row, cursor_x)
+        self.input_win.noutrefresh()
@@ -0,0 +1,59 @@
+import threading
+
+# Process-wide pool of model API clients. Participants using the same API key and base URL
+# share one OpenAI client and with it one HTTP connection pool, so several agents reuse the
+# same keep-alive connections instead of each paying for its own TCP and TLS handshakes. The
+# transport speaks HTTP/2 (many requests multiplexed over one connection) when the optional
+# 'h2' package is installed, HTTP/1.1 with keep-alive otherwise.
+class ClientPool(object):
+    def __init__(self, max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0, timeout=600.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def _create_client(self, api_key, base_url):
+        from openai import OpenAI
+        import httpx
+        try:
+            import h2  # noqa: F401 (only checks that HTTP/2 support is available)
+            http2 = True
+        except ImportError:
+            http2 = False
+        http_client = httpx.Client(
+            http2=http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    def get(self, api_key, base_url=None):
+        """
+        Returns the shared client for an API key and base URL, creating it on first use.
+        """
+        key = (api_key, base_url)
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self._create_client(api_key, base_url)
+                self.clients[key] = client
+            return client
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
+
+
+# The pool used by default
+shared_pool = ClientPool()
+
+def shared_client(api_key, base_url=None):
+    return shared_pool.get(api_key, base_url)
@@ -0,0 +1,142 @@
+from blob_store import shared_store
+from message_records import ContextRecord
+
+# Conversation context. This class holds the messages that are sent to the model with each
+# request and keeps them within a token budget. Every entry caches an approximate token
+# count, so the total is known without re-measuring the whole history on each request.
+# Before a request, 'fit' applies the following policy until the context fits the budget:
+#   1. Tool outputs older than the 'keep_recent_turns' most recent user turns are elided.
+#   2. The oldest messages after the system prompt are dropped. If a summarizer is given,
+#      the dropped messages are folded into a rolling summary that is kept right after the
+#      system prompt.
+#   3. As a last resort, tool outputs in the recent turns are elided as well, except for the
+#      results of the latest tool calls, which the model has not seen yet.
+# An assistant message with tool calls and the tool results answering it are always kept or
+# dropped together, so the context never contains a tool result without its tool call.
+# Messages are kept as compact ContextRecords, with long contents in a BlobStore; 'messages'
+# builds the message dicts of the API payload.
+class ConversationContext(object):
+    def __init__(self, system_prompt, token_budget=64000, keep_recent_turns=4, elided_output_length=200, summarizer=None, blob_store=shared_store):
+        self.blob_store = blob_store
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.elided_output_length = elided_output_length
+        self.summarizer = summarizer
+        self.summary = None
+
+        # ContextRecords, each with its token count
+        self.entries = []
+        self.total_tokens = 0
+        self.append({"role": "system", "content": system_prompt})
+
+    @staticmethod
+    def count_tokens(message):
+        # Rough estimate of about four characters per token plus a small per-message overhead.
+        characters = len(message.get("content") or "")
+        for tool_call in message.get("tool_calls") or []:
+            characters += len(tool_call["function"]["name"]) + len(tool_call["function"]["arguments"])
+        return characters // 4 + 4
+
+    @property
+    def messages(self):
+        return [entry.to_dict(self.blob_store) for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _record(self, message):
+        return ContextRecord.from_dict(message, self.count_tokens(message), self.blob_store)
+
+    def append(self, message):
+        entry = self._record(message)
+        self.entries.append(entry)
+        self.total_tokens += entry.token_count
+
+    def _first_free_index(self):
+        # The system prompt and the rolling summary are never elided or dropped.
+        return 2 if self.summary is not None else 1
+
+    def _recent_turns_index(self):
+        # Index of the first message belonging to the protected recent user turns.
+        user_turns_seen = 0
+        for index in range(len(self.entries) - 1, self._first_free_index() - 1, -1):
+            if self.entries[index].role == "user":
+                user_turns_seen += 1
+                if user_turns_seen == self.keep_recent_turns:
+                    return index
+        return self._first_free_index()
+
+    def _group_end(self, index):
+        # A group is a message together with the tool results that directly follow it.
+        end = index + 1
+        while end < len(self.entries) and self.entries[end].role == "tool":
+            end += 1
+        return end
+
+    def _set_entry(self, index, message):
+        entry = self._record(message)
+        self.total_tokens += entry.token_count - self.entries[index].token_count
+        self.entries[index] = entry
+
+    def _elide_tool_outputs(self, end_index):
+        for index in range(self._first_free_index(), end_index):
+            if self.total_tokens <= self.token_budget:
+                return
+            entry = self.entries[index]
+            content = entry.content or ""
+            if entry.role != "tool" or len(content) <= self.elided_output_length:
+                continue
+            elided = self.blob_store.prefix(content, self.elided_output_length)
+            message = entry.to_dict(self.blob_store)
+            self._set_entry(index, dict(message, content=f"{elided}\n[Output elided, {len(content) - len(elided)} more characters]"))
+
+    def _drop_oldest(self, end_index):
+        start = self._first_free_index()
+        stop = start
+        dropped_tokens = 0
+        while stop < end_index and self.total_tokens - dropped_tokens > self.token_budget:
+            group_end = self._group_end(stop)
+            if group_end > end_index:
+                break
+            dropped_tokens += sum(entry.token_count for entry in self.entries[stop:group_end])
+            stop = group_end
+        # Drop the rest of a partially dropped turn, so the kept context starts with a user message.
+        while start < stop < end_index and self.entries[stop].role != "user":
+            dropped_tokens += self.entries[stop].token_count
+            stop += 1
+        if stop == start:
+            return
+
+        dropped = [entry.to_dict(self.blob_store) for entry in self.entries[start:stop]]
+        del self.entries[start:stop]
+        self.total_tokens -= dropped_tokens
+
+        if self.summarizer:
+            summary_text = self.summarizer(dropped, self.summary)
+            summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary_text}"}
+            if self.summary is None:
+                entry = self._record(summary_message)
+                self.entries.insert(1, entry)
+                self.total_tokens += entry.token_count
+            else:
+                self._set_entry(1, summary_message)
+            self.summary = summary_text
+
+    def fit(self):
+        """
+        Applies the context policy until the messages fit the token budget (or nothing else
+        can be removed without touching the system prompt and the most recent turns).
+
+        Returns:
+        - int: The approximate number of tokens in the context afterwards.
+        """
+        if self.total_tokens > self.token_budget:
+            self._elide_tool_outputs(self._recent_turns_index())
+        if self.total_tokens > self.token_budget:
+            self._drop_oldest(self._recent_turns_index())
+        if self.total_tokens > self.token_budget:
+            last_group_index = len(self.entries) - 1
+            while last_group_index > 0 and self.entries[last_group_index].role == "tool":
+                last_group_index -= 1
+            self._elide_tool_outputs(last_group_index)
+        return self.total_tokens
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import json
+import threading
+import time
+
+# Fake model backend. This class exposes the 'chat.completions.create' interface used by
+# GptParticipant and answers without network access: a request for a new user message is
+# answered with 'tool_calls' calls of 'tool_name' (if any), a request carrying the tool results
+# with the text 'reply'. Responses can be streamed in chunks of 'chunk_size' characters.
+# 'latency' is the delay before the response (or its first chunk), 'chunk_delay' the delay
+# between chunks. The reported token usage is estimated from the text lengths. Used by
+# benchmarks and to run the app offline.
+class FakeModelClient(object):
+    def __init__(self, reply="Done.", tool_calls=0, tool_name="list_folder", tool_arguments=None, latency=0.0, chunk_delay=0.0, chunk_size=16):
+        self.reply = reply
+        self.tool_calls = tool_calls
+        self.tool_name = tool_name
+        self.tool_arguments = tool_arguments if tool_arguments is not None else {"relative_folder": "."}
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _response_message(self, messages):
+        # Returns (content, tool calls) for a request.
+        if self.tool_calls and messages and messages[-1].get("role") == "user":
+            calls = []
+            for index in range(self.tool_calls):
+                calls.append({
+                    "id": f"call_{self.requests}_{index}",
+                    "type": "function",
+                    "function": {"name": self.tool_name, "arguments": json.dumps(self.tool_arguments)},
+                })
+            return None, calls
+        return self.reply, []
+
+    def _usage(self, messages, content, calls):
+        prompt_tokens = sum(len(json.dumps(message)) // 4 for message in messages)
+        completion_tokens = len(content or "") // 4 + sum(len(json.dumps(call)) // 4 for call in calls)
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+
+    def _create(self, model=None, messages=(), tools=None, stream=False, stream_options=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+            content, calls = self._response_message(messages)
+        usage = self._usage(messages, content, calls)
+        if self.latency:
+            time.sleep(self.latency)
+        if not stream:
+            message = SimpleNamespace(
+                role="assistant",
+                content=content,
+                tool_calls=[SimpleNamespace(id=call["id"], type="function", function=SimpleNamespace(**call["function"])) for call in calls] or None,
+            )
+            return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="tool_calls" if calls else "stop")], usage=usage)
+        return self._stream(content, calls, usage if (stream_options or {}).get("include_usage") else None)
+
+    def _stream(self, content, calls, usage):
+        text = content or ""
+        for start in range(0, len(text), self.chunk_size):
+            if start and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield self._chunk(SimpleNamespace(content=text[start:start + self.chunk_size], tool_calls=None))
+        for index, call in enumerate(calls):
+            fragment = SimpleNamespace(index=index, id=call["id"], type="function", function=SimpleNamespace(**call["function"]))
+            yield self._chunk(SimpleNamespace(content=None, tool_calls=[fragment]))
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+    def _chunk(self, delta):
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)], usage=None)
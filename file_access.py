@@ -0,0 +1,194 @@
+import mmap
+import os
+import tempfile
+
+# Helpers for ranged access to files of any size. Files are mapped into memory with mmap
+# instead of being read as a whole, and only the requested part is decoded. Edits are
+# streamed into a temporary file next to the original, which then replaces it, so an edit
+# never needs the whole file in memory either.
+
+CHUNK_SIZE = 1 << 20
+
+class _MappedFile(object):
+    # Context manager mapping a file read-only; empty files yield an empty bytes object,
+    # since they cannot be mapped.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'rb')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            return b""
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def __exit__(self, *exc):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+def count_newlines(data, start=0, end=None):
+    """
+    Counts the newlines in data[start:end] in chunks, so large mapped files are never copied
+    as a whole.
+    """
+    end = len(data) if end is None else end
+    newlines = 0
+    for chunk_start in range(start, end, CHUNK_SIZE):
+        newlines += data[chunk_start:min(chunk_start + CHUNK_SIZE, end)].count(b"\n")
+    return newlines
+
+def count_lines(data, start=0):
+    """
+    Counts the lines from 'start' to the end of the data. A last line without a trailing
+    newline counts as a line.
+    """
+    if start >= len(data):
+        return 0
+    lines = count_newlines(data, start)
+    if data[-1:] != b"\n":
+        lines += 1
+    return lines
+
+def line_offset(data, line_number):
+    """
+    Returns the byte offset at which the given line (1-based) starts, or the length of the
+    data if it has fewer lines.
+    """
+    remaining = line_number - 1
+    position = 0
+    while remaining > 0 and position < len(data):
+        chunk = data[position:position + CHUNK_SIZE]
+        newlines = chunk.count(b"\n")
+        if newlines < remaining:
+            remaining -= newlines
+            position += len(chunk)
+            continue
+        while remaining > 0:
+            position = data.find(b"\n", position) + 1
+            remaining -= 1
+    return min(position, len(data))
+
+def read_range(path, display_path, offset=None, length=None, start_line=None, max_lines=500, max_bytes=65536):
+    """
+    Reads a part of a file.
+
+    Parameters:
+    - path: Path, the file to read.
+    - display_path: str, the path shown to the model in the header.
+    - offset, length: int, a byte range to read. Takes precedence over line based reading.
+    - start_line: int, the first line to read (1-based) when reading lines.
+    - max_lines: int, the maximum number of lines to read.
+    - max_bytes: int, the maximum number of bytes to return in any case.
+
+    Returns:
+    - str: A header with the file size and the returned range, the content, and a marker
+      telling how much of the file follows if the content was truncated.
+    """
+    with _MappedFile(path) as data:
+        size = len(data)
+        if offset is not None or length is not None:
+            start = min(max(offset or 0, 0), size)
+            end = min(start + (length if length is not None else max_bytes), start + max_bytes, size)
+            content = data[start:end].decode('utf-8', errors='replace')
+            header = f'[File "{display_path}": {size} bytes, showing bytes {start}-{end}]'
+            remaining = size - end
+            footer = f'[Truncated, {remaining} more bytes]' if remaining else ""
+        else:
+            first_line = max(start_line or 1, 1)
+            start = line_offset(data, first_line)
+            end = start
+            lines_read = 0
+            while end < size and lines_read < max_lines and end - start < max_bytes:
+                newline = data.find(b"\n", end, min(start + max_bytes, size))
+                end = newline + 1 if newline != -1 else min(start + max_bytes, size)
+                lines_read += 1
+            content = data[start:end].decode('utf-8', errors='replace')
+            if lines_read:
+                header = f'[File "{display_path}": {size} bytes, showing lines {first_line}-{first_line + lines_read - 1}]'
+            else:
+                header = f'[File "{display_path}": {size} bytes, no lines from line {first_line} on]'
+            remaining = count_lines(data, end)
+            footer = f'[Truncated, {remaining} more lines]' if remaining else ""
+
+    if footer:
+        if not content.endswith("\n"):
+            content += "\n"
+        return f"{header}\n{content}{footer}"
+    return f"{header}\n{content}"
+
+def _rewrite(path, start, end, replacement):
+    # Writes the file with the byte range [start, end) replaced, streaming the unchanged parts
+    # into a temporary file that atomically replaces the original.
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = os.stat(path).st_mode
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".interbud-edit-")
+    try:
+        with os.fdopen(handle, 'wb') as output, _MappedFile(path) as data:
+            for chunk_start in range(0, start, CHUNK_SIZE):
+                output.write(data[chunk_start:min(chunk_start + CHUNK_SIZE, start)])
+            output.write(replacement)
+            for chunk_start in range(end, len(data), CHUNK_SIZE):
+                output.write(data[chunk_start:chunk_start + CHUNK_SIZE])
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def edit_lines(path, start_line, end_line, new_text):
+    """
+    Replaces the lines start_line to end_line (1-based, inclusive) with new_text. An end_line
+    of start_line - 1 inserts the text before start_line without removing anything. An end_line
+    past the end of the file replaces the lines up to the end; a start_line of the number of
+    lines + 1 appends to the file.
+
+    Returns:
+    - str: A short description of the edit, with the lines actually replaced.
+    """
+    if start_line < 1 or end_line < start_line - 1:
+        raise ValueError(f"Invalid line range {start_line}-{end_line}")
+    replacement = new_text.encode('utf-8')
+    with _MappedFile(path) as data:
+        size = len(data)
+        total_lines = count_lines(data)
+        if start_line > total_lines + 1:
+            raise ValueError(f"The file has only {total_lines} lines")
+        end_line = min(end_line, total_lines)
+        start = line_offset(data, start_line)
+        end = line_offset(data, end_line + 1)
+        unterminated = size > 0 and data[size - 1:size] != b"\n"
+    if replacement and start == size and unterminated:
+        # Appending after a last line without a line terminator
+        replacement = b"\n" + replacement
+    if replacement and not replacement.endswith(b"\n") and end < size:
+        replacement += b"\n"
+    _rewrite(path, start, end, replacement)
+    new_lines = len(new_text.splitlines())
+    if start_line > total_lines:
+        return f"Appended {new_lines} lines after line {total_lines}."
+    if end_line < start_line:
+        return f"Inserted {new_lines} lines before line {start_line}."
+    return f"Replaced lines {start_line}-{end_line} ({end_line - start_line + 1} lines) with {new_lines} lines."
+
+def replace_text(path, old_text, new_text):
+    """
+    Replaces the single occurrence of old_text in a file with new_text.
+
+    Returns:
+    - str: A short description of the edit.
+    """
+    needle = old_text.encode('utf-8')
+    if not needle:
+        raise ValueError("The text to replace must not be empty")
+    with _MappedFile(path) as data:
+        start = data.find(needle)
+        if start == -1:
+            raise ValueError("The text to replace was not found")
+        if data.find(needle, start + 1) != -1:
+            raise ValueError("The text to replace occurs more than once, include more context")
+        line = count_newlines(data, 0, start) + 1
+    _rewrite(path, start, start + len(needle), new_text.encode('utf-8'))
+    return f"Replaced the text at line {line}."
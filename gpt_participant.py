@@ -1,66 +1,466 @@
-from openai import OpenAI
+from client_pool import shared_client
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, wait
 
 import queue
 import threading
 from datetime import datetime
 from participant_interface import ChatParticipantInterface
+from participant_registry import SCHEDULING_MODES
+from tool_executor import ToolExecutor
+from conversation_context import ConversationContext
+from metrics import Metrics
+from rate_limiter import RateLimiter, backoff_delay, is_transient_error
+from file_access import edit_lines, read_range, replace_text
+from shell_sessions import ShellSessionPool
+from workspace_index import WorkspaceIndex
 from pathlib import Path
 import json
-import subprocess
+import re
+import time
+
+# Function tools offered to the model. The names map to methods of GptParticipant.
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "list_folder",
+            "description": "Get a JSON object containing the folders and files inside a path relative to the base folder.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_folder": {
+                        "type": "string",
+                        "description": "The folder to list, relative to the base folder.",
+                    },
+                },
+                "required": ["relative_folder"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_files",
+            "description": "Find files below a folder relative to the base folder in one call, by glob pattern and optional size and modification time filters. Returns a JSON object with the matching files (path, size, modified) and the total number of matches.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "pattern": {
+                        "type": "string",
+                        "description": "Glob matched against file names (e.g. '*.py'), or against relative paths if it contains a '/'.",
+                    },
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The folder to search in, relative to the base folder. Defaults to the base folder.",
+                    },
+                    "recursive": {
+                        "type": "boolean",
+                        "description": "Whether to include subfolders. Defaults to true.",
+                    },
+                    "min_size": {
+                        "type": "integer",
+                        "description": "Minimum file size in bytes.",
+                    },
+                    "max_size": {
+                        "type": "integer",
+                        "description": "Maximum file size in bytes.",
+                    },
+                    "modified_after": {
+                        "type": "string",
+                        "description": "Only files modified after this ISO 8601 timestamp.",
+                    },
+                    "modified_before": {
+                        "type": "string",
+                        "description": "Only files modified before this ISO 8601 timestamp.",
+                    },
+                },
+                "required": ["pattern"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_text",
+            "description": "Search the contents of all text files below a folder relative to the base folder for a regular expression. Returns matching lines as 'path:line: text' with optional context lines.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "pattern": {
+                        "type": "string",
+                        "description": "The regular expression (Python syntax) to search for.",
+                    },
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The folder or file to search in, relative to the base folder. Defaults to the base folder.",
+                    },
+                    "glob": {
+                        "type": "string",
+                        "description": "Only search files whose names match this glob, e.g. '*.py'.",
+                    },
+                    "ignore_case": {
+                        "type": "boolean",
+                        "description": "Whether to match case-insensitively.",
+                    },
+                    "max_matches": {
+                        "type": "integer",
+                        "description": "The maximum number of matching lines to return. Defaults to 100.",
+                    },
+                    "context_lines": {
+                        "type": "integer",
+                        "description": "The number of lines to show before and after each match. Defaults to 0.",
+                    },
+                },
+                "required": ["pattern"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": "Get the contents of a file at a path relative to the base folder. Returns a header with the file size and the range shown, and a marker with the number of remaining lines or bytes if the output is truncated. Read large files in parts using start_line or offset.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The file to read, relative to the base folder.",
+                    },
+                    "start_line": {
+                        "type": "integer",
+                        "description": "The first line to read (1-based). Defaults to 1.",
+                    },
+                    "max_lines": {
+                        "type": "integer",
+                        "description": "The maximum number of lines to read. Defaults to 500.",
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Read bytes starting at this byte offset instead of lines.",
+                    },
+                    "length": {
+                        "type": "integer",
+                        "description": "The number of bytes to read when reading bytes.",
+                    },
+                },
+                "required": ["relative_path"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "edit_range",
+            "description": "Replace a range of lines in a file at a path relative to the base folder with new text, without resending the rest of the file. Use end_line = start_line - 1 to insert before start_line.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The file to edit, relative to the base folder.",
+                    },
+                    "start_line": {
+                        "type": "integer",
+                        "description": "The first line to replace (1-based).",
+                    },
+                    "end_line": {
+                        "type": "integer",
+                        "description": "The last line to replace (inclusive).",
+                    },
+                    "new_text": {
+                        "type": "string",
+                        "description": "The text replacing the lines. May be empty to delete them.",
+                    },
+                },
+                "required": ["relative_path", "start_line", "end_line", "new_text"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "apply_patch",
+            "description": "Replace a snippet of text in a file at a path relative to the base folder. The snippet must occur exactly once in the file.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The file to edit, relative to the base folder.",
+                    },
+                    "old_text": {
+                        "type": "string",
+                        "description": "The exact text to replace, including enough context to be unique.",
+                    },
+                    "new_text": {
+                        "type": "string",
+                        "description": "The text to put in its place.",
+                    },
+                },
+                "required": ["relative_path", "old_text", "new_text"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_file",
+            "description": "Write contents to a file at a path relative to the base folder",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The file to write, relative to the base folder.",
+                    },
+                    "contents": {
+                        "type": "string",
+                        "description": "The contents to write to the file.",
+                    },
+                },
+                "required": ["relative_path", "contents"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_directory",
+            "description": "Create a directory at a path relative to the base folder.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The directory to create, relative to the base folder.",
+                    },
+                },
+                "required": ["relative_path"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "run_command",
+            "description": "Run a Ubuntu Linux shell command in the folder given relative to the base folder. Commands for the same folder share one bash session, so the environment and 'cd' carry over. Commands are killed after a timeout, and long output is shortened to its beginning and end.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "command": {
+                        "type": "string",
+                        "description": "The command to execute.",
+                    },
+                    "relative_path": {
+                        "type": "string",
+                        "description": "The folder to run the command in, relative to the base folder.",
+                    },
+                },
+                "required": ["command", "relative_path"],
+            },
+        },
+    }
+]
+
+# Tools that may change files below the base folder; the workspace index is refreshed after them.
+WORKSPACE_CHANGING_TOOLS = ("write_file", "create_directory", "edit_range", "apply_patch", "run_command")
+
+# System prompt of participants that are not given one
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. You have access to a Ubuntu Linux system, can run shell commands and interact with the file system. You assist the user in any way they require help."
+
+# Raised inside a turn when it was cancelled
+class TurnCancelled(Exception):
+    pass
 
 class GptParticipant(ChatParticipantInterface):
-    def __init__(self, label, api_key, model="gpt-4o-mini", base_file_folder=Path("gpt_managed_files/")):
-        super(GptParticipant, self).__init__(label)
+    default_system_prompt = DEFAULT_SYSTEM_PROMPT
 
-        # Ensure the base file folder exists
-        base_file_folder.mkdir(parents=True, exist_ok=True)
+    def __init__(self, label, api_key, model="gpt-4o-mini", base_file_folder=Path("gpt_managed_files/"), stream=True, partial_update_interval=0.05, max_tool_workers=4, tool_concurrency_limits=None, context_token_budget=64000, summarize_context=False, command_timeout=120, command_output_limit=65536, session_log=None, client=None, metrics=None, scheduling="coalesce", rate_limiter=None, max_steps=25, turn_token_budget=None, max_retries=4, completion_token_estimate=1000, system_prompt=None, label_senders=False, base_url=None, max_queued_messages=64):
+        super(GptParticipant, self).__init__(label)
+        if scheduling not in SCHEDULING_MODES:
+            raise ValueError(f"Unknown scheduling mode: {scheduling}")
 
-        self.client = OpenAI(api_key=api_key)
+        # A client can be passed in, e.g., to record or replay the model API (see cassette.py).
+        # Otherwise the participant uses the client (and connection pool) shared by all
+        # participants with the same API key. It is created on first use, as importing the
+        # SDK and setting up the client takes a while (see 'prepare').
+        self._client = client
+        self.base_url = base_url
+        self.prepared = False
+        self.restored = False
+        self.prepare_lock = threading.Lock()
         self.api_key = api_key
         self.model = model
+        self.stream = stream
+        self.partial_update_interval = partial_update_interval
         self.running = False
-        self.message_queue = queue.Queue()
+        self.closed = False
+        # 'send_message' blocks while 'max_queued_messages' messages wait for a turn, so a busy
+        # participant holds up the message bus delivery to it, where the inbox' overflow policy
+        # applies, instead of queueing without limit.
+        self.message_queue = queue.Queue(maxsize=max_queued_messages)
+        self.scheduling = scheduling
+        self.label_senders = label_senders
+
+        # The turn in progress can be cancelled by completing this future (see 'cancel'). API
+        # requests run on helper threads, so a cancelled turn does not wait for them; the stream
+        # of a cancelled request is closed.
+        self.cancel_signal = Future()
+        self.active_stream = None
+
+        # Limits of the tool loop, retries of failed requests, and the rate limiter, which may be
+        # shared with other participants using the same API quota. The tokens of a request are
+        # estimated from the context and 'completion_token_estimate' until its usage is known.
+        self.max_steps = max_steps
+        self.turn_token_budget = turn_token_budget
+        self.max_retries = max_retries
+        self.completion_token_estimate = completion_token_estimate
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.turn_tokens = 0
+        self.pending_token_estimate = 0
+
+        # Spans and token counters; 'turn' collects the measurements of the turn in progress
+        self.metrics = metrics or Metrics()
+        self.turn = None
 
-        self.messages = [{"role": "system", "content": "You are a helpful assistant. You have access to a Ubuntu Linux system, can run shell commands and interact with the file system. You assist the user in any way they require help."}]
+        # Messages sent to the model, kept within the token budget before each request
+        self.context = ConversationContext(
+            system_prompt or DEFAULT_SYSTEM_PROMPT,
+            token_budget=context_token_budget,
+            summarizer=self._summarize_messages if summarize_context else None,
+        )
+
+        # Every message added to the context is also appended to the session log (if any),
+        # from which the context of a resumed session is restored (see 'prepare').
+        self.session_log = session_log
 
         self.base_file_folder = base_file_folder
 
+        # Tool calls of one turn run concurrently, file system changes are serialized per path
+        self.tool_executor = ToolExecutor(max_workers=max_tool_workers, concurrency_limits=tool_concurrency_limits)
+
+        # Long-lived shell sessions for run_command, one per working directory
+        self.shell_pool = ShellSessionPool()
+        # Output of the commands running right now (command id -> [command line, output tail]),
+        # shown together as the in-progress message, one block per command. Updates are
+        # throttled to 'partial_update_interval'; a timer shows the output held back by the
+        # throttle.
+        self.running_commands = {}
+        self.running_commands_lock = threading.Lock()
+        self.running_commands_shown = 0.0
+        self.running_commands_timer = None
+        self.command_timeout = command_timeout
+        self.command_output_limit = command_output_limit
+
+        # Index of the files below the base folder for find_files and search_text
+        self.workspace_index = WorkspaceIndex(base_file_folder)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = shared_client(self.api_key, self.base_url)
+        return self._client
+
+    def prepare(self):
+        """
+        Does the setup that is not needed to show the app: creates the base file folder,
+        restores the context of a resumed session and creates the API client (importing the
+        SDK). The app calls it in the background once the first frame is drawn; otherwise the
+        first turn does. Calling it again does nothing once it succeeded; after an error (e.g.,
+        the client could not be created), it only retries the steps that failed.
+        """
+        with self.prepare_lock:
+            if self.prepared:
+                return
+            if not self.restored:
+                self.base_file_folder.mkdir(parents=True, exist_ok=True)
+                if self.session_log is not None and len(self.session_log):
+                    self._restore_context()
+                self.restored = True
+            self.client
+            self.prepared = True
+
     def run_command_in_directory(self, command, working_directory):
         """
-        Runs a command in a specified working directory and returns the output.
+        Runs a command in the shell session of a specified working directory and returns the output.
+        The output is shown as an in-progress message while the command runs.
 
         Parameters:
-        - command: list of str, the command and its arguments to run.
+        - command: str, the shell command line to run.
         - working_directory: str or Path, the directory in which to run the command.
 
         Returns:
-        - str: The standard output from the command.
+        - str: The combined standard output and error of the command (head and tail only if it
+          exceeds the output limit), followed by the exit code if it is not zero.
         """
+        command_id = object()
+        with self.running_commands_lock:
+            self.running_commands[command_id] = [command, ""]
+
+        def show_output(text):
+            with self.running_commands_lock:
+                entry = self.running_commands[command_id]
+                entry[1] = (entry[1] + text)[-4000:]
+            self._show_running_commands()
+
         try:
-            process = subprocess.Popen(command, cwd=working_directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            stdout, stderr = process.communicate()
-
-            if process.returncode != 0:
-                raise subprocess.CalledProcessError(process.returncode, command, output=stdout, stderr=stderr)
-            
-            return stdout
-        except subprocess.CalledProcessError as e:
-            return f"Error: {e.stderr}"
+            exit_code, output = self.shell_pool.run(command, working_directory, timeout=self.command_timeout, output_limit=self.command_output_limit, output_callback=show_output)
         except Exception as e:
             return f"An error occurred: {e}"
+        finally:
+            # The command's block is removed right away; the message is cleared once no
+            # command is running anymore
+            with self.running_commands_lock:
+                del self.running_commands[command_id]
+            self._show_running_commands(force=True)
+
+        if exit_code:
+            return f"{output}\n[Exit code {exit_code}]"
+        return output
     
+    def _show_running_commands(self, force=False):
+        # Shows the output of the running commands, or clears the in-progress message if none
+        # is running. The message is updated under the lock, so a cleared message is never
+        # overwritten by an older update.
+        with self.running_commands_lock:
+            now = time.monotonic()
+            wait = self.running_commands_shown + self.partial_update_interval - now
+            if not force and wait > 0:
+                if self.running_commands_timer is None:
+                    self.running_commands_timer = threading.Timer(wait, self._flush_running_commands)
+                    self.running_commands_timer.daemon = True
+                    self.running_commands_timer.start()
+                return
+            self.running_commands_shown = now
+            commands = list(self.running_commands.values())
+            share = 4000 // max(len(commands), 1)
+            self._update_partial_message("\n".join(f"$ {command}\n{output[-share:]}".rstrip("\n") for command, output in commands))
+
+    def _flush_running_commands(self):
+        with self.running_commands_lock:
+            self.running_commands_timer = None
+            if not self.running_commands:
+                # Cleared when the last command returned; the message may show other text by now
+                return
+        self._show_running_commands(force=True)
+
     def run_command(self, command, relative_path):
         """
         Runs a command in the current working directory and returns the output.
 
         Parameters:
-        - command: list of str, the command and its arguments to run.
+        - command: str, the shell command line to run.
         - relative_path: str, the path relative to the base file folder to run the command in.
 
         Returns:
-        - str: The standard output from the command.
+        - str: The output from the command.
         """
-        return self.run_command_in_directory(command, self.base_file_folder / Path(relative_path))
+        working_directory = self.base_file_folder / Path(relative_path)
+        if not working_directory.is_dir():
+            return json.dumps({'status': 'error', 'message': f'Path "{relative_path}" is not a directory'})
+        return self.run_command_in_directory(command, working_directory)
 
     def list_folder(self, relative_folder):
         path = self.base_file_folder / Path(relative_folder)
@@ -79,7 +479,19 @@ class GptParticipant(ChatParticipantInterface):
 
         return json.dumps(contents)
 
-    def read_file(self, relative_path):
+    def find_files(self, pattern, relative_path=".", recursive=True, min_size=None, max_size=None, modified_after=None, modified_before=None):
+        try:
+            return json.dumps(self.workspace_index.find_files(pattern, relative_path, recursive, min_size, max_size, modified_after, modified_before))
+        except ValueError as e:
+            return json.dumps({'status': 'error', 'message': str(e)})
+
+    def search_text(self, pattern, relative_path=".", glob=None, ignore_case=False, max_matches=100, context_lines=0):
+        try:
+            return self.workspace_index.search_text(pattern, relative_path, glob, ignore_case, max_matches, context_lines)
+        except re.error as e:
+            return json.dumps({'status': 'error', 'message': f'Invalid regular expression: {e}'})
+
+    def read_file(self, relative_path, start_line=None, max_lines=500, offset=None, length=None):
         path = self.base_file_folder / Path(relative_path)
         if not path.exists():
             return json.dumps({'status': 'error', 'message': f'Path "{relative_path}" does not exist'})
@@ -87,7 +499,27 @@ class GptParticipant(ChatParticipantInterface):
         if path.is_dir():
             return json.dumps({'status': 'error', 'message': f'Path "{relative_path}" is not a file'})
 
-        return path.read_text()
+        return read_range(path, relative_path, offset=offset, length=length, start_line=start_line, max_lines=max_lines)
+
+    def edit_range(self, relative_path, start_line, end_line, new_text):
+        path = self.base_file_folder / Path(relative_path)
+        if not path.is_file():
+            return json.dumps({'status': 'error', 'message': f'Path "{relative_path}" is not a file'})
+
+        try:
+            return edit_lines(path, start_line, end_line, new_text)
+        except ValueError as e:
+            return json.dumps({'status': 'error', 'message': str(e)})
+
+    def apply_patch(self, relative_path, old_text, new_text):
+        path = self.base_file_folder / Path(relative_path)
+        if not path.is_file():
+            return json.dumps({'status': 'error', 'message': f'Path "{relative_path}" is not a file'})
+
+        try:
+            return replace_text(path, old_text, new_text)
+        except ValueError as e:
+            return json.dumps({'status': 'error', 'message': str(e)})
 
     def write_file(self, relative_path, contents):
         path = self.base_file_folder / Path(relative_path)
@@ -105,180 +537,458 @@ class GptParticipant(ChatParticipantInterface):
         return "Directory created."
 
     def send_message(self, send_datetime, sender, message):
-        self.message_queue.put((send_datetime, sender, message))
+        item = (send_datetime, sender, message, time.monotonic())
+        if self.scheduling == "supersede" and self.turn is not None:
+            self.cancel()
+        while not self.closed:
+            try:
+                self.message_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def cancel(self):
+        # Cancels the turn in progress: the API request is abandoned and running commands are
+        # killed. Messages that arrived in the meantime are answered in the next turn.
+        if self.turn is None:
+            return
+        try:
+            self.cancel_signal.set_result(True)
+        except InvalidStateError:
+            return
+        stream = self.active_stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+        self.shell_pool.interrupt()
+
+    def _check_cancelled(self):
+        if self.cancel_signal.done():
+            raise TurnCancelled()
+
+    def _create_completion(self, **request):
+        """
+        Sends a completion request and returns its result (a response or a stream).
+
+        Before every attempt the shared rate limiter is asked for capacity. Transient errors
+        (connection problems, 429 and server errors) are retried up to 'max_retries' times with
+        jittered exponential backoff; a 429 also pauses the rate limiter, so other participants
+        back off as well. The request runs on a helper thread and the wait ends when the turn is
+        cancelled; a cancelled request is left to finish in the background and its result (e.g.,
+        a stream) is discarded.
+        """
+        estimated_tokens = self.context.total_tokens + self.completion_token_estimate
+        for attempt in range(self.max_retries + 1):
+            if not self.rate_limiter.acquire(estimated_tokens, self.cancel_signal):
+                raise TurnCancelled()
+            self.pending_token_estimate = estimated_tokens
+            try:
+                return self._send_request(request)
+            except TurnCancelled:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    raise
+                delay = backoff_delay(attempt, error=e)
+                if getattr(e, "status_code", None) == 429:
+                    self.rate_limiter.pause(delay)
+                self.metrics.count("interbud_api_retries_total", participant=self.label)
+                wait([self.cancel_signal], timeout=delay)
+                self._check_cancelled()
+
+    def _send_request(self, request):
+        future = Future()
+
+        def request_thread():
+            try:
+                # The raw response gives access to the rate limit headers (if the client has it)
+                completions = self.client.chat.completions
+                raw_completions = getattr(completions, "with_raw_response", None)
+                if raw_completions is not None:
+                    raw_response = raw_completions.create(**request)
+                    self.rate_limiter.update_from_headers(raw_response.headers)
+                    future.set_result(raw_response.parse())
+                else:
+                    future.set_result(completions.create(**request))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=request_thread, name="api-request", daemon=True).start()
+        wait([future, self.cancel_signal], return_when=FIRST_COMPLETED)
+        if not future.done():
+            future.add_done_callback(lambda done: self._close_stream(done.result()) if request.get("stream") and not done.exception() else None)
+        self._check_cancelled()
+        return future.result()
+
+    def _close_stream(self, stream):
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+    def _record_usage(self, usage):
+        # Adds the usage reported for a request to the metrics, the turn's token count and the
+        # rate limiter. Without reported usage, the estimate made before the request counts.
+        tokens = self.pending_token_estimate
+        if usage is not None:
+            tokens = (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+            self.metrics.add_usage(self.turn, self.model, usage)
+            self.rate_limiter.record_usage(self.pending_token_estimate, tokens)
+        self.turn_tokens += tokens
+        self.pending_token_estimate = 0
 
     def _process_messages(self, messages):
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "list_folder",
-                    "description": "Get a JSON object containing the folders and files inside a path relative to the base folder.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "relative_folder": {
-                                "type": "string",
-                                "description": "The folder to list, relative to the base folder.",
-                            },
-                        },
-                        "required": ["relative_folder"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "read_file",
-                    "description": "Get a contents of a file at a path relative to the base folder.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "relative_path": {
-                                "type": "string",
-                                "description": "The file to read, relative to the base folder.",
-                            },
-                        },
-                        "required": ["relative_path"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "write_file",
-                    "description": "Write contents to a file at a path relative to the base folder",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "relative_path": {
-                                "type": "string",
-                                "description": "The file to write, relative to the base folder.",
-                            },
-                            "contents": {
-                                "type": "string",
-                                "description": "The contents to write to the file.",
-                            },
-                        },
-                        "required": ["relative_path", "contents"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_directory",
-                    "description": "Create a directory at a path relative to the base folder.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "relative_path": {
-                                "type": "string",
-                                "description": "The directory to create, relative to the base folder.",
-                            },
-                        },
-                        "required": ["relative_path"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "run_command",
-                    "description": "Run a Ubuntu Linux shell command in the folder given relative to the base folder.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "command": {
-                                "type": "string",
-                                "description": "The command to execute.",
-                            },
-                            "relative_path": {
-                                "type": "string",
-                                "description": "The folder to run the command in, relative to the base folder.",
-                            },
-                        },
-                        "required": ["command", "relative_path"],
-                    },
-                },
-            }
-        ]
+        """
+        Runs the tool loop of a turn and returns the reply text.
 
+        The loop is a state machine alternating between "request" (ask the model for the next
+        message, given the context) and "tools" (run the tool calls of that message and add their
+        results to the context) until the model answers without tool calls. Before every request
+        the step budget ('max_steps' requests per turn) and the token budget ('turn_token_budget'
+        tokens per turn) are checked; a turn exceeding them ends with a note. Errors end the turn
+        with a short error message.
+        """
+        self.turn_tokens = 0
+        state = "request"
+        steps = 0
+        response_message = None
         try:
+            self.prepare()
             for message in messages:
-                self.messages.append(message)
-            response = self.client.chat.completions.create(model=self.model, messages = self.messages, tools=tools)
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
-            self.messages.append(response_message)
-            if tool_calls:
-                available_functions = {
-                    "list_folder": self.list_folder,
-                    "read_file": self.read_file,
-                    "write_file": self.write_file,
-                    "create_directory": self.create_directory,
-                }
-                tool_call_results = []
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
-                    function_to_call = available_functions.get(function_name)
-                    function_args = json.loads(tool_call.function.arguments)
-                    if self.message_send_callback:
-                        self.message_send_callback(datetime.now(), self.label, f"Calling function {function_name} with arguments {function_args}")
-                    if function_name == "list_folder":
-                        function_response = function_to_call(
-                            relative_folder=function_args.get("relative_folder"),
-                        )
-                    elif function_name == "read_file":
-                        function_response = function_to_call(
-                            relative_path=function_args.get("relative_path"),
-                        )
-                    elif function_name == "write_file":
-                        function_response = function_to_call(
-                            relative_path=function_args.get("relative_path"),
-                            contents=function_args.get("contents"),
-                        )
-                    elif function_name == "create_directory":
-                        function_response = function_to_call(
-                            relative_path=function_args.get("relative_path"),
-                        )
-                    elif function_name == "run_command":
-                        function_response = self.run_command(
-                            command=function_args.get("command").split(),
-                            relative_path=function_args.get("relative_path"),
-                        )
-
-                    tool_call_results.append(
-                        {
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "name": function_name,
-                            "content": function_response,
-                        }
-                    )
-                
-                return self._process_messages(tool_call_results)
-            else:
-                return response_message.content
+                self._append_to_context(message)
+            while True:
+                self._check_cancelled()
+                if state == "request":
+                    if steps >= self.max_steps:
+                        return f"[Stopped: this turn reached its limit of {self.max_steps} model requests]"
+                    if self.turn_token_budget is not None and self.turn_tokens >= self.turn_token_budget:
+                        return f"[Stopped: this turn used {self.turn_tokens} tokens, its budget is {self.turn_token_budget}]"
+                    steps += 1
+                    response_message = self._request_completion(steps)
+                    self._append_to_context(response_message)
+                    if not response_message.get("tool_calls"):
+                        return response_message.get("content")
+                    state = "tools"
+                elif state == "tools":
+                    # Cancelled tool calls still get results, so every tool call in the context
+                    # is answered; the loop stops before the next request.
+                    for result in self._run_tool_calls(response_message):
+                        self._append_to_context(result)
+                    state = "request"
+        except TurnCancelled:
+            raise
         except Exception as e:
-            return f"Error: {e}" + str(self.messages)
+            return self._error_message(e)
+
+    def _error_message(self, error, max_length=500):
+        text = str(error)
+        if len(text) > max_length:
+            text = text[:max_length] + "..."
+        return f"Error: {type(error).__name__}: {text}"
+
+    def _request_completion(self, step):
+        """
+        Requests the next assistant message for the current context.
+
+        Returns:
+        - dict: The assistant message.
+        """
+        self.context.fit()
+        with self.metrics.span("API call", "api", self.turn, model=self.model, stream=self.stream, step=step) as span_args:
+            if self.stream:
+                return self._stream_completion(TOOLS, span_args)
+            response = self._create_completion(model=self.model, messages = self.context.messages, tools=TOOLS)
+            self._record_usage(getattr(response, "usage", None))
+            return self._message_to_dict(response.choices[0].message)
+
+    def _run_tool_calls(self, response_message):
+        """
+        Runs the tool calls of an assistant message.
+
+        Returns:
+        - list of dict: The tool result messages, one per tool call.
+        """
+        if response_message.get("content") and self.message_send_callback:
+            # Text the model produced alongside its tool calls becomes a regular message.
+            self.message_send_callback(datetime.now(), self.label, response_message["content"])
+        tool_calls = response_message["tool_calls"]
+        calls = []
+        for tool_call in tool_calls:
+            function_name = tool_call["function"]["name"]
+            try:
+                function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+            except ValueError as e:
+                calls.append((function_name, lambda error=e: f"Error: Invalid JSON arguments: {error}", {}, None))
+                continue
+            if self.message_send_callback:
+                self.message_send_callback(datetime.now(), self.label, f"Calling function {function_name} with arguments {function_args}")
+            calls.append(self._timed_tool_call(self._prepare_tool_call(function_name, function_args)))
+
+        function_responses = self.tool_executor.run(calls, self.cancel_signal)
+        if any(function_name in WORKSPACE_CHANGING_TOOLS for function_name, _, _, _ in calls):
+            self.workspace_index.mark_dirty()
+
+        tool_call_results = []
+        for tool_call, function_response in zip(tool_calls, function_responses):
+            tool_call_results.append(
+                {
+                    "tool_call_id": tool_call["id"],
+                    "role": "tool",
+                    "name": tool_call["function"]["name"],
+                    "content": function_response,
+                }
+            )
+        return tool_call_results
+
+    def _prepare_tool_call(self, function_name, function_args):
+        """
+        Resolves a tool call requested by the model into a call for the tool executor.
+
+        Returns:
+        - tuple: (function_name, function, kwargs, path) as expected by ToolExecutor.run.
+        """
+        available_functions = {
+            "list_folder": self.list_folder,
+            "find_files": self.find_files,
+            "search_text": self.search_text,
+            "read_file": self.read_file,
+            "edit_range": self.edit_range,
+            "apply_patch": self.apply_patch,
+            "write_file": self.write_file,
+            "create_directory": self.create_directory,
+            "run_command": self.run_command,
+        }
+        function_to_call = available_functions.get(function_name)
+        if function_to_call is None:
+            return (function_name, lambda: f"Error: Unknown function {function_name}", {}, None)
+
+        path = None
+        if "relative_path" in function_args:
+            path = (self.base_file_folder / Path(function_args["relative_path"])).resolve()
+        return (function_name, function_to_call, function_args, path)
+
+    def _timed_tool_call(self, call):
+        # Wraps the function of a tool call so its execution is recorded as a span of the turn.
+        function_name, function, kwargs, path = call
+        turn = self.turn
+        self.metrics.count("interbud_tool_calls_total", participant=self.label, tool=function_name)
+
+        def timed_function(**function_kwargs):
+            with self.metrics.span(function_name, "tool", turn):
+                return function(**function_kwargs)
+        return (function_name, timed_function, kwargs, path)
+
+    def _append_to_context(self, message):
+        self.context.append(message)
+        if self.session_log is not None:
+            self.session_log.append(message)
+
+    def _restore_context(self):
+        # Reads the logged messages from the newest backwards until the token budget is used up,
+        # then drops messages from the front until the restored context starts with a user
+        # message, so no tool result is restored without its tool call.
+        restored = []
+        tokens = self.context.total_tokens
+        for message in self.session_log.iter_reverse():
+            tokens += ConversationContext.count_tokens(message)
+            if tokens > self.context.token_budget:
+                break
+            restored.append(message)
+        restored.reverse()
+        while restored and restored[0].get("role") != "user":
+            restored.pop(0)
+        # The app may have stopped between an assistant message with tool calls and their
+        # results. The API rejects tool calls without results, so the missing ones are answered
+        # (and logged) as interrupted.
+        unanswered = {}
+        for message in restored:
+            if message.get("role") == "assistant" and message.get("tool_calls"):
+                unanswered = {tool_call["id"]: tool_call["function"]["name"] for tool_call in message["tool_calls"]}
+            elif message.get("role") == "tool":
+                unanswered.pop(message.get("tool_call_id"), None)
+        for message in restored:
+            self.context.append(message)
+        for tool_call_id, function_name in unanswered.items():
+            self._append_to_context({
+                "tool_call_id": tool_call_id,
+                "role": "tool",
+                "name": function_name,
+                "content": "Interrupted: the app stopped before the call finished.",
+            })
+
+    def _summarize_messages(self, messages, previous_summary):
+        """
+        Summarizes messages that are dropped from the conversation context.
+
+        Parameters:
+        - messages: list of dict, the messages to summarize, oldest first.
+        - previous_summary: str or None, the summary of even older messages.
+
+        Returns:
+        - str: A summary covering the previous summary and the given messages.
+        """
+        transcript = []
+        if previous_summary:
+            transcript.append(f"Earlier summary: {previous_summary}")
+        for message in messages:
+            if message.get("content"):
+                transcript.append(f"{message['role']}: {message['content']}")
+            for tool_call in message.get("tool_calls") or []:
+                transcript.append(f"{message['role']}: called {tool_call['function']['name']} with {tool_call['function']['arguments']}")
+
+        with self.metrics.span("summarize", "api", self.turn, model=self.model):
+            response = self._create_completion(model=self.model, messages=[
+                {"role": "system", "content": "Summarize the following conversation between a user, an assistant and its tools in a few sentences. Keep facts, file names and decisions that may matter later."},
+                {"role": "user", "content": "\n".join(transcript)},
+            ])
+        self._record_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    def _message_to_dict(self, message):
+        """
+        Converts an assistant message returned by the API into the plain dictionary format
+        used for the conversation history.
+        """
+        result = {"role": "assistant", "content": message.content}
+        if message.tool_calls:
+            result["tool_calls"] = [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+                }
+                for tool_call in message.tool_calls
+            ]
+        return result
+
+    def _stream_completion(self, tools, span_args=None):
+        """
+        Requests a streamed completion and assembles the deltas into an assistant message.
+
+        Content deltas are forwarded to the partial message callback as they arrive (the first
+        one immediately, later ones at most every 'partial_update_interval' seconds). Tool call
+        fragments are accumulated by their index until the stream ends. The token usage is
+        requested as the last chunk of the stream and recorded; the time to the first chunk is
+        stored in 'span_args'.
+
+        Returns:
+        - dict: The complete assistant message.
+        """
+        started = time.monotonic()
+        stream = self._create_completion(model=self.model, messages=self.context.messages, tools=tools, stream=True, stream_options={"include_usage": True})
+        self.active_stream = stream
+        content_parts = []
+        tool_calls = {}
+        usage = None
+        last_update = None
+        shown_parts = 0
+        try:
+            for chunk in stream:
+                self._check_cancelled()
+                if span_args is not None and "first_chunk_ms" not in span_args:
+                    span_args["first_chunk_ms"] = round((time.monotonic() - started) * 1000, 1)
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    now = time.monotonic()
+                    if last_update is None or now - last_update >= self.partial_update_interval:
+                        last_update = now
+                        shown_parts = len(content_parts)
+                        self._update_partial_message("".join(content_parts))
+                for fragment in delta.tool_calls or []:
+                    tool_call = tool_calls.setdefault(fragment.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                    if fragment.id:
+                        tool_call["id"] = fragment.id
+                    if fragment.function:
+                        if fragment.function.name:
+                            tool_call["function"]["name"] += fragment.function.name
+                        if fragment.function.arguments:
+                            tool_call["function"]["arguments"] += fragment.function.arguments
+        except Exception:
+            # Closing the stream of a cancelled request ends the iteration with an error
+            self._check_cancelled()
+            raise
+        finally:
+            self.active_stream = None
+        self._check_cancelled()
+        self._record_usage(usage)
+
+        content = "".join(content_parts) or None
+        if content and shown_parts != len(content_parts):
+            # Make sure the in-progress message shows the complete text until it is finalized.
+            self._update_partial_message(content)
+
+        response_message = {"role": "assistant", "content": content}
+        if tool_calls:
+            response_message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return response_message
+
+    def _update_partial_message(self, text):
+        if self.partial_message_callback:
+            self.partial_message_callback(datetime.now(), self.label, text)
+
+    def _run_turn(self, items):
+        # Answers one or more queued (datetime, sender, message, queued_at) items in one turn.
+        if self.label_senders:
+            # With several agents in the chat, the model needs to know who wrote a message.
+            content = "\n\n".join(f"{sender}: {message}" for _, sender, message, _ in items)
+        else:
+            content = "\n\n".join(message for _, _, message, _ in items)
+        self.cancel_signal = Future()
+        self.turn = self.metrics.begin_turn(self.label, self.model, min(queued_at for _, _, _, queued_at in items))
+        try:
+            response = self._process_messages([{"role": "user", "content": content}])
+        except TurnCancelled:
+            self.metrics.count("interbud_cancelled_turns_total", participant=self.label)
+            self._update_partial_message("")
+            response = "[Cancelled]"
+        if response:
+            if self.message_send_callback:
+                self.message_send_callback(datetime.now(), self.label, response)
+        turn, self.turn = self.turn, None
+        self.metrics.end_turn(turn)
 
     def run(self):
         self.running = True
         def gpt_thread():
+            pending = deque()
             while self.running:
-                try:
-                    send_datetime, sender, message = self.message_queue.get(timeout=1)
-                    response = self._process_messages([{"role": "user", "content": message}])
-                    if response:
-                        if self.message_send_callback:
-                            self.message_send_callback(datetime.now(), self.label, response)
-                except queue.Empty:
-                    continue
+                if not pending:
+                    pending.append(self.message_queue.get())
+                # Collect everything that arrived while the previous turn ran. Sequential turns
+                # take one message at a time, the others stay in the (bounded) queue.
+                while self.scheduling != "sequential":
+                    try:
+                        pending.append(self.message_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in pending:
+                    break
+                if self.scheduling == "sequential":
+                    self._run_turn([pending.popleft()])
+                else:
+                    items = list(pending)
+                    pending.clear()
+                    self._run_turn(items)
 
         self.thread = threading.Thread(target=gpt_thread)
         self.thread.start()
 
     def quit(self):
         self.running = False
-        self.thread.join()
\ No newline at end of file
+        self.closed = True
+        self.cancel()
+        try:
+            self.message_queue.put_nowait(None)  # Wake up the thread
+        except queue.Full:
+            # The thread is not waiting for messages, it stops after the current turn
+            pass
+        self.thread.join()
+        self.tool_executor.shutdown()
+        self.shell_pool.close()
\ No newline at end of file
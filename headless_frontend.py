@@ -0,0 +1,133 @@
+import curses
+import queue
+import threading
+import time
+from chat_frontend import ChatFrontend
+from text_layout import char_width
+
+# In-memory stand-in for a curses window. It keeps the characters drawn into it as a grid of
+# cells (a wide character occupies its cell and an empty one after it) and supports the calls
+# ChatFrontend makes.
+class HeadlessWindow(object):
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.cells = [[" "] * width for _ in range(height)]
+        self.cursor = (0, 0)
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, y, x, text, attributes=0):
+        row = self.cells[y]
+        for character in text:
+            width = char_width(character)
+            if width == 0:
+                # Combining characters are kept in the cell of the character they belong to
+                if x > 0:
+                    row[x - 1] += character
+                continue
+            if x + width > self.width:
+                raise curses.error("addstr() returned ERR")
+            row[x] = character
+            if width == 2:
+                row[x + 1] = ""
+            x += width
+
+    def border(self):
+        self.cells[0] = ["+"] + ["-"] * (self.width - 2) + ["+"]
+        self.cells[-1] = list(self.cells[0])
+        for row in self.cells[1:-1]:
+            row[0] = row[-1] = "|"
+
+    def clear(self):
+        self.cells = [[" "] * self.width for _ in range(self.height)]
+
+    def move(self, y, x):
+        self.cursor = (y, x)
+
+    def keypad(self, flag):
+        pass
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def text(self):
+        return "\n".join("".join(row) for row in self.cells)
+
+
+# In-memory stand-in for the curses screen ('stdscr'). Besides its size it provides the
+# keyboard input of KeyboardChatParticipant: keys passed to 'press_keys' are returned by
+# 'get_wch', which blocks like the curses call (or raises curses.error in no-delay mode).
+class HeadlessScreen(HeadlessWindow):
+    def __init__(self, height=40, width=120):
+        super(HeadlessScreen, self).__init__(height, width)
+        self.keys = queue.Queue()
+        self.no_delay = False
+
+    def press_keys(self, keys):
+        for key in keys:
+            self.keys.put(key)
+
+    def resize(self, height, width):
+        self.height = height
+        self.width = width
+        self.clear()
+        self.keys.put(curses.KEY_RESIZE)
+
+    def nodelay(self, flag):
+        self.no_delay = flag
+
+    def get_wch(self):
+        if self.no_delay:
+            try:
+                return self.keys.get_nowait()
+            except queue.Empty:
+                raise curses.error("no input")
+        return self.keys.get()
+
+
+# Chat frontend that draws into HeadlessWindows instead of a terminal. It is used to run the
+# app without curses, e.g., in benchmarks. Every drawn frame is counted, and 'wait_for_frame'
+# lets another thread wait until a frame shows a certain state.
+class HeadlessChatFrontend(ChatFrontend):
+    def __init__(self, screen=None, **kwargs):
+        self.frames = 0
+        self.frame_condition = threading.Condition()
+        super(HeadlessChatFrontend, self).__init__(screen or HeadlessScreen(), **kwargs)
+
+    def setup_terminal(self):
+        pass
+
+    def new_window(self, height, width, y, x):
+        return HeadlessWindow(height, width)
+
+    def update_screen(self):
+        with self.frame_condition:
+            self.frames += 1
+            self.frame_condition.notify_all()
+
+    def wait_for_frame(self, predicate, timeout=10.0):
+        """
+        Waits until a frame was drawn for which 'predicate(frontend)' is true.
+
+        Returns:
+        - bool: Whether such a frame was drawn before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self.frame_condition:
+            while not predicate(self):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.frame_condition.wait(remaining)
+            return True
+
+    def history_text(self):
+        return self.history_win.text()
+
+    def input_text(self):
+        return self.input_win.text()
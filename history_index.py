@@ -0,0 +1,134 @@
+from array import array
+from bisect import bisect_left
+import re
+import sys
+import threading
+
+# Categories of chat messages the history can be filtered by
+USER, ASSISTANT, TOOL_CALL = 0, 1, 2
+
+# History filters: name -> categories of the messages shown
+HISTORY_FILTERS = {
+    "all": (USER, ASSISTANT, TOOL_CALL),
+    "no tool calls": (USER, ASSISTANT),
+    "user": (USER,),
+    "assistants": (ASSISTANT,),
+    "tool calls": (TOOL_CALL,),
+}
+
+# Prefix of the messages a model participant sends when it calls a tool
+TOOL_CALL_PREFIX = "Calling function "
+
+WORD = re.compile(r"\w+")
+
+def message_category(sender, message, user_labels=("User",)):
+    if sender in user_labels:
+        return USER
+    if message.startswith(TOOL_CALL_PREFIX):
+        return TOOL_CALL
+    return ASSISTANT
+
+
+# Inverted index of the chat history. Messages are numbered in the order they are added; every
+# lower case word maps to the (ascending) numbers of the messages containing it, and the category
+# of every message is kept for filtering. A search intersects the posting lists of the words of
+# the query, the last word matching as a prefix, so results are available while the query is
+# typed. The words matching the last prefix are remembered, so extending the query only narrows
+# that set instead of scanning the vocabulary again.
+# Messages dropped from the history are dropped from the index with 'trim'. Message numbers stay
+# the same; the index is compacted once the dropped messages make up half of it, so it holds at
+# most about twice the messages of the history and compacting costs O(1) per message overall.
+class HistoryIndex(object):
+    def __init__(self, user_labels=("User",)):
+        self.user_labels = user_labels
+        self.postings = {}
+        # Categories of the messages from 'first_id' on
+        self.first_id = 0
+        self.categories = array('B')
+        self.lock = threading.Lock()
+        self.prefix_cache = ("", None)
+
+    def __len__(self):
+        # The number of messages added, including the trimmed ones
+        return self.first_id + len(self.categories)
+
+    def add(self, sender, message):
+        """
+        Adds a message to the index.
+
+        Returns:
+        - int: The number of the message.
+        """
+        with self.lock:
+            message_id = self.first_id + len(self.categories)
+            self.categories.append(message_category(sender, message, self.user_labels))
+            for word in set(WORD.findall(message.lower())):
+                postings = self.postings.get(word)
+                if postings is None:
+                    postings = self.postings[sys.intern(word)] = array('I')
+                postings.append(message_id)
+            if self.prefix_cache[1] is not None:
+                # New words may match the cached prefix
+                self.prefix_cache = ("", None)
+            return message_id
+
+    def trim(self, first_id):
+        """
+        Drops the messages numbered below 'first_id' (e.g., the messages dropped from the
+        history). Searches return no messages below it either way.
+        """
+        with self.lock:
+            dropped = first_id - self.first_id
+            if dropped <= 0 or dropped < len(self.categories) - dropped:
+                return
+            self.categories = self.categories[dropped:]
+            self.first_id = first_id
+            for word in list(self.postings):
+                postings = self.postings[word]
+                start = bisect_left(postings, first_id)
+                if start == len(postings):
+                    del self.postings[word]
+                elif start:
+                    self.postings[word] = postings[start:]
+            self.prefix_cache = ("", None)
+
+    def _prefix_words(self, prefix):
+        cached_prefix, cached_words = self.prefix_cache
+        if cached_words is not None and prefix.startswith(cached_prefix):
+            candidates = cached_words
+        else:
+            candidates = self.postings
+        words = [word for word in candidates if word.startswith(prefix)]
+        self.prefix_cache = (prefix, words)
+        return words
+
+    def search(self, query, categories=None, first_id=0):
+        """
+        Returns the numbers of the messages (at least 'first_id') containing all words of the
+        query, the last one as a prefix, and belonging to one of 'categories' (default: all).
+        """
+        words = WORD.findall(query.lower())
+        if not words:
+            return []
+        with self.lock:
+            first_id = max(first_id, self.first_id)
+            complete, prefix = words[:-1], words[-1]
+            sets = []
+            for word in complete:
+                postings = self.postings.get(word)
+                if postings is None:
+                    return []
+                sets.append(postings)
+            matches = set()
+            for word in self._prefix_words(prefix):
+                postings = self.postings[word]
+                matches.update(postings[bisect_left(postings, first_id):])
+            for postings in sorted(sets, key=len):
+                matches.intersection_update(postings[bisect_left(postings, first_id):])
+            if categories is not None:
+                matches = [message_id for message_id in matches if self.categories[message_id - self.first_id] in categories]
+            return sorted(matches)
+
+    def category(self, message_id):
+        with self.lock:
+            return self.categories[message_id - self.first_id]
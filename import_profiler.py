@@ -0,0 +1,103 @@
+import importlib.abc
+import sys
+import threading
+import time
+
+# Import-time profiler. Installed at the very start of the process, it measures how long every
+# module takes to import (including and excluding the modules it imports in turn) and on which
+# thread, so the modules slowing down the start of the app can be found. Milestones (e.g., the
+# first frame drawn) are recorded with 'mark'. 'report' returns a text table of the imports
+# from the slowest down.
+
+# Loader wrapping the loader of a module to time its execution
+class TimingLoader(importlib.abc.Loader):
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.begin(module.__name__)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.end(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # name -> (offset of the start in seconds, inclusive seconds, exclusive seconds, thread)
+        self.modules = {}
+        self.marks = []
+        self.finding = threading.local()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self.finding, "active", False):
+            return None
+        # Let the other finders locate the module, then wrap its loader
+        self.finding.active = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.finding.active = False
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = TimingLoader(spec.loader, self)
+        return spec
+
+    def begin(self, name):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        # [name, start, seconds spent in nested imports]
+        stack.append([name, time.perf_counter(), 0.0])
+
+    def end(self, name):
+        stack = self.local.stack
+        name, start, nested = stack.pop()
+        inclusive = time.perf_counter() - start
+        if stack:
+            stack[-1][2] += inclusive
+        with self.lock:
+            self.modules[name] = (start - self.started, inclusive, inclusive - nested, threading.current_thread().name)
+
+    def mark(self, label):
+        # Records a milestone, e.g., "first frame"
+        with self.lock:
+            self.marks.append((label, time.perf_counter() - self.started))
+
+    def report(self, limit=30):
+        with self.lock:
+            modules = sorted(self.modules.items(), key=lambda item: item[1][2], reverse=True)
+            marks = list(self.marks)
+        lines = ["Import times (ms, slowest first):", f"{'self':>9} {'total':>9} {'at':>9}  {'thread':<20} module"]
+        for name, (offset, inclusive, exclusive, thread) in modules[:limit]:
+            lines.append(f"{exclusive * 1000:9.1f} {inclusive * 1000:9.1f} {offset * 1000:9.1f}  {thread:<20} {name}")
+        total = sum(exclusive for _, (_, _, exclusive, _) in modules)
+        lines.append(f"{len(modules)} modules, {total * 1000:.1f} ms in total")
+        for label, offset in marks:
+            lines.append(f"{label}: {offset * 1000:.1f} ms after start")
+        return "\n".join(lines)
@@ -1,17 +1,176 @@
 #!/usr/bin/env python3
 
+import sys
+
+# With --profile_imports, the import times of all modules are measured from here on and reported
+# when the app ends (see import_profiler.py).
+profiler = None
+if "--profile_imports" in sys.argv:
+    from import_profiler import ImportProfiler
+    profiler = ImportProfiler().install()
+
 import argparse
 import curses
+import json
+import os
+import signal
+import threading
+from blob_store import shared_store
 from interbud_app import InterBudApp
+from metrics import Metrics, PrometheusExporter, TraceExporter
+from participant_registry import PARTICIPANTS, SCHEDULING_MODES, USER_PARTICIPANTS
+from rate_limiter import RateLimiter
+from session_store import SessionStore
+
+# Modules only needed by some options (the model SDK, record/replay, daemon mode) are imported
+# when they are used, so the app starts without waiting for them.
+
+def mark_first_frame(frontend):
+    # Records when the first frame was drawn, for the import time report
+    if profiler is not None:
+        def wait():
+            frontend.first_frame.wait()
+            profiler.mark("first frame")
+        threading.Thread(target=wait, daemon=True).start()
+
+def main(stdscr, openai_api_key, openai_base_url, stream, session_store, client, metrics, rate_limiter, gpt_options, agents):
+    app = InterBudApp(stdscr, openai_api_key, stream=stream, openai_base_url=openai_base_url, session_store=session_store, client=client, metrics=metrics, rate_limiter=rate_limiter, gpt_options=gpt_options, agents=agents)
+    mark_first_frame(app.frontend)
+    app.run()
+
+def attach(stdscr, socket_path):
+    from session_daemon import AttachedClient
+    client = AttachedClient(stdscr, socket_path)
+    mark_first_frame(client.frontend)
+    client.run()
 
-def main(stdscr, openai_api_key):
-    app = InterBudApp(stdscr, openai_api_key)
+def run_daemon(socket_path, openai_api_key, openai_base_url, stream, session_store, client, metrics, rate_limiter, gpt_options, agents):
+    # Runs the app without a terminal until SIGINT/SIGTERM or a client's stop request.
+    from session_daemon import DaemonFrontend, RemoteUserParticipant
+    user = RemoteUserParticipant("User")
+    frontend = DaemonFrontend(socket_path, user, session_store.session_id if session_store is not None else None)
+    app = InterBudApp(None, openai_api_key, stream=stream, openai_base_url=openai_base_url, session_store=session_store, client=client, frontend=frontend, metrics=metrics, rate_limiter=rate_limiter, gpt_options=gpt_options, agents=agents, user=user)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: frontend.quit())
+    print(f"Serving the session on {socket_path}, attach with --attach {socket_path}", flush=True)
     app.run()
+    app.quit_app()
+
+def create_client(args):
+    # Returns the model API client: a replay of a cassette, a client recording into a cassette,
+    # or None for the default (shared, connection pooled) OpenAI client, which the participants
+    # create in the background once the app is shown.
+    if args.replay:
+        from cassette import Cassette, ReplayClient
+        return ReplayClient(Cassette(args.replay), latency_scale=args.replay_latency_scale, extra_latency=args.replay_extra_latency)
+    if not args.record:
+        return None
+    from cassette import Cassette, RecordingClient
+    from client_pool import shared_client
+    return RecordingClient(shared_client(args.openai_api_key, args.openai_base_url), Cassette(args.record))
+
+def parse_participants(text):
+    """
+    Parses the --participants option: comma separated participant names from the participant
+    registry (or "module:Class"), each optionally followed by "=label".
+
+    Returns:
+    - list of dict: The participants in the format of the --agents file.
+    """
+    agents = []
+    for entry in text.split(","):
+        kind, _, label = entry.strip().partition("=")
+        if kind in USER_PARTICIPANTS or (kind not in PARTICIPANTS and ":" not in kind):
+            raise ValueError(f"Unknown participant: {kind} (known: {', '.join(sorted(set(PARTICIPANTS) - USER_PARTICIPANTS))})")
+        agents.append({"label": label or ("GPT" if kind == "gpt" else kind), "type": kind, "default": not agents})
+    return agents
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='InterBud chat frontend')
-    parser.add_argument('--openai_api_key', help='OpenAI API key', required=True)
+    parser.add_argument('--openai_api_key', help='OpenAI API key (not needed with --replay)')
+    parser.add_argument('--openai_base_url', help='Base URL of an OpenAI compatible API, e.g., a replay_server.py instance')
+    parser.add_argument('--no_stream', help='Wait for complete GPT replies instead of streaming them', action='store_true')
+    parser.add_argument('--session_dir', help='Folder in which sessions are stored', default='sessions')
+    parser.add_argument('--resume', help='Resume the session with the given id', metavar='SESSION')
+    parser.add_argument('--no_session', help='Do not store the session', action='store_true')
+    parser.add_argument('--record', help='Record all model API requests and responses to a cassette file', metavar='CASSETTE')
+    parser.add_argument('--replay', help='Answer model API requests from a recorded cassette file instead of the API', metavar='CASSETTE')
+    parser.add_argument('--replay_latency_scale', help='Scale of the recorded latencies when replaying (0 replays at full speed)', type=float, default=0.0)
+    parser.add_argument('--replay_extra_latency', help='Fixed delay in seconds added to every replayed response', type=float, default=0.0)
+    parser.add_argument('--scheduling', help='How messages sent while GPT is busy are handled: answered one by one, together in the next turn, or together after cancelling the current turn', choices=SCHEDULING_MODES, default='coalesce')
+    parser.add_argument('--max_steps', help='Maximum number of model requests (tool rounds) per turn', type=int, default=25)
+    parser.add_argument('--turn_token_budget', help='Tokens a turn may use before it is stopped', type=int)
+    parser.add_argument('--requests_per_minute', help='Client-side request rate limit (by default taken from the API\'s rate limit headers)', type=int)
+    parser.add_argument('--tokens_per_minute', help='Client-side token rate limit (by default taken from the API\'s rate limit headers)', type=int)
+    parser.add_argument('--trace_file', help='Write spans of all turns as a Chrome/Perfetto trace to this file')
+    parser.add_argument('--prometheus_file', help='Write token, cost and latency counters in the Prometheus text format to this file after every turn')
+    parser.add_argument('--agents', help='JSON file configuring the model participants: {"participants": [{"label": "worker", "model": "gpt-4o-mini", "system_prompt": "...", "default": false}, ...]}; a message starting with @label is answered by that participant only', metavar='FILE')
+    parser.add_argument('--blob_dir', help='Keep large messages and tool outputs in a memory-mapped file in this folder instead of in memory (the file grows for the whole session)')
+    parser.add_argument('--daemon', help='Run without a terminal and serve the session on this Unix socket; the participants keep working while no client is attached', metavar='SOCKET')
+    parser.add_argument('--attach', help='Attach to the session of a daemon listening on this Unix socket (CTRL-D detaches)', metavar='SOCKET')
+    parser.add_argument('--participants', help=f'Comma separated participants besides the user, each a name from the participant registry ({", ".join(sorted(set(PARTICIPANTS) - USER_PARTICIPANTS))}) or module:Class, optionally followed by =label; the first one answers messages that address no one (default: gpt)', metavar='NAMES')
+    parser.add_argument('--profile_imports', help='Measure how long every module takes to import and print a report when the app ends', action='store_true')
     args = parser.parse_args()
 
+    if args.attach:
+        if not os.path.exists(args.attach):
+            parser.error(f'No daemon is listening on {args.attach}')
+        curses.wrapper(attach, args.attach)
+        if profiler is not None:
+            print(profiler.report(), file=sys.stderr)
+        raise SystemExit(0)
+
     openai_api_key = args.openai_api_key
-    curses.wrapper(main, openai_api_key)
\ No newline at end of file
+    if not openai_api_key and not args.replay:
+        parser.error('--openai_api_key is required unless --replay is given')
+    if args.record and args.replay:
+        parser.error('--record and --replay cannot be combined')
+    if args.resume and args.no_session:
+        parser.error('--resume and --no_session cannot be combined')
+    if args.resume and not os.path.isdir(os.path.join(args.session_dir, args.resume)):
+        parser.error(f'Session "{args.resume}" does not exist in {args.session_dir}')
+
+    if args.agents and args.participants:
+        parser.error('--agents and --participants cannot be combined')
+    agents = None
+    if args.participants:
+        try:
+            agents = parse_participants(args.participants)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.agents:
+        try:
+            with open(args.agents, encoding="utf-8") as file:
+                agents = json.load(file)["participants"]
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f'Cannot read the participants from {args.agents}: {e}')
+    if agents is not None:
+        labels = [agent.get("label") for agent in agents]
+        if not all(labels) or len(set(label.lower() for label in labels)) < len(labels) or "user" in (label.lower() for label in labels):
+            parser.error('Every participant needs a unique label other than "User"')
+        if args.record and any(agent.get("api_key") or agent.get("base_url") for agent in agents):
+            # The recording client sends everything to the API given on the command line
+            parser.error('--record cannot be combined with participants that have their own "api_key" or "base_url"')
+
+    if args.blob_dir:
+        shared_store.spill_to(args.blob_dir)
+
+    session_store = None
+    if not args.no_session:
+        session_store = SessionStore(args.session_dir, args.resume)
+    client = create_client(args)
+    exporters = []
+    if args.trace_file:
+        exporters.append(TraceExporter(args.trace_file))
+    if args.prometheus_file:
+        exporters.append(PrometheusExporter(args.prometheus_file))
+    rate_limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    gpt_options = {"scheduling": args.scheduling, "max_steps": args.max_steps, "turn_token_budget": args.turn_token_budget}
+    if args.daemon:
+        run_daemon(args.daemon, openai_api_key, args.openai_base_url, not args.no_stream, session_store, client, Metrics(exporters), rate_limiter, gpt_options, agents)
+    else:
+        curses.wrapper(main, openai_api_key, args.openai_base_url, not args.no_stream, session_store, client, Metrics(exporters), rate_limiter, gpt_options, agents)
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+    if session_store is not None:
+        print(f"Session {session_store.session_id} stored, continue it with --resume {session_store.session_id}")
\ No newline at end of file
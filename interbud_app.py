@@ -1,35 +1,142 @@
+from datetime import datetime
 from chat_frontend import ChatFrontend
-from keyboard_participant import KeyboardChatParticipant
-from gpt_participant import GptParticipant
+from message_bus import MessageBus
+from message_routing import MessageRouter
+from metrics import Metrics
+from participant_registry import is_model_participant, participant_class
+from rate_limiter import RateLimiter
+import threading
+
+# The model participants of a chat unless others are configured
+DEFAULT_AGENTS = [{"label": "GPT", "type": "gpt", "model": "gpt-4o", "default": True}]
 
 class InterBudApp(object):
-    def __init__(self, stdscr, openai_api_key):
+    def __init__(self, stdscr, openai_api_key, stream=True, openai_base_url=None, session_store=None, resume_history_messages=1000, client=None, frontend=None, metrics=None, rate_limiter=None, gpt_options=None, agents=None, user=None):
         self.stdscr = stdscr
         self.openai_api_key = openai_api_key
-        self.frontend = ChatFrontend(stdscr)
+        self.openai_base_url = openai_base_url
+        self.stream = stream
+        self.session_store = session_store
+        self.client = client
+        # Further GptParticipant arguments (scheduling, step and token budgets, ...)
+        self.gpt_options = dict(gpt_options or {})
+        # The participants besides the user: dicts with a "label", and optionally a "type" (a
+        # name in the participant registry, "gpt" by default), "default" (answers messages that
+        # address no one) and the arguments of the participant, e.g., a "model" and a
+        # "system_prompt". Messages starting with "@label" go to that agent only.
+        self.agents = [dict(agent) for agent in (agents or DEFAULT_AGENTS)]
+        if not any(agent.get("default") for agent in self.agents):
+            self.agents[0]["default"] = True
+        self.router = MessageRouter()
+        # All GPT participants share one rate limiter, as they share the API key's quota.
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Spans and counters of all participants; the status bar shows the last finished turn.
+        self.metrics = metrics or Metrics()
+        # A frontend can be passed in, e.g., a HeadlessChatFrontend to run without a terminal.
+        self.frontend = frontend if frontend is not None else ChatFrontend(stdscr, metrics=self.metrics)
+        self.metrics.add_turn_listener(lambda turn: self.frontend.update_status(self.metrics.status_text(turn)))
         self.chat_participants = {}
+        # The user's participant, by default the keyboard of the terminal (the daemon passes
+        # one that receives the messages of its clients, see session_daemon.py).
+        self.user = user
+
+        # All messages go through the bus, which delivers them to each participant (and the
+        # frontend) on its own thread, so a slow participant never blocks the sender.
+        self.bus = MessageBus()
+        self.bus.add_observer(self.router.observe)
+        self.bus.subscribe("Frontend", self.frontend.enqueue_message, self.frontend.update_partial_message, receive_own=True, inbox_size=4096)
+
+        # Chat messages are appended to the session store; a resumed session shows its newest
+        # messages right away.
+        if self.session_store is not None:
+            self.frontend.load_history(self.session_store.history_tail(resume_history_messages))
+            self.bus.subscribe("SessionStore", self.session_store.append_message, receive_own=True, inbox_size=4096)
     
     def run(self):
-        self.add_chat_partner("User", KeyboardChatParticipant("User", self.stdscr))
-        self.add_chat_partner("GPT", GptParticipant("GPT", self.openai_api_key, "gpt-4o"))
+        user = self.user or participant_class("keyboard")("User", self.stdscr)
+        self.add_chat_partner(user.label, user)
+        for agent in self.agents:
+            self.router.add_agent(agent["label"], agent.get("default", False))
+        for agent in self.agents:
+            self.add_chat_partner(agent["label"], self.create_agent(agent), accept=self.router.accepts(agent["label"]))
+        threading.Thread(target=self.prepare_participants, name="prepare-participants", daemon=True).start()
         self.frontend.run()
+
+    def prepare_participants(self):
+        # Slow setup of the participants (e.g., importing the model SDK) happens once the first
+        # frame is on the screen, so the app shows up right away.
+        first_frame = getattr(self.frontend, "first_frame", None)
+        if first_frame is not None:
+            first_frame.wait(5.0)
+        for participant in list(self.chat_participants.values()):
+            if hasattr(participant, "prepare"):
+                try:
+                    participant.prepare()
+                except Exception as e:
+                    # The participant's first turn prepares it again (and fails with an error
+                    # message if the problem persists)
+                    self.frontend.enqueue_message(datetime.now(), "InterBud", f"{participant.label} could not be set up: {type(e).__name__}: {e}")
+
+    def create_agent(self, agent):
+        label = agent["label"]
+        kind = agent.get("type", "gpt")
+        cls = participant_class(kind)
+        if not is_model_participant(kind):
+            return cls(label, **{key: value for key, value in agent.items() if key not in ("label", "type", "default")})
+        # All agents share the API client (and with it the HTTP connections) and the rate limiter,
+        # unless an agent uses another API ("base_url", "api_key"). Clients are created when
+        # the participants are prepared (see 'prepare_participants'). A client passed to the app
+        # (e.g., replaying a cassette) is used by all agents, whatever API they name.
+        options = {"stream": self.stream, "session_log": self.context_log(label), "client": self.client, "base_url": self.openai_base_url, "metrics": self.metrics, "rate_limiter": self.rate_limiter}
+        options.update(self.gpt_options)
+        options.update((key, value) for key, value in agent.items() if key not in ("label", "type", "model", "default", "system_prompt", "api_key"))
+        api_key = agent.get("api_key", self.openai_api_key)
+        system_prompt = agent.get("system_prompt", cls.default_system_prompt)
+        multiple_agents = len(self.agents) > 1
+        if multiple_agents:
+            others = ", ".join(other["label"] for other in self.agents if other["label"] != label)
+            system_prompt += (
+                f" You are {label} in a chat with the user and the assistants {others}."
+                " Messages starting with @Name are addressed to that participant only; start your"
+                " message with @Name to hand a task to another assistant."
+            )
+        return cls(label, api_key, agent.get("model", "gpt-4o"), system_prompt=system_prompt, label_senders=multiple_agents, **options)
     
+    def context_log(self, label):
+        return self.session_store.context_log(label) if self.session_store is not None else None
+
     def process_message(self, date, sender, message):
-        self.frontend.enqueue_message(date, sender, message)
-        for participant in self.chat_participants:
-            if participant == sender:
-                continue
-            obj = self.chat_participants[participant]
-            obj.send_message(date, sender, message)
+        self.bus.publish(date, sender, message)
+
+    def process_partial_message(self, date, sender, message):
+        # In-progress messages are only shown, they are not forwarded to other participants.
+        self.bus.publish_partial(date, sender, message)
     
-    def add_chat_partner(self, label, chat_partner):
+    def add_chat_partner(self, label, chat_partner, accept=None):
+        # 'accept' optionally limits the messages the participant receives (see MessageRouter).
         self.chat_participants[label] = chat_partner
+        self.bus.subscribe(label, chat_partner.send_message, accept=accept)
         chat_partner.register_message_send_callback(self.process_message)
         chat_partner.register_quit_app_callback(self.quit_app)
         chat_partner.register_update_input_callback(self.frontend.update_input)
+        chat_partner.register_partial_message_callback(self.process_partial_message)
+        chat_partner.register_resize_callback(self.frontend.resize)
+        chat_partner.register_cancel_callback(self.cancel_work)
+        chat_partner.register_history_callback(self.frontend.navigate_history)
         chat_partner.run()
     
+    def cancel_work(self):
+        # Called when a participant asks to cancel (e.g., ESC): stops the turns in progress.
+        for participant in self.chat_participants.values():
+            participant.cancel()
+
     def quit_app(self):
+        # The frontend and the participants stop before the exporters and the session store
+        # they write to are closed
+        self.frontend.quit()
         for participant in self.chat_participants:
             self.chat_participants[participant].quit()
-        self.frontend.quit()
\ No newline at end of file
+        self.bus.stop()
+        self.metrics.close()
+        if self.session_store is not None:
+            self.session_store.close()
\ No newline at end of file
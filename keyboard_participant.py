@@ -1,5 +1,6 @@
 from participant_interface import ChatParticipantInterface
 
+from line_editor import LineEditor
 from datetime import datetime
 import curses
 import threading
@@ -10,53 +11,196 @@ import threading
 # Its 'send_message' method does nothing as the user sees the chat history in the respective
 # chat frontend window. The 'update_input' method is called when the user types in the
 # chat input field. This method should be used to update the input field in the chat frontend.
-# This class spawns a thread that listens for keyboard input and sends it to the chat frontend.
-# CTRL-D is used to exit the chat. When the user hits <Enter>, the current text in the input
-# field is sent to the chat frontend.
+# This class spawns a thread that listens for keyboard input and applies it to a LineEditor.
+# All keys that are already waiting (e.g., a pasted block of text) are applied at once and
+# reported to the frontend with a single update. CTRL-D is used to exit the chat. When the
+# user hits <Enter>, the current text in the input field is sent to the chat frontend. A
+# newline inside a burst of keys (a paste) or <Alt-Enter> inserts a line break instead. <ESC>
+# cancels the work in progress of the other participants (e.g., a model's turn).
+# <PageUp>/<PageDown> scroll the chat history, <Home>/<End> jump to its start and end while the
+# input field is empty, and CTRL-F cycles through the history filters. '/' in an empty input
+# field starts an incremental search of the history: typed keys extend the query, <Up>/<Down>
+# go to the previous/next match, <Enter> ends the search at the match and <ESC> returns to the
+# newest messages.
 class KeyboardChatParticipant(ChatParticipantInterface):
     def __init__(self, label, stdscr):
         self.label = label
         self.running = False
-        self.input_text = ""
+        self.editor = LineEditor()
         self.stdscr = stdscr
         self.update_input_callback = None
         self.message_send_callback = None
         self.quit_app_callback = None
+        self.partial_message_callback = None
+        self.resize_callback = None
+        self.cancel_callback = None
+        self.history_callback = None
+        self.search_query = None
     
+    @property
+    def input_text(self):
+        return self.editor.text
+
     def send_message(self, send_datetime, sender, message):
         pass
     
-    def update_input(self, text):
-        self.input_text = text
-        if self.update_input_callback:
-            self.update_input_callback(self.label, text)
+    def navigate_history(self, action, argument=None):
+        if self.history_callback:
+            self.history_callback(action, argument)
+
+    def update_input(self):
+        if self.update_input_callback and self.search_query is not None:
+            self.update_input_callback(self.label, "/" + self.search_query, (0, len(self.search_query) + 1))
+        elif self.update_input_callback:
+            lines, cursor_row, cursor_col = self.editor.snapshot()
+            self.update_input_callback(self.label, "\n".join(lines), (cursor_row, cursor_col))
     
     def quit(self):
         self.running = False
 
+    def read_pending_keys(self):
+        # Returns all keys that are already waiting, without blocking.
+        keys = []
+        self.stdscr.nodelay(True)
+        try:
+            while True:
+                keys.append(self.stdscr.get_wch())
+        except curses.error:
+            pass
+        finally:
+            self.stdscr.nodelay(False)
+        return keys
+
+    def end_search(self, back_to_newest):
+        self.search_query = None
+        self.navigate_history("end_search", back_to_newest)
+
+    def handle_search_key(self, key):
+        """
+        Applies a single key to the search query.
+
+        Returns:
+        - bool: Whether the input field changed.
+        """
+        if key in ('\n', '\r', curses.KEY_ENTER):
+            self.end_search(False)
+        elif key in (curses.KEY_BACKSPACE, '\b', '\x7f', 127):
+            if not self.search_query:
+                self.end_search(False)
+            else:
+                self.search_query = self.search_query[:-1]
+                self.navigate_history("search", self.search_query)
+        elif key in (curses.KEY_UP, chr(16)):  # CTRL-P
+            self.navigate_history("previous_match")
+            return False
+        elif key in (curses.KEY_DOWN, chr(14)):  # CTRL-N
+            self.navigate_history("next_match")
+            return False
+        elif isinstance(key, str) and key.isprintable():
+            self.search_query += key
+            self.navigate_history("search", self.search_query)
+        else:
+            return self.handle_navigation_key(key)
+        return True
+
+    def handle_navigation_key(self, key):
+        # Keys scrolling the history; they never change the input field.
+        if key == curses.KEY_PPAGE:
+            self.navigate_history("page_up")
+        elif key == curses.KEY_NPAGE:
+            self.navigate_history("page_down")
+        elif key == chr(6):  # CTRL-F
+            self.navigate_history("cycle_filter")
+        return False
+
+    def handle_key(self, key, next_key):
+        """
+        Applies a single key to the editor.
+
+        Returns:
+        - bool: Whether the editor changed.
+        """
+        if self.search_query is not None:
+            return self.handle_search_key(key)
+        if key == '/' and not self.editor.text and next_key is None:
+            self.search_query = ""
+            self.navigate_history("search", "")
+            return True
+        if key in (curses.KEY_HOME, curses.KEY_END) and not self.editor.text:
+            self.navigate_history("top" if key == curses.KEY_HOME else "bottom")
+            return False
+        if key in (curses.KEY_PPAGE, curses.KEY_NPAGE, chr(6)):
+            return self.handle_navigation_key(key)
+        if key in ('\n', '\r', curses.KEY_ENTER):
+            if next_key is not None:
+                # More keys arrived together with this newline, so it is part of a paste.
+                self.editor.insert("\n")
+                return True
+            user_input = self.editor.submit()
+            if user_input:
+                self.update_input()
+                if self.message_send_callback:
+                    self.message_send_callback(datetime.now(), self.label, user_input)
+            return False
+        elif key in (curses.KEY_BACKSPACE, '\b', '\x7f', 127):
+            self.editor.backspace()
+        elif key == curses.KEY_DC:
+            self.editor.delete()
+        elif key == curses.KEY_LEFT:
+            self.editor.move_left()
+        elif key == curses.KEY_RIGHT:
+            self.editor.move_right()
+        elif key == curses.KEY_UP:
+            self.editor.move_up()
+        elif key == curses.KEY_DOWN:
+            self.editor.move_down()
+        elif key in (curses.KEY_HOME, chr(1)):  # CTRL-A
+            self.editor.move_home()
+        elif key in (curses.KEY_END, chr(5)):  # CTRL-E
+            self.editor.move_end()
+        elif isinstance(key, str) and (key.isprintable() or key == '\t'):
+            self.editor.insert(key)
+        else:
+            return False
+        return True
+
     def run(self):
         self.running = True
 
         def keyboard_thread():
             while self.running:
-                char = self.stdscr.get_wch()
-                if char == chr(4):  # CTRL-D
-                    self.running = False
-                    if self.quit_app_callback:
-                        self.quit_app_callback()
-                    break
-                elif char == '\n':
-                    user_input = self.input_text
-                    self.input_text = ""
-                    if user_input:
-                        if self.message_send_callback:
-                            self.update_input(self.input_text)
-                            self.message_send_callback(datetime.now(), self.label, user_input)
-                elif char == curses.KEY_BACKSPACE or char == '\b' or char == 127:
-                    self.input_text = self.input_text[:-1]
-                    self.update_input(self.input_text)
-                elif isinstance(char, str):
-                    self.update_input(self.input_text + char)
+                keys = [self.stdscr.get_wch()]
+                keys.extend(self.read_pending_keys())
+
+                changed = False
+                i = 0
+                while i < len(keys):
+                    key = keys[i]
+                    next_key = keys[i + 1] if i + 1 < len(keys) else None
+                    if key == chr(4):  # CTRL-D
+                        self.running = False
+                        if self.quit_app_callback:
+                            self.quit_app_callback()
+                        return
+                    elif key == curses.KEY_RESIZE:
+                        if self.resize_callback:
+                            self.resize_callback()
+                    elif key == '\x1b' and next_key in ('\n', '\r'):  # Alt-Enter
+                        self.editor.insert("\n")
+                        changed = True
+                        i += 1
+                    elif key == '\x1b' and next_key is None and self.search_query is not None:
+                        self.end_search(True)
+                        changed = True
+                    elif key == '\x1b' and next_key is None:  # ESC on its own, not an Alt combination
+                        if self.cancel_callback:
+                            self.cancel_callback()
+                    else:
+                        changed = self.handle_key(key, next_key) or changed
+                    i += 1
+
+                if changed:
+                    self.update_input()
         
         self.thread = threading.Thread(target=keyboard_thread)
-        self.thread.start()
\ No newline at end of file
+        self.thread.start()
@@ -0,0 +1,147 @@
+from text_layout import char_width, split_by_width
+
+def scroll_start(line, cursor_col, width, start=0):
+    """
+    Computes the first character of 'line' to show in a field 'width' columns wide, so that
+    the cursor stays visible. The previous start is kept as long as possible, which avoids the
+    text jumping around while the cursor moves within the visible part.
+    """
+    if cursor_col < start:
+        return cursor_col
+    # Walk back from the cursor to find the leftmost start that still shows the cursor cell.
+    min_start = cursor_col
+    used = 1
+    while min_start > 0:
+        w = char_width(line[min_start - 1])
+        if used + w > width:
+            break
+        used += w
+        min_start -= 1
+    return max(start, min_start)
+
+def clip_to_width(text, width):
+    """
+    Returns the longest prefix of 'text' that fits into 'width' columns.
+    """
+    if not text:
+        return text
+    return split_by_width(text, width)[0]
+
+
+# Line editor. This class is the model behind the keyboard input field: a multi-line text
+# buffer with a cursor and a history of submitted inputs. It does not draw anything itself;
+# the keyboard participant applies keys to it and passes 'snapshot()' to the frontend, which
+# takes care of horizontal scrolling and drawing on its own thread.
+class LineEditor(object):
+    def __init__(self, history_limit=1000):
+        self.lines = [""]
+        self.cursor_row = 0
+        self.cursor_col = 0
+        self.history = []
+        self.history_limit = history_limit
+        self.history_index = None
+        self.draft = None
+
+    @property
+    def text(self):
+        return "\n".join(self.lines)
+
+    def snapshot(self):
+        # Immutable view of the editor state that can safely be handed to another thread.
+        return (tuple(self.lines), self.cursor_row, self.cursor_col)
+
+    def set_text(self, text):
+        self.lines = text.split("\n")
+        self.cursor_row = len(self.lines) - 1
+        self.cursor_col = len(self.lines[-1])
+
+    def insert(self, text):
+        line = self.lines[self.cursor_row]
+        before, after = line[:self.cursor_col], line[self.cursor_col:]
+        new_lines = (before + text).split("\n")
+        self.cursor_col = len(new_lines[-1])
+        new_lines[-1] += after
+        self.lines[self.cursor_row:self.cursor_row + 1] = new_lines
+        self.cursor_row += len(new_lines) - 1
+
+    def backspace(self):
+        if self.cursor_col > 0:
+            line = self.lines[self.cursor_row]
+            self.lines[self.cursor_row] = line[:self.cursor_col - 1] + line[self.cursor_col:]
+            self.cursor_col -= 1
+        elif self.cursor_row > 0:
+            previous = self.lines[self.cursor_row - 1]
+            self.lines[self.cursor_row - 1] = previous + self.lines.pop(self.cursor_row)
+            self.cursor_row -= 1
+            self.cursor_col = len(previous)
+
+    def delete(self):
+        line = self.lines[self.cursor_row]
+        if self.cursor_col < len(line):
+            self.lines[self.cursor_row] = line[:self.cursor_col] + line[self.cursor_col + 1:]
+        elif self.cursor_row < len(self.lines) - 1:
+            self.lines[self.cursor_row] = line + self.lines.pop(self.cursor_row + 1)
+
+    def move_left(self):
+        if self.cursor_col > 0:
+            self.cursor_col -= 1
+        elif self.cursor_row > 0:
+            self.cursor_row -= 1
+            self.cursor_col = len(self.lines[self.cursor_row])
+
+    def move_right(self):
+        if self.cursor_col < len(self.lines[self.cursor_row]):
+            self.cursor_col += 1
+        elif self.cursor_row < len(self.lines) - 1:
+            self.cursor_row += 1
+            self.cursor_col = 0
+
+    def move_home(self):
+        self.cursor_col = 0
+
+    def move_end(self):
+        self.cursor_col = len(self.lines[self.cursor_row])
+
+    def move_up(self):
+        # Moves to the previous line, or recalls the previous history entry on the first line.
+        if self.cursor_row > 0:
+            self.cursor_row -= 1
+            self.cursor_col = min(self.cursor_col, len(self.lines[self.cursor_row]))
+            return
+        if not self.history or self.history_index == 0:
+            return
+        if self.history_index is None:
+            self.draft = self.text
+            self.history_index = len(self.history)
+        self.history_index -= 1
+        self.set_text(self.history[self.history_index])
+
+    def move_down(self):
+        # Moves to the next line, or recalls the next history entry on the last line.
+        if self.cursor_row < len(self.lines) - 1:
+            self.cursor_row += 1
+            self.cursor_col = min(self.cursor_col, len(self.lines[self.cursor_row]))
+            return
+        if self.history_index is None:
+            return
+        self.history_index += 1
+        if self.history_index == len(self.history):
+            self.history_index = None
+            self.set_text(self.draft)
+        else:
+            self.set_text(self.history[self.history_index])
+
+    def submit(self):
+        """
+        Clears the editor and returns its text. Non-empty texts are added to the history.
+        """
+        text = self.text
+        if text and (not self.history or self.history[-1] != text):
+            self.history.append(text)
+            del self.history[:-self.history_limit]
+        self.lines = [""]
+        self.cursor_row = 0
+        self.cursor_col = 0
+        self.history_index = None
+        self.draft = None
+        return text
@@ -0,0 +1,170 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+
+# Inbox of a single message bus subscriber. It lives on the bus' event loop and holds at most
+# 'max_size' messages of the form (datetime, sender, message, partial). A partial message
+# (the in-progress text of a participant) replaces a queued partial message of the same
+# sender, as only the latest one matters. When the inbox is full, the overflow policy decides
+# what happens with a new message:
+#   - "drop_oldest": The oldest queued message is discarded.
+#   - "drop_newest": The new message is discarded.
+#   - "coalesce": The new message is merged into the last queued message if that one has the
+#     same sender, otherwise the oldest queued message is discarded.
+# An optional 'accept' filter(sender, message) limits which final messages the inbox receives.
+class Inbox(object):
+    def __init__(self, name, deliver, deliver_partial, receive_own, max_size, overflow_policy, accept=None):
+        if overflow_policy not in ("drop_oldest", "drop_newest", "coalesce"):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.name = name
+        self.deliver = deliver
+        self.deliver_partial = deliver_partial
+        self.receive_own = receive_own
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.accept = accept
+        self.items = deque()
+        self.dropped = 0
+        self.event = asyncio.Event()
+        # Each subscriber gets its own delivery thread, so a slow one only delays itself.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inbox-{name}")
+
+    def put(self, item):
+        date, sender, message, partial = item
+        if self.items:
+            last_date, last_sender, last_message, last_partial = self.items[-1]
+            if partial and last_partial and last_sender == sender:
+                self.items[-1] = item
+                return
+        if len(self.items) >= self.max_size:
+            if self.overflow_policy == "drop_newest" or partial:
+                # In-progress text never pushes out a final message.
+                self.dropped += 1
+                return
+            if self.overflow_policy == "coalesce" and last_sender == sender and not partial and not last_partial:
+                self.items[-1] = (last_date, last_sender, f"{last_message}\n{message}", False)
+                self.event.set()
+                return
+            self.items.popleft()
+            self.dropped += 1
+        self.items.append(item)
+        self.event.set()
+
+
+# Message bus. This class replaces the synchronous fan-out of messages to all participants.
+# It runs an asyncio event loop on its own thread; 'publish' can be called from any thread
+# and returns immediately. Every subscriber has a bounded inbox that is drained by a delivery
+# task as soon as a message arrives. The subscriber's 'deliver' callback (datetime, sender,
+# message) is called on the subscriber's own delivery thread, which adapts the existing
+# thread based participants to the event loop: a participant that takes long to accept a
+# message neither blocks the sender nor any of the other subscribers.
+class MessageBus(object):
+    def __init__(self, inbox_size=256, overflow_policy="coalesce"):
+        self.inbox_size = inbox_size
+        self.overflow_policy = overflow_policy
+        self.inboxes = {}
+        self.delivery_tasks = {}
+        self.observers = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="message-bus", daemon=True)
+        self.started = False
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            self.thread.start()
+
+    def _call(self, function, *args):
+        # Runs a function on the event loop thread and waits for its result.
+        if threading.current_thread() is self.thread:
+            return function(*args)
+
+        async def call():
+            return function(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    async def _deliver(self, inbox):
+        while True:
+            await inbox.event.wait()
+            inbox.event.clear()
+            while inbox.items:
+                date, sender, message, partial = inbox.items.popleft()
+                deliver = inbox.deliver_partial if partial else inbox.deliver
+                try:
+                    await self.loop.run_in_executor(inbox.executor, deliver, date, sender, message)
+                except Exception:
+                    # A failing subscriber must not stop the delivery of later messages.
+                    continue
+
+    def subscribe(self, name, deliver, deliver_partial=None, receive_own=False, inbox_size=None, overflow_policy=None, accept=None):
+        """
+        Registers a subscriber.
+
+        Parameters:
+        - name: str, the subscriber's name. Messages published with this name as sender are
+          not delivered back to it unless 'receive_own' is set.
+        - deliver: callable(datetime, sender, message), called for each delivered message.
+        - deliver_partial: callable(datetime, sender, message), called for in-progress messages.
+          Subscribers without it do not receive in-progress messages.
+        - receive_own: bool, whether the subscriber also receives its own messages.
+        - inbox_size: int, the maximum number of queued messages (defaults to the bus' size).
+        - overflow_policy: str, see Inbox (defaults to the bus' policy).
+        - accept: callable(sender, message) -> bool, optional. Only messages it accepts are
+          delivered (e.g., messages addressed to the subscriber).
+        """
+        self.start()
+
+        def add():
+            inbox = Inbox(name, deliver, deliver_partial, receive_own, inbox_size or self.inbox_size, overflow_policy or self.overflow_policy, accept)
+            self.inboxes[name] = inbox
+            self.delivery_tasks[name] = self.loop.create_task(self._deliver(inbox))
+        self._call(add)
+
+    def add_observer(self, observe):
+        """
+        Registers a callable(sender, message) that is called on the bus' event loop for every
+        final message, before it is dispatched to the inboxes (e.g., MessageRouter.observe).
+        """
+        self.observers.append(observe)
+
+    def unsubscribe(self, name):
+        def remove():
+            inbox = self.inboxes.pop(name, None)
+            task = self.delivery_tasks.pop(name, None)
+            if task:
+                task.cancel()
+            if inbox:
+                inbox.executor.shutdown(wait=False)
+        self._call(remove)
+
+    def _dispatch(self, date, sender, message, partial):
+        if not partial:
+            for observe in self.observers:
+                observe(sender, message)
+        for inbox in self.inboxes.values():
+            if inbox.name == sender and not inbox.receive_own:
+                continue
+            if partial and inbox.deliver_partial is None:
+                continue
+            if not partial and inbox.accept is not None and not inbox.accept(sender, message):
+                continue
+            inbox.put((date, sender, message, partial))
+
+    def publish(self, date, sender, message):
+        self.loop.call_soon_threadsafe(self._dispatch, date, sender, message, False)
+
+    def publish_partial(self, date, sender, message):
+        self.loop.call_soon_threadsafe(self._dispatch, date, sender, message, True)
+
+    def stop(self):
+        if not self.started:
+            return
+        for name in list(self.inboxes):
+            self.unsubscribe(name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.started = False
@@ -0,0 +1,85 @@
+from datetime import datetime
+import sys
+import time
+from blob_store import shared_store
+
+# Compact records of the messages the app keeps for a whole session. Instead of a dict (or an
+# API response object) per message, a record uses __slots__, interned strings for the few
+# distinct roles, senders and tool names, and integer timestamps; long texts are held by a
+# BlobStore and referenced.
+
+def intern_name(name):
+    return sys.intern(name) if name is not None else None
+
+
+# Chat history entry: a message as shown in the history window. The prefix
+# ("[HH:MM:SS] sender: ") is built when the message is drawn instead of being stored.
+class ChatRecord(object):
+    __slots__ = ("message_id", "timestamp", "sender", "text")
+
+    def __init__(self, message_id, timestamp, sender, text):
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.sender = sender
+        self.text = text
+
+    @classmethod
+    def create(cls, message_id, date, sender, text, blob_store=shared_store):
+        return cls(message_id, int(date.timestamp()), intern_name(sender), blob_store.put(text))
+
+    @property
+    def date(self):
+        return datetime.fromtimestamp(self.timestamp)
+
+    def prefix(self):
+        return f"[{time.strftime('%H:%M:%S', time.localtime(self.timestamp))}] {self.sender}: "
+
+
+# Conversation context entry: one message of the model API payload and its approximate token
+# count. Tool calls are kept as (id, name, arguments) tuples; the content and the arguments
+# of tool calls may be blob references. 'to_dict' builds the message of the API payload.
+class ContextRecord(object):
+    __slots__ = ("role", "content", "name", "tool_call_id", "tool_calls", "token_count")
+
+    KEYS = ("role", "content", "name", "tool_call_id", "tool_calls")
+
+    def __init__(self, role, content=None, name=None, tool_call_id=None, tool_calls=None, token_count=0):
+        self.role = role
+        self.content = content
+        self.name = name
+        self.tool_call_id = tool_call_id
+        self.tool_calls = tool_calls
+        self.token_count = token_count
+
+    @classmethod
+    def from_dict(cls, message, token_count, blob_store=shared_store):
+        unknown = set(message) - set(cls.KEYS)
+        if unknown:
+            raise ValueError(f"Unsupported message fields: {', '.join(sorted(unknown))}")
+        tool_calls = None
+        if message.get("tool_calls"):
+            tool_calls = tuple(
+                (tool_call["id"], intern_name(tool_call["function"]["name"]), blob_store.put(tool_call["function"]["arguments"]))
+                for tool_call in message["tool_calls"]
+            )
+        return cls(
+            intern_name(message["role"]),
+            blob_store.put(message.get("content")),
+            intern_name(message.get("name")),
+            message.get("tool_call_id"),
+            tool_calls,
+            token_count,
+        )
+
+    def to_dict(self, blob_store=shared_store):
+        message = {"role": self.role, "content": blob_store.get(self.content)}
+        if self.name is not None:
+            message["name"] = self.name
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        if self.tool_calls is not None:
+            message["tool_calls"] = [
+                {"id": call_id, "type": "function", "function": {"name": name, "arguments": blob_store.get(arguments)}}
+                for call_id, name, arguments in self.tool_calls
+            ]
+        return message
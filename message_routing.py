@@ -0,0 +1,62 @@
+import re
+
+# Mentions at the start of a message ("@worker ...", "@planner, @worker: ...")
+LEADING_MENTIONS = re.compile(r"^\s*((?:@[\w-]+[\s,:]*)+)")
+MENTION = re.compile(r"@([\w-]+)")
+
+# Addressable routing between the participants of a chat. Messages starting with one or more
+# @mentions of agents (model participants) are delivered to the mentioned agents only; other
+# messages from non-agents (e.g., the user) go to the default agents. Agents never answer
+# unaddressed messages of other agents, so agents only talk to each other when they address
+# each other explicitly, and at most 'max_agent_hops' agent-to-agent handoffs (agent messages
+# addressing other agents) in a row are routed before the user has to speak again (two agents
+# addressing each other would otherwise never stop); other agent messages, such as tool call
+# traces, do not count. 'observe' is called by the message bus when it dispatches a message,
+# right before the 'accepts' filters, so the count matches the order messages are routed in.
+# Participants that are not agents (the user, the session store) are
+# not routed and receive everything.
+class MessageRouter(object):
+    def __init__(self, max_agent_hops=8):
+        # lower case label -> label
+        self.agents = {}
+        self.default_agents = set()
+        self.max_agent_hops = max_agent_hops
+        self.agent_hops = 0
+
+    def add_agent(self, label, default=False):
+        self.agents[label.lower()] = label
+        if default:
+            self.default_agents.add(label)
+
+    def addressees(self, message):
+        """
+        Returns the labels of the agents a message is addressed to (empty if it mentions none).
+        """
+        match = LEADING_MENTIONS.match(message or "")
+        if not match:
+            return set()
+        names = MENTION.findall(match.group(1))
+        return {self.agents[name.lower()] for name in names if name.lower() in self.agents}
+
+    def is_agent(self, label):
+        return label.lower() in self.agents
+
+    def observe(self, sender, message):
+        # Called once for every dispatched message, before it is routed
+        if not self.is_agent(sender):
+            self.agent_hops = 0
+        elif self.addressees(message):
+            self.agent_hops += 1
+
+    def accepts(self, label):
+        """
+        Returns a filter(sender, message) telling whether the agent 'label' gets a message.
+        """
+        def accept(sender, message):
+            if self.is_agent(sender) and self.agent_hops > self.max_agent_hops:
+                return False
+            addressees = self.addressees(message)
+            if addressees:
+                return label in addressees
+            return label in self.default_agents and not self.is_agent(sender)
+        return accept
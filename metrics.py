@@ -0,0 +1,254 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+# Prices in USD per million (prompt, completion) tokens, used for the cost counters. Models
+# missing here are counted with a cost of 0.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+def format_duration(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+def escape_label(value):
+    # Escapes a Prometheus label value
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_count(count):
+    return f"{count / 1000:.1f}k" if count >= 10000 else str(count)
+
+
+# Measurements of one turn of a participant: from taking a message out of its queue until its
+# reply was sent. 'phases' holds the total duration and number of spans per phase ("api",
+# "tool", ...); the token counts come from the usage reported by the API.
+class Turn(object):
+    def __init__(self, participant, model, queue_wait=0.0):
+        self.participant = participant
+        self.model = model
+        self.queue_wait = queue_wait
+        self.started = time.monotonic()
+        self.duration = None
+        self.phases = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self.lock:
+            total = self.phases.setdefault(phase, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def phase_seconds(self, phase):
+        return self.phases.get(phase, [0.0, 0])[0]
+
+    def phase_count(self, phase):
+        return self.phases.get(phase, [0.0, 0])[1]
+
+    @property
+    def tokens_per_second(self):
+        # Completion tokens per second of API time
+        api_seconds = self.phase_seconds("api")
+        return self.completion_tokens / api_seconds if api_seconds > 0 else 0.0
+
+
+# Exporter writing spans as a Chrome trace (JSON array format, one event per line), which
+# chrome://tracing and Perfetto load directly. The closing bracket is optional in this format,
+# so the file stays valid while the app runs and after a crash.
+class TraceExporter(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write("[\n")
+        self.named_threads = set()
+        self.pid = os.getpid()
+
+    def span(self, name, phase, start, duration, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name, "cat": phase, "ph": "X", "pid": self.pid, "tid": thread.ident,
+            "ts": round(start * 1e6), "dur": round(duration * 1e6), "args": args,
+        }
+        with self.lock:
+            if self.file is None:
+                # Closed; spans of threads that are still finishing (e.g., a frame being drawn)
+                # are dropped
+                return
+            if thread.ident not in self.named_threads:
+                self.named_threads.add(thread.ident)
+                metadata = {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident, "args": {"name": thread.name}}
+                self.file.write(json.dumps(metadata) + ",\n")
+            self.file.write(json.dumps(event, default=str) + ",\n")
+
+    def turn_ended(self, metrics):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# Exporter writing all counters in the Prometheus text format after every turn (e.g., for the
+# textfile collector of the node exporter). The file is replaced atomically.
+class PrometheusExporter(object):
+    def __init__(self, path):
+        self.path = path
+
+    def span(self, name, phase, start, duration, args):
+        pass
+
+    def turn_ended(self, metrics):
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.prometheus_text())
+        os.replace(temporary_path, self.path)
+
+    def close(self):
+        pass
+
+
+# Collects spans and counters of the app. Spans are timed phases (queue wait, API calls, tool
+# executions, frontend renders, whole turns); each is added to the totals of its phase, to the
+# turn it belongs to (if any) and passed to the exporters. Counters accumulate turns, tokens,
+# cost and tool calls per participant. Turn listeners are called with every finished turn, e.g.,
+# to update the status bar. All methods can be called from any thread.
+class Metrics(object):
+    def __init__(self, exporters=(), prices=None):
+        self.exporters = list(exporters)
+        self.prices = MODEL_PRICES if prices is None else prices
+        self.lock = threading.Lock()
+        self.epoch = time.monotonic()
+        # (metric name, sorted label items) -> value
+        self.counters = {}
+        self.turn_listeners = []
+        self.last_render = 0.0
+
+    def add_turn_listener(self, listener):
+        self.turn_listeners.append(listener)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def total(self, name):
+        # Sum of a counter over all label values
+        with self.lock:
+            return sum(value for (counter_name, _), value in self.counters.items() if counter_name == name)
+
+    def record_span(self, name, phase, start, duration, turn=None, args=None):
+        if turn is not None:
+            turn.add_phase(phase, duration)
+        if phase == "render":
+            self.last_render = duration
+        self.count("interbud_phase_seconds_sum", duration, phase=phase)
+        self.count("interbud_phase_seconds_count", 1, phase=phase)
+        for exporter in self.exporters:
+            exporter.span(name, phase, start - self.epoch, duration, args or {})
+
+    @contextmanager
+    def span(self, name, phase, turn=None, **args):
+        """
+        Times the enclosed block as a span. The yielded dict holds the span's arguments shown in
+        traces; the block can add to it (e.g., the time to the first token).
+        """
+        start = time.monotonic()
+        try:
+            yield args
+        finally:
+            self.record_span(name, phase, start, time.monotonic() - start, turn, args)
+
+    def begin_turn(self, participant, model, queued_at=None):
+        now = time.monotonic()
+        queue_wait = now - queued_at if queued_at is not None else 0.0
+        turn = Turn(participant, model, queue_wait)
+        if queued_at is not None:
+            self.record_span("queue wait", "queue", queued_at, queue_wait, turn, {"participant": participant})
+        return turn
+
+    def add_usage(self, turn, model, usage):
+        """
+        Adds the token usage reported by the API (an object with 'prompt_tokens' and
+        'completion_tokens') to the counters and to the turn, if any.
+        """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        participant = turn.participant if turn is not None else ""
+        self.count("interbud_tokens_total", prompt_tokens, participant=participant, kind="prompt")
+        self.count("interbud_tokens_total", completion_tokens, participant=participant, kind="completion")
+        self.count("interbud_cost_usd_total", cost, participant=participant)
+        if turn is not None:
+            with turn.lock:
+                turn.prompt_tokens += prompt_tokens
+                turn.completion_tokens += completion_tokens
+                turn.cost += cost
+
+    def end_turn(self, turn):
+        turn.duration = time.monotonic() - turn.started
+        self.record_span("turn", "turn", turn.started, turn.duration, None, {
+            "participant": turn.participant, "prompt_tokens": turn.prompt_tokens, "completion_tokens": turn.completion_tokens,
+        })
+        self.count("interbud_turns_total", participant=turn.participant)
+        for exporter in self.exporters:
+            exporter.turn_ended(self)
+        for listener in self.turn_listeners:
+            listener(turn)
+
+    def status_text(self, turn):
+        """
+        Returns a one-line summary of a finished turn and the session totals for the status bar.
+        """
+        parts = [f"queue {format_duration(turn.queue_wait)}", f"api {format_duration(turn.phase_seconds('api'))} ({turn.phase_count('api')})"]
+        if turn.phase_count("tool"):
+            parts.append(f"tools {format_duration(turn.phase_seconds('tool'))} ({turn.phase_count('tool')})")
+        parts.append(f"render {format_duration(self.last_render)}")
+        text = f"{turn.participant} {format_duration(turn.duration)}: {', '.join(parts)}"
+        if turn.prompt_tokens or turn.completion_tokens:
+            text += f" | {format_count(turn.prompt_tokens)}+{format_count(turn.completion_tokens)} tok, {turn.tokens_per_second:.0f} tok/s"
+        text += f" | session {format_count(int(self.total('interbud_tokens_total')))} tok, ${self.total('interbud_cost_usd_total'):.3f}"
+        return text
+
+    def prometheus_text(self):
+        types = {
+            "interbud_turns_total": "counter",
+            "interbud_tokens_total": "counter",
+            "interbud_cost_usd_total": "counter",
+            "interbud_tool_calls_total": "counter",
+            "interbud_cancelled_turns_total": "counter",
+            "interbud_api_retries_total": "counter",
+            "interbud_phase_seconds": "summary",
+        }
+        with self.lock:
+            counters = sorted(self.counters.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            base_name = name[:-len("_sum")] if name.endswith("_sum") else name[:-len("_count")] if name.endswith("_count") else name
+            if base_name in types and base_name not in typed:
+                typed.add(base_name)
+                lines.append(f"# TYPE {base_name} {types[base_name]}")
+            label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
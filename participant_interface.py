@@ -6,13 +6,23 @@
 # a method that is called when the currently typed text by the participant changes
 # (e.g., when a keyboard user types, with each keystroke this function is called with
 # the current text in the input field). This method should be used to update the input
-# field in the chat frontend.
+# field in the chat frontend. Participants that produce their messages incrementally (e.g.,
+# a streaming language model) can report the text produced so far through the partial message
+# callback; the frontend shows it as an in-progress message until the final message arrives.
+# Participants reading from the terminal report size changes through the resize callback, and
+# a request to cancel the work in progress (e.g., the ESC key) through the cancel callback;
+# the app then calls 'cancel' on all participants. Keys that scroll or search the chat history
+# are reported through the history callback (see ChatFrontend.navigate_history).
 class ChatParticipantInterface(object):
     def __init__(self, label):
         self.label = label
         self.message_send_callback = None
         self.quit_app_callback = None
         self.update_input_callback = None
+        self.partial_message_callback = None
+        self.resize_callback = None
+        self.cancel_callback = None
+        self.history_callback = None
         self.should_quit = False
 
     def register_message_send_callback(self, message_send_callback):
@@ -24,6 +34,22 @@ class ChatParticipantInterface(object):
     def register_update_input_callback(self, update_input_callback):
         self.update_input_callback = update_input_callback
     
+    def register_partial_message_callback(self, partial_message_callback):
+        self.partial_message_callback = partial_message_callback
+
+    def register_resize_callback(self, resize_callback):
+        self.resize_callback = resize_callback
+
+    def register_cancel_callback(self, cancel_callback):
+        self.cancel_callback = cancel_callback
+
+    def register_history_callback(self, history_callback):
+        self.history_callback = history_callback
+
+    def cancel(self):
+        # Participants doing long-running work (e.g., waiting for a model) stop it here.
+        pass
+
     def quit(self):
         self.should_quit = True
 
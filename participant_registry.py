@@ -0,0 +1,51 @@
+import importlib
+
+# Participant registry. Participants are declared by name with the module and class that
+# implement them ("module:Class"); a module is only imported when a participant of its kind is
+# created, so the participants that are not used in a session cost nothing at startup. Other
+# participants can be declared with 'register_participant', or referred to by their
+# "module:Class" directly.
+PARTICIPANTS = {
+    "keyboard": "keyboard_participant:KeyboardChatParticipant",
+    "gpt": "gpt_participant:GptParticipant",
+    "remote_user": "session_daemon:RemoteUserParticipant",
+}
+
+# Model participants get the app's model options (API key, client, rate limiter, ...)
+MODEL_PARTICIPANTS = {"gpt"}
+
+# Participants representing the user, which the app creates itself
+USER_PARTICIPANTS = {"keyboard", "remote_user"}
+
+# Scheduling modes for the messages waiting while a turn of a GptParticipant runs.
+# They are defined here, so the command line can offer them without importing the participant:
+#   - "sequential": Every message gets its own turn.
+#   - "coalesce": All waiting messages are answered together in the next turn.
+#   - "supersede": Like "coalesce", and a new message also cancels the turn in progress.
+SCHEDULING_MODES = ("sequential", "coalesce", "supersede")
+
+def register_participant(name, spec, model=False):
+    """
+    Declares a participant.
+
+    Parameters:
+    - name: str, the name it is referred to by (e.g., in --participants).
+    - spec: str, "module:Class" of the ChatParticipantInterface implementation.
+    - model: bool, whether it is a model participant taking the GptParticipant arguments.
+    """
+    PARTICIPANTS[name] = spec
+    if model:
+        MODEL_PARTICIPANTS.add(name)
+
+def is_model_participant(name):
+    return name in MODEL_PARTICIPANTS
+
+def participant_class(name):
+    """
+    Returns the class of a participant, importing its module if needed.
+    """
+    spec = PARTICIPANTS.get(name, name)
+    module_name, separator, class_name = spec.partition(":")
+    if not separator:
+        raise ValueError(f"Unknown participant: {name} (known: {', '.join(sorted(PARTICIPANTS))})")
+    return getattr(importlib.import_module(module_name), class_name)
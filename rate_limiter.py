@@ -0,0 +1,151 @@
+from concurrent.futures import wait
+import random
+import re
+import threading
+import time
+
+def parse_duration(text):
+    """
+    Parses a duration as used in the rate limit headers of the OpenAI API (e.g., "1s", "6m0s",
+    "20ms", "1h2m3.5s") and returns it in seconds.
+    """
+    seconds = 0.0
+    for value, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text or ""):
+        seconds += float(value) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+def is_transient_error(error):
+    """
+    Returns whether a failed API request is worth retrying: connection problems, timeouts,
+    rate limits (429), conflicts and server errors.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in (408, 409, 429) or status_code >= 500
+    if any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+def retry_after(error):
+    # Returns the delay in seconds the server asked for in a failed response, if any.
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=30.0, error=None):
+    """
+    Returns the delay before retry number 'attempt' (starting at 0): exponential backoff with
+    full jitter, or the delay requested by the server if it is longer.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        delay = max(delay, min(requested, max_delay))
+    return delay
+
+
+# Token bucket holding up to 'capacity' units that refills at 'rate' units per second.
+class TokenBucket(object):
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Requests larger than the bucket only wait until it is full.
+        missing = min(amount, self.capacity) - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else 60.0
+
+
+# Client-side rate limiter for the model API. Requests and tokens per minute are tracked in two
+# token buckets; a request waits until both have capacity for it (its tokens are estimated up
+# front and corrected when the actual usage is known). The buckets are configured from the rate
+# limit headers of every response (x-ratelimit-limit/remaining/reset-requests/tokens), or from
+# the limits passed in; without either, requests are not limited. A 429 response pauses all
+# requests for the delay the server asked for. One limiter is shared by all participants
+# using the same API key, so they spend one quota together instead of running into 429 storms.
+class RateLimiter(object):
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.paused_until = 0.0
+
+    def acquire(self, tokens, cancelled=None):
+        """
+        Waits until a request using about 'tokens' tokens may be sent.
+
+        Parameters:
+        - tokens: int, the estimated number of tokens of the request.
+        - cancelled: concurrent.futures.Future, optional. Waiting stops when it completes.
+
+        Returns:
+        - bool: True when the request may be sent, False if waiting was cancelled.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                delay = self.paused_until - now
+                for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                    if bucket is not None:
+                        bucket.refill(now)
+                        delay = max(delay, bucket.wait_time(amount))
+                if delay <= 0:
+                    if self.requests is not None:
+                        self.requests.level -= 1
+                    if self.tokens is not None:
+                        self.tokens.level -= tokens
+                    return True
+            if cancelled is not None:
+                wait([cancelled], timeout=delay)
+                if cancelled.done():
+                    return False
+            else:
+                time.sleep(delay)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        # Corrects the token bucket once the actual usage of a request is known.
+        with self.lock:
+            if self.tokens is not None:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated_tokens - actual_tokens)
+
+    def update_from_headers(self, headers):
+        if not headers:
+            return
+        with self.lock:
+            now = time.monotonic()
+            for kind in ("requests", "tokens"):
+                try:
+                    limit = int(headers.get(f"x-ratelimit-limit-{kind}"))
+                    remaining = int(headers.get(f"x-ratelimit-remaining-{kind}"))
+                except (TypeError, ValueError):
+                    continue
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                # The bucket refills to the limit by the time the server resets it
+                rate = (limit - remaining) / reset if reset > 0 and remaining < limit else limit / 60
+                bucket = getattr(self, kind)
+                if bucket is None:
+                    bucket = TokenBucket(limit, rate)
+                    setattr(self, kind, bucket)
+                bucket.capacity = limit
+                bucket.rate = rate
+                bucket.level = remaining
+                bucket.updated = now
+
+    def pause(self, seconds):
+        # Holds back all requests, e.g., after a 429 response.
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
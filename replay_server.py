@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import time
+from cassette import Cassette, ReplayClient
+
+# Local stand-in for the OpenAI chat completions endpoint. It serves the interactions of a
+# cassette over HTTP (plain JSON or server-sent events for streamed requests), so any client
+# speaking the OpenAI API can be driven offline, e.g., InterBud with --openai_base_url.
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    replay = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        try:
+            interaction = self.replay.find(request)
+        except LookupError as e:
+            self.send_json(404, {"error": {"message": str(e), "type": "invalid_request_error"}})
+            return
+
+        delays = self.replay.delays(interaction)
+        if "chunks" not in interaction:
+            time.sleep(delays[0])
+            self.send_json(200, interaction["response"])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for chunk, delay in zip(interaction["chunks"], delays):
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+def serve(cassette_path, host="127.0.0.1", port=8000, latency_scale=0.0, extra_latency=0.0):
+    ReplayRequestHandler.replay = ReplayClient(Cassette(cassette_path), latency_scale=latency_scale, extra_latency=extra_latency)
+    server = ThreadingHTTPServer((host, port), ReplayRequestHandler)
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a recorded InterBud cassette as an OpenAI compatible API')
+    parser.add_argument('cassette', help='Cassette file recorded with --record')
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8000)
+    parser.add_argument('--latency_scale', help='Scale of the recorded latencies (0 replays at full speed)', type=float, default=0.0)
+    parser.add_argument('--extra_latency', help='Fixed delay in seconds added to every response', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(args.cassette, args.host, args.port, args.latency_scale, args.extra_latency)
+    print(f"Serving {args.cassette} on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
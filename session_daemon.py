@@ -0,0 +1,342 @@
+from collections import deque
+from datetime import datetime
+import json
+import os
+import socket
+import threading
+from blob_store import shared_store
+from chat_frontend import ChatFrontend
+from keyboard_participant import KeyboardChatParticipant
+from message_records import ChatRecord
+from participant_interface import ChatParticipantInterface
+
+# Daemon mode. The daemon runs InterBudApp and its participants without a terminal and serves
+# the session on a Unix domain socket; terminal clients attach to it, and may detach (or lose
+# their connection) while the participants keep working. Every client gets a snapshot of the
+# session followed by incremental updates, so several clients can watch one session; messages
+# typed in any of them reach the participants once, through the daemon's single user
+# participant.
+#
+# The protocol consists of JSON objects, one per line. From the daemon to a client:
+#   {"type": "snapshot", "session": id, "history": [[timestamp, sender, text], ...],
+#    "partial": [timestamp, sender, text] or null, "status": text}
+#   {"type": "message", "time": timestamp, "sender": sender, "text": text}
+#   {"type": "partial", "time": timestamp, "sender": sender, "text": text} (empty text: done)
+#   {"type": "status", "text": text}
+# From a client to the daemon:
+#   {"type": "message", "text": text}  (sent as the user's message)
+#   {"type": "cancel"}                 (like ESC: cancels the work in progress)
+#   {"type": "stop"}                   (stops the daemon)
+
+def encode_event(event):
+    return json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+# Connection of an attached client on the daemon side. Events are queued and written by the
+# connection's own thread, so a slow client does not hold up the daemon. A queued partial
+# message is replaced by a newer one of the same sender; a client falling more than
+# 'max_queued' events behind is disconnected (it can attach again and gets a new snapshot).
+class ClientConnection(object):
+    def __init__(self, connection, on_event, on_close, max_queued=10000):
+        self.connection = connection
+        self.on_event = on_event
+        self.on_close = on_close
+        self.max_queued = max_queued
+        self.events = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self._write_events, name="daemon-client-writer", daemon=True).start()
+        threading.Thread(target=self._read_events, name="daemon-client-reader", daemon=True).start()
+
+    def push(self, event):
+        with self.condition:
+            if self.closed:
+                return
+            if event["type"] == "partial" and self.events and self.events[-1]["type"] == "partial" and self.events[-1]["sender"] == event["sender"]:
+                self.events[-1] = event
+            elif len(self.events) >= self.max_queued:
+                self.closed = True
+            else:
+                self.events.append(event)
+            self.condition.notify()
+
+    def _write_events(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.events and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        break
+                    events = list(self.events)
+                    self.events.clear()
+                self.connection.sendall(b"".join(encode_event(event) for event in events))
+        except OSError:
+            pass
+        self.close()
+
+    def _read_events(self):
+        try:
+            with self.connection.makefile("rb") as lines:
+                for line in lines:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.on_event(event)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+            connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.close()
+        self.on_close(self)
+
+
+# The user of a daemon session. Messages and cancel requests of all attached clients arrive
+# here and are sent to the other participants like those of a KeyboardChatParticipant.
+class RemoteUserParticipant(ChatParticipantInterface):
+    def send_message(self, send_datetime, sender, message):
+        pass
+
+    def submit(self, text):
+        if text and self.message_send_callback:
+            self.message_send_callback(datetime.now(), self.label, text)
+
+    def request_cancel(self):
+        if self.cancel_callback:
+            self.cancel_callback()
+
+    def run(self):
+        pass
+
+
+# Frontend of the daemon. It takes the place of ChatFrontend in InterBudApp: instead of
+# drawing, it keeps the newest 'history_limit' messages (as compact ChatRecords), the
+# in-progress message and the status, and forwards every change to the attached clients.
+# 'run' accepts clients on the socket until 'quit' is called.
+class DaemonFrontend(object):
+    def __init__(self, socket_path, user, session_id=None, history_limit=1000, blob_store=shared_store):
+        self.socket_path = socket_path
+        self.user = user
+        self.session_id = session_id
+        self.blob_store = blob_store
+        self.history = deque(maxlen=history_limit)
+        self.next_message_id = 0
+        self.partial = None
+        self.status_text = ""
+        self.clients = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.server = self._listen(socket_path)
+
+    @staticmethod
+    def _listen(socket_path):
+        if os.path.exists(socket_path):
+            # A socket nobody listens on is left over from a daemon that did not shut down
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError(f"A daemon is already serving {socket_path}")
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user running the daemon may connect
+        umask = os.umask(0o077)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        server.settimeout(0.2)
+        return server
+
+    def _broadcast(self, event):
+        for client in self.clients:
+            client.push(event)
+
+    def enqueue_message(self, date, sender, message):
+        with self.lock:
+            self.history.append(ChatRecord.create(self.next_message_id, date, sender, message, self.blob_store))
+            self.next_message_id += 1
+            if self.partial is not None and self.partial[1] == sender:
+                self.partial = None
+            self._broadcast({"type": "message", "time": date.timestamp(), "sender": sender, "text": message})
+
+    def update_partial_message(self, date, sender, message):
+        with self.lock:
+            self.partial = (date.timestamp(), sender, message) if message else None
+            self._broadcast({"type": "partial", "time": date.timestamp(), "sender": sender, "text": message or ""})
+
+    def update_status(self, text):
+        with self.lock:
+            self.status_text = text
+            self._broadcast({"type": "status", "text": text})
+
+    def load_history(self, messages):
+        for date, sender, message in messages:
+            self.history.append(ChatRecord.create(self.next_message_id, date, sender, message, self.blob_store))
+            self.next_message_id += 1
+
+    def update_input(self, label, text, cursor=None):
+        # Every client edits its input field locally
+        pass
+
+    def navigate_history(self, action, argument=None):
+        # Every client scrolls and searches its own history
+        pass
+
+    def resize(self):
+        pass
+
+    def snapshot(self):
+        return {
+            "type": "snapshot",
+            "session": self.session_id,
+            "history": [[record.timestamp, record.sender, self.blob_store.get(record.text)] for record in self.history],
+            "partial": list(self.partial) if self.partial is not None else None,
+            "status": self.status_text,
+        }
+
+    def handle_event(self, event):
+        if event.get("type") == "message":
+            self.user.submit(event.get("text"))
+        elif event.get("type") == "cancel":
+            self.user.request_cancel()
+        elif event.get("type") == "stop":
+            # 'run' returns, after which the daemon quits the app
+            self.quit()
+
+    def _attach(self, connection):
+        client = ClientConnection(connection, self.handle_event, self._detach)
+        # Taking the snapshot and adding the client under one lock makes sure the client gets
+        # every later update exactly once.
+        with self.lock:
+            client.push(self.snapshot())
+            self.clients.append(client)
+        client.start()
+
+    def _detach(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def run(self):
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    connection, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                self._attach(connection)
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            for client in list(self.clients):
+                client.close()
+
+    def quit(self):
+        self.running = False
+
+
+# Terminal client of a daemon session: a ChatFrontend and a KeyboardChatParticipant that are
+# connected to the daemon instead of to the participants. Typing and drawing happen locally;
+# submitted messages and ESC are sent to the daemon, and the messages of the session arrive
+# from it. CTRL-D detaches the client, the session goes on in the daemon.
+class AttachedClient(object):
+    def __init__(self, stdscr, socket_path, label="User", frontend=None):
+        self.stdscr = stdscr
+        self.label = label
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        self.lines = self.connection.makefile("rb")
+        self.send_lock = threading.Lock()
+        self.session_id = None
+        # A frontend can be passed in, e.g., a HeadlessChatFrontend to run without a terminal.
+        self.frontend = frontend if frontend is not None else ChatFrontend(stdscr)
+        self.keyboard = KeyboardChatParticipant(label, stdscr)
+        self.detached = False
+
+    def send(self, event):
+        try:
+            with self.send_lock:
+                self.connection.sendall(encode_event(event))
+        except OSError:
+            pass
+
+    def submit(self, date, sender, message):
+        self.send({"type": "message", "text": message})
+
+    def cancel(self):
+        self.send({"type": "cancel"})
+
+    def apply_snapshot(self, snapshot):
+        self.session_id = snapshot.get("session")
+        self.frontend.load_history((datetime.fromtimestamp(timestamp), sender, text) for timestamp, sender, text in snapshot["history"])
+        if snapshot.get("partial"):
+            timestamp, sender, text = snapshot["partial"]
+            self.frontend.update_partial_message(datetime.fromtimestamp(timestamp), sender, text)
+        self.frontend.update_status(snapshot.get("status", ""))
+
+    def apply_event(self, event):
+        kind = event.get("type")
+        if kind == "message":
+            self.frontend.enqueue_message(datetime.fromtimestamp(event["time"]), event["sender"], event["text"])
+        elif kind == "partial":
+            self.frontend.update_partial_message(datetime.fromtimestamp(event["time"]), event["sender"], event["text"])
+        elif kind == "status":
+            self.frontend.update_status(event["text"])
+
+    def _read_events(self):
+        try:
+            for line in self.lines:
+                self.apply_event(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        if not self.detached:
+            self.frontend.enqueue_message(datetime.now(), "InterBud", "The daemon closed the connection. Press CTRL-D to exit.")
+
+    def detach(self):
+        self.detached = True
+        self.keyboard.quit()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+        self.frontend.quit()
+
+    def run(self):
+        # The snapshot is applied before the frontend starts drawing
+        line = self.lines.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        self.apply_snapshot(json.loads(line))
+        threading.Thread(target=self._read_events, name="daemon-events", daemon=True).start()
+
+        self.keyboard.register_message_send_callback(self.submit)
+        self.keyboard.register_cancel_callback(self.cancel)
+        self.keyboard.register_quit_app_callback(self.detach)
+        self.keyboard.register_update_input_callback(self.frontend.update_input)
+        self.keyboard.register_resize_callback(self.frontend.resize)
+        self.keyboard.register_history_callback(self.frontend.navigate_history)
+        self.keyboard.run()
+        self.frontend.run()
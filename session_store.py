@@ -0,0 +1,160 @@
+from array import array
+from datetime import datetime
+import json
+import os
+import queue
+import threading
+
+# Append-only session log. Entries are JSON objects stored one per line in a data file. A
+# sidecar index file holds the byte offset of every entry as a fixed-size 64-bit integer, so
+# the number of entries and the position of any entry are known without reading the data
+# file, and the newest entries can be read directly. Appends are queued and written by a
+# background thread, which also takes care of flushing and fsyncing, so callers never block
+# on disk I/O. When a log is opened, a data file and index that got out of step (e.g., after a
+# crash between the two writes) are repaired.
+class SessionLog(object):
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.fsync = fsync
+        self.offsets = array('Q')
+
+        open(self.path, 'ab').close()
+        open(self.index_path, 'ab').close()
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        self.offsets.frombytes(data[:len(data) - len(data) % self.offsets.itemsize])
+        self._repair()
+
+        self.data_file = open(self.path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        self.data_size = self.data_file.tell()
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_entries, name="session-log-writer", daemon=True)
+        self.writer.start()
+
+    def _repair(self):
+        data_size = os.path.getsize(self.path)
+        # Drop index entries pointing past the end of the data (the data write was lost)...
+        while self.offsets and self.offsets[-1] >= data_size:
+            self.offsets.pop()
+        with open(self.path, 'r+b') as f:
+            # ...check that the last indexed entry is complete...
+            if self.offsets:
+                f.seek(self.offsets[-1])
+                if not f.readline().endswith(b"\n"):
+                    f.seek(self.offsets.pop())
+            # ...and index complete lines that were written after it. A partially written
+            # last entry is cut off.
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    if line:
+                        f.truncate(offset)
+                    break
+                self.offsets.append(offset)
+        with open(self.index_path, 'wb') as f:
+            f.write(self.offsets.tobytes())
+
+    def _write_entries(self):
+        while True:
+            entries = [self.queue.get()]
+            while True:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = None in entries
+            lines = [json.dumps(entry, ensure_ascii=False).encode('utf-8') + b"\n" for entry in entries if entry is not None]
+            if lines:
+                new_offsets = array('Q')
+                for line in lines:
+                    new_offsets.append(self.data_size)
+                    self.data_size += len(line)
+                self.data_file.write(b"".join(lines))
+                self.data_file.flush()
+                self.index_file.write(new_offsets.tobytes())
+                self.index_file.flush()
+                if self.fsync:
+                    os.fsync(self.data_file.fileno())
+                    os.fsync(self.index_file.fileno())
+                self.offsets.extend(new_offsets)
+            for _ in entries:
+                self.queue.task_done()
+            if closing:
+                return
+
+    def append(self, entry):
+        self.queue.put(entry)
+
+    def flush(self):
+        # Waits until all queued entries are written.
+        self.queue.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        self.data_file.close()
+        self.index_file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read(self, index):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[index])
+            return json.loads(f.readline())
+
+    def read_range(self, start, stop):
+        # Reads the entries [start, stop) with a single seek.
+        start = max(start, 0)
+        stop = min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[start])
+            return [json.loads(f.readline()) for _ in range(stop - start)]
+
+    def tail(self, count):
+        return self.read_range(len(self.offsets) - count, len(self.offsets))
+
+    def iter_reverse(self, batch_size=256):
+        # Yields the entries from the newest to the oldest, reading them in batches.
+        stop = len(self.offsets)
+        while stop > 0:
+            start = max(stop - batch_size, 0)
+            yield from reversed(self.read_range(start, stop))
+            stop = start
+
+
+# Session store. This class groups the logs of one session in a directory: the chat history
+# as shown in the frontend, and the conversation context of every model participant.
+class SessionStore(object):
+    def __init__(self, session_directory, session_id=None):
+        self.session_id = session_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.directory = os.path.join(session_directory, self.session_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.history = SessionLog(os.path.join(self.directory, "history.jsonl"))
+        self.context_logs = {}
+
+    def context_log(self, label):
+        if label not in self.context_logs:
+            self.context_logs[label] = SessionLog(os.path.join(self.directory, f"context-{label}.jsonl"))
+        return self.context_logs[label]
+
+    def append_message(self, date, sender, message):
+        self.history.append({"time": date.timestamp(), "sender": sender, "message": message})
+
+    def history_tail(self, count):
+        """
+        Returns the newest 'count' chat messages as (datetime, sender, message) tuples.
+        """
+        return [(datetime.fromtimestamp(entry["time"]), entry["sender"], entry["message"]) for entry in self.history.tail(count)]
+
+    def close(self):
+        self.history.close()
+        for log in self.context_logs.values():
+            log.close()
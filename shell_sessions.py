@@ -0,0 +1,197 @@
+import codecs
+import os
+import select
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+# Output collector that keeps at most 'limit' bytes: the first half and the last half of the
+# output. Everything in between is counted but not stored, so a command producing gigabytes
+# of output only costs 'limit' bytes of memory.
+class CappedOutput(object):
+    def __init__(self, limit):
+        self.half = max(limit // 2, 1)
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def add(self, data):
+        if len(self.head) < self.half:
+            take = self.half - len(self.head)
+            self.head += data[:take]
+            data = data[take:]
+        self.tail += data
+        if len(self.tail) > 2 * self.half:
+            excess = len(self.tail) - self.half
+            self.omitted += excess
+            del self.tail[:excess]
+
+    def text(self):
+        if self.omitted or len(self.tail) > self.half:
+            excess = max(len(self.tail) - self.half, 0)
+            omitted = self.omitted + excess
+            tail = bytes(self.tail[excess:])
+            return (self.head.decode('utf-8', errors='replace')
+                    + f"\n[... {omitted} bytes of output omitted ...]\n"
+                    + tail.decode('utf-8', errors='replace'))
+        return (self.head + self.tail).decode('utf-8', errors='replace')
+
+
+# Long-lived shell session. This class keeps a bash process running in a working directory
+# and runs commands in it one after another, so the environment and the current directory
+# (e.g., after 'cd' or 'export') carry over between commands. Each command is evaluated by the
+# shell with stdin from /dev/null and stderr merged into stdout, followed by a marker line
+# carrying its exit code. The output is read incrementally and can be streamed to a callback.
+# A command exceeding its timeout is killed together with the whole shell; the pool starts a
+# fresh session for the next command. The shell and everything it starts run with CPU time
+# and address space limits.
+class ShellSession(object):
+    def __init__(self, working_directory, cpu_limit=300, memory_limit=4 << 30):
+        self.working_directory = working_directory
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            ["/bin/bash", "-c", f"{self._limits_script()}exec /bin/bash --noprofile --norc"],
+            cwd=working_directory,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            start_new_session=True,
+        )
+
+    def _limits_script(self):
+        # The limits are set by a wrapper shell that then replaces itself with the session's
+        # bash, so they are inherited by every command. (A preexec_fn would run Python code
+        # between fork and exec, which can deadlock while other threads are running.)
+        script = ""
+        if self.cpu_limit:
+            script += f"ulimit -t {int(self.cpu_limit)} && "
+        if self.memory_limit:
+            script += f"ulimit -v {int(self.memory_limit) // 1024} && "
+        return script
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def run(self, command, timeout=120, output_limit=65536, output_callback=None):
+        """
+        Runs a shell command in the session.
+
+        Parameters:
+        - command: str, the command line, interpreted by bash (quoting, pipes etc. work).
+        - timeout: float, the wall-clock time in seconds after which the command is killed.
+        - output_limit: int, the maximum number of output bytes kept (head and tail).
+        - output_callback: callable(str), called with each piece of output as it arrives.
+
+        Returns:
+        - tuple: (exit_code, output). exit_code is None if the command timed out or ended the
+          shell.
+        """
+        with self.lock:
+            if not self.alive:
+                raise BrokenPipeError("The shell session has ended")
+            # The marker is printed on a line of its own, the newline in front of it is part of it.
+            marker_text = f"__INTERBUD_DONE_{uuid.uuid4().hex}__"
+            marker = f"\n{marker_text} ".encode()
+            script = f"eval {shlex.quote(command)} < /dev/null 2>&1\nprintf '\\n%s %d\\n' {marker_text} $?\n"
+            self.process.stdin.write(script.encode('utf-8'))
+
+            fd = self.process.stdout.fileno()
+            output = CappedOutput(output_limit)
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pending = b""
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.kill()
+                    output.add(pending)
+                    return None, output.text() + f"\n[Command timed out after {timeout} seconds, the shell session was restarted]"
+                ready, _, _ = select.select([fd], [], [], remaining)
+                if not ready:
+                    continue
+                data = os.read(fd, 65536)
+                if not data:
+                    output.add(pending)
+                    return None, output.text() + f"\n[The shell exited with code {self.process.wait()}]"
+                pending += data
+
+                index = pending.find(marker)
+                if index == -1:
+                    # Hold back a possible beginning of the marker split across reads.
+                    keep = next((k for k in range(min(len(marker), len(pending)), 0, -1) if marker.startswith(pending[-k:])), 0)
+                    ready_data, pending = pending[:len(pending) - keep], pending[len(pending) - keep:]
+                elif pending.find(b"\n", index + 1) == -1:
+                    ready_data, pending = pending[:index], pending[index:]
+                else:
+                    ready_data = pending[:index]
+                    exit_code = int(pending[index + len(marker):pending.find(b"\n", index + 1)])
+                    output.add(ready_data)
+                    if output_callback and ready_data:
+                        output_callback(decoder.decode(ready_data, final=True))
+                    return exit_code, output.text()
+
+                if ready_data:
+                    output.add(ready_data)
+                    if output_callback:
+                        output_callback(decoder.decode(ready_data))
+
+
+# Pool of shell sessions, one per working directory. Sessions are started on first use and
+# replaced when they were killed (timeout) or exited. Commands for the same directory run one
+# after another in its session.
+class ShellSessionPool(object):
+    def __init__(self, cpu_limit=300, memory_limit=4 << 30):
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, working_directory):
+        key = os.path.realpath(working_directory)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None or not session.alive:
+                session = ShellSession(key, cpu_limit=self.cpu_limit, memory_limit=self.memory_limit)
+                self.sessions[key] = session
+            return session
+
+    def run(self, command, working_directory, max_restarts=2, **kwargs):
+        # See ShellSession.run. A session that ended before the command could be sent to it is
+        # replaced at most 'max_restarts' times; a shell that keeps dying right away (e.g.,
+        # because the memory limit is too low for bash itself) ends the command with an error.
+        for _ in range(max_restarts + 1):
+            session = self.get_session(working_directory)
+            try:
+                return session.run(command, **kwargs)
+            except BrokenPipeError:
+                # The session ended while the command was waiting for it, start a new one.
+                continue
+        return None, "[The shell session could not be started]"
+
+    def interrupt(self):
+        # Kills the sessions that are running a command (e.g., when the turn that started it was
+        # cancelled). The commands return, and the sessions are replaced on their next use.
+        with self.lock:
+            for session in self.sessions.values():
+                if session.lock.locked():
+                    session.kill()
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.kill()
+            self.sessions.clear()
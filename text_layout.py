@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import unicodedata
+
+def char_width(char):
+    """
+    Returns the number of terminal columns a character occupies: 0 for combining and other
+    zero-width characters, 2 for wide and full-width (e.g., CJK) characters, 1 otherwise.
+    """
+    if char < '\u0300':
+        return 1
+    if unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+        return 0
+    if unicodedata.east_asian_width(char) in ('W', 'F'):
+        return 2
+    return 1
+
+def text_width(text):
+    """
+    Returns the number of terminal columns a string occupies.
+    """
+    if text.isascii():
+        return len(text)
+    return sum(char_width(char) for char in text)
+
+def split_by_width(text, width):
+    """
+    Splits a string into pieces of at most 'width' columns each. Combining characters stay
+    with the character they belong to.
+    """
+    pieces = []
+    current = []
+    current_width = 0
+    for char in text:
+        w = char_width(char)
+        if current_width + w > width and current:
+            pieces.append(''.join(current))
+            current = []
+            current_width = 0
+        current.append(char)
+        current_width += w
+    pieces.append(''.join(current))
+    return pieces
+
+def wrap_line(text, width):
+    """
+    Wraps a single line of text (no newlines) into rows of at most 'width' columns.
+
+    Words are separated by single spaces; runs of spaces (e.g., indentation in command output)
+    are preserved within a row, the space at a row break is dropped. Words longer than a row
+    are split. The running width of the current row is tracked, so wrapping is linear in the
+    length of the line.
+
+    Returns:
+    - list of str: The rows, at least one (empty) row for an empty line.
+    """
+    text = text.expandtabs(4)
+    if text.isascii() and len(text) <= width:
+        return [text]
+
+    rows = []
+    parts = []
+    row_width = 0
+    row_started = False
+    for word in text.split(' '):
+        w = text_width(word)
+        separator = 1 if row_started else 0
+        if row_width + separator + w <= width:
+            if row_started:
+                parts.append(' ')
+            parts.append(word)
+            row_width += separator + w
+            row_started = True
+            continue
+
+        if row_started:
+            rows.append(''.join(parts))
+        if w > width:
+            pieces = split_by_width(word, width)
+            rows.extend(pieces[:-1])
+            word = pieces[-1]
+            w = text_width(word)
+        parts = [word]
+        row_width = w
+        row_started = True
+
+    rows.append(''.join(parts))
+    return rows
+
+def wrap_text(text, width):
+    """
+    Wraps a (possibly multi-line) text into rows of at most 'width' columns.
+    """
+    rows = []
+    for line in text.split('\n'):
+        rows.extend(wrap_line(line, width))
+    return rows
+
+
+# Layout cache. This class memoizes the wrapped rows of chat messages keyed by message id and
+# width. Wrapping only happens for messages that are actually drawn, so after a terminal resize
+# just the messages in the visible region are wrapped again for the new width. The least
+# recently used entries are evicted once 'max_entries' is exceeded.
+class LayoutCache(object):
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def lookup(self, message_id, width):
+        # Returns the cached rows of a message, or None.
+        key = (message_id, width)
+        rows = self.entries.get(key)
+        if rows is not None:
+            self.entries.move_to_end(key)
+        return rows
+
+    def get_rows(self, message_id, prefix, text, width):
+        """
+        Returns the rows of a message wrapped to 'width' columns, each starting with 'prefix'.
+        """
+        rows = self.lookup(message_id, width)
+        if rows is not None:
+            return rows
+
+        key = (message_id, width)
+        body_width = max(width - text_width(prefix), 1)
+        rows = [prefix + row for row in wrap_text(text, body_width)]
+        self.entries[key] = rows
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return rows
+
+    def clear(self):
+        self.entries.clear()
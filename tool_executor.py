@@ -0,0 +1,75 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+
+# Tool executor. This class runs the tool calls of a single GPT turn on a bounded pool of
+# worker threads, so independent calls take as long as the slowest one instead of the sum
+# of all of them. The results are returned in the order the calls were submitted.
+# Per-tool concurrency limits cap how many calls of one tool run at the same time, and
+# tools listed in 'path_serialized_tools' (the ones that modify the file system) run one
+# after another for the same path, in the order they were requested. Calls of other tools
+# and calls on different paths fan out freely. A batch can be cancelled through a future: the
+# calls that did not finish by then are abandoned and reported as cancelled.
+class ToolExecutor(object):
+    def __init__(self, max_workers=4, concurrency_limits=None, path_serialized_tools=("write_file", "create_directory", "edit_range", "apply_patch")):
+        self.max_workers = max_workers
+        self.concurrency_limits = dict(concurrency_limits or {})
+        self.path_serialized_tools = set(path_serialized_tools)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.tool_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in self.concurrency_limits.items()}
+
+    def _run_call(self, function_name, function, kwargs, previous_call):
+        # Calls on the same path wait for the previously requested call on that path.
+        if previous_call is not None:
+            previous_call.exception()
+
+        semaphore = self.tool_semaphores.get(function_name)
+        if semaphore is None:
+            return function(**kwargs)
+        with semaphore:
+            return function(**kwargs)
+
+    def run(self, calls, cancelled=None):
+        """
+        Runs a batch of tool calls concurrently.
+
+        Parameters:
+        - calls: list of (function_name, function, kwargs, path) tuples. 'path' identifies the
+          resource a call works on and is only used for tools in 'path_serialized_tools'.
+        - cancelled: concurrent.futures.Future, optional. When it completes, the batch stops
+          waiting for unfinished calls.
+
+        Returns:
+        - list: The results of the calls in the order they were given. A call that raised an
+          exception yields an error string instead of a result.
+        """
+        last_call_per_path = {}
+        futures = []
+        for function_name, function, kwargs, path in calls:
+            previous_call = None
+            if function_name in self.path_serialized_tools and path is not None:
+                previous_call = last_call_per_path.get(path)
+            future = self.pool.submit(self._run_call, function_name, function, kwargs, previous_call)
+            if function_name in self.path_serialized_tools and path is not None:
+                last_call_per_path[path] = future
+            futures.append(future)
+
+        if cancelled is not None:
+            waiting = set(futures)
+            while waiting and not cancelled.done():
+                _, not_done = wait(waiting | {cancelled}, return_when=FIRST_COMPLETED)
+                waiting = not_done - {cancelled}
+
+        results = []
+        for future in futures:
+            if not future.done():
+                future.cancel()
+                results.append("Cancelled before the call finished.")
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(f"An error occurred: {e}")
+        return results
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,214 @@
+from datetime import datetime
+import fnmatch
+import os
+import re
+import threading
+import time
+
+# Workspace index. This class keeps an in-memory index of all files below a root folder
+# (size and modification time per file, the listing per directory) and a cache of the text of
+# files that were searched. The index is refreshed incrementally: a directory whose mtime did
+# not change reuses its cached listing instead of being read again, and a file's cached text is
+# only read again when its size or mtime changed. A refresh only happens when the index was
+# marked dirty (e.g., after a tool changed files) or 'refresh_interval' seconds passed since the
+# last one, so repeated queries on an unchanged tree are answered without touching the disk.
+class WorkspaceIndex(object):
+    def __init__(self, root, refresh_interval=5.0, max_file_size=2 << 20, ignored_directories=(".git", "__pycache__", "node_modules", ".venv")):
+        self.root = os.path.realpath(root)
+        self.refresh_interval = refresh_interval
+        self.max_file_size = max_file_size
+        self.ignored_directories = set(ignored_directories)
+        self.lock = threading.Lock()
+
+        # relative directory -> (mtime_ns, [subdirectory names], [file names])
+        self.directories = {}
+        # relative file path -> (size, mtime_ns)
+        self.files = {}
+        # relative file path -> (size, mtime_ns, text or None for binary/oversized files)
+        self.contents = {}
+        self.dirty = True
+        self.last_refresh = 0.0
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def refresh(self, force=False):
+        with self.lock:
+            if not force and not self.dirty and time.monotonic() - self.last_refresh < self.refresh_interval:
+                return
+            self.dirty = False
+            directories = {}
+            files = {}
+            pending = [""]
+            while pending:
+                relative = pending.pop()
+                absolute = os.path.join(self.root, relative)
+                try:
+                    mtime_ns = os.stat(absolute).st_mtime_ns
+                except OSError:
+                    continue
+                cached = self.directories.get(relative)
+                if cached is not None and cached[0] == mtime_ns:
+                    _, subdirectories, file_names = cached
+                else:
+                    subdirectories, file_names = [], []
+                    try:
+                        with os.scandir(absolute) as entries:
+                            for entry in entries:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if entry.name not in self.ignored_directories:
+                                        subdirectories.append(entry.name)
+                                elif entry.is_file():
+                                    file_names.append(entry.name)
+                    except OSError:
+                        continue
+                directories[relative] = (mtime_ns, subdirectories, file_names)
+                for name in file_names:
+                    path = os.path.join(relative, name)
+                    try:
+                        stat = os.stat(os.path.join(self.root, path))
+                    except OSError:
+                        continue
+                    files[path] = (stat.st_size, stat.st_mtime_ns)
+                pending.extend(os.path.join(relative, name) for name in subdirectories)
+
+            self.directories = directories
+            self.files = files
+            self.contents = {path: content for path, content in self.contents.items() if files.get(path) == content[:2]}
+            self.last_refresh = time.monotonic()
+
+    def _normalize(self, relative_path):
+        path = os.path.normpath(relative_path or ".")
+        return "" if path == "." else path
+
+    def _candidates(self, relative_path, recursive):
+        base = self._normalize(relative_path)
+        if base in self.files:
+            return [base]
+        prefix = base + os.sep if base else ""
+        result = []
+        for path in self.files:
+            if not path.startswith(prefix):
+                continue
+            if not recursive and os.sep in path[len(prefix):]:
+                continue
+            result.append(path)
+        result.sort()
+        return result
+
+    def _text(self, path):
+        size, mtime_ns = self.files[path]
+        cached = self.contents.get(path)
+        if cached is not None and cached[:2] == (size, mtime_ns):
+            return cached[2]
+        text = None
+        if size <= self.max_file_size:
+            try:
+                with open(os.path.join(self.root, path), 'rb') as f:
+                    data = f.read()
+                if b"\0" not in data[:8192]:
+                    text = data.decode('utf-8', errors='replace')
+            except OSError:
+                pass
+        self.contents[path] = (size, mtime_ns, text)
+        return text
+
+    def find_files(self, pattern="*", relative_path=".", recursive=True, min_size=None, max_size=None, modified_after=None, modified_before=None, limit=200):
+        """
+        Finds files by glob pattern and optional size and modification time filters.
+
+        Parameters:
+        - pattern: str, a glob matched against the file name, or against the relative path if
+          it contains a '/'.
+        - relative_path: str, the folder to search in.
+        - recursive: bool, whether to include subfolders.
+        - min_size, max_size: int, size limits in bytes.
+        - modified_after, modified_before: str, ISO 8601 timestamps.
+        - limit: int, the maximum number of files returned.
+
+        Returns:
+        - dict: The matching files (path, size, modified) and the total number of matches.
+        """
+        self.refresh()
+        after = datetime.fromisoformat(modified_after).timestamp() * 1e9 if modified_after else None
+        before = datetime.fromisoformat(modified_before).timestamp() * 1e9 if modified_before else None
+        matches = []
+        total = 0
+        with self.lock:
+            for path in self._candidates(relative_path, recursive):
+                size, mtime_ns = self.files[path]
+                name = path if '/' in pattern else os.path.basename(path)
+                if not fnmatch.fnmatch(name, pattern):
+                    continue
+                if (min_size is not None and size < min_size) or (max_size is not None and size > max_size):
+                    continue
+                if (after is not None and mtime_ns < after) or (before is not None and mtime_ns > before):
+                    continue
+                total += 1
+                if len(matches) < limit:
+                    modified = datetime.fromtimestamp(mtime_ns / 1e9).isoformat(timespec='seconds')
+                    matches.append({'path': path, 'size': size, 'modified': modified})
+        return {'files': matches, 'total': total}
+
+    def search_text(self, pattern, relative_path=".", glob=None, ignore_case=False, max_matches=100, context_lines=0):
+        """
+        Searches the contents of text files for a regular expression.
+
+        Parameters:
+        - pattern: str, the regular expression.
+        - relative_path: str, the folder (or file) to search in, recursively.
+        - glob: str, an optional glob the file names have to match.
+        - ignore_case: bool, whether to match case-insensitively.
+        - max_matches: int, the maximum number of matching lines returned.
+        - context_lines: int, the number of lines shown before and after each match.
+
+        Returns:
+        - str: Matching lines as 'path:line: text', context lines as 'path-line- text', and a
+          summary line.
+        """
+        self.refresh()
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        output = []
+        matches = 0
+        files_with_matches = 0
+        truncated = False
+        with self.lock:
+            for path in self._candidates(relative_path, True):
+                if glob and not fnmatch.fnmatch(os.path.basename(path), glob):
+                    continue
+                text = self._text(path)
+                if not text:
+                    continue
+                # Collect the numbers of the matching lines, then print them with their context
+                matching_lines = []
+                line_number = 0
+                position = 0
+                for match in regex.finditer(text):
+                    line_number += text.count("\n", position, match.start())
+                    position = match.start()
+                    if matching_lines and matching_lines[-1] == line_number:
+                        continue
+                    if matches >= max_matches:
+                        truncated = True
+                        break
+                    matches += 1
+                    matching_lines.append(line_number)
+                if not matching_lines:
+                    continue
+
+                files_with_matches += 1
+                lines = text.split("\n")
+                printed_until = -1
+                matching = set(matching_lines)
+                for line_number in matching_lines:
+                    first = max(line_number - context_lines, printed_until + 1)
+                    for context in range(first, min(line_number + context_lines + 1, len(lines))):
+                        separator = ":" if context in matching else "-"
+                        output.append(f"{path}{separator}{context + 1}{separator} {lines[context]}")
+                        printed_until = context
+                if truncated:
+                    break
+
+        summary = f"[{matches} matching lines in {files_with_matches} files"
+        summary += ", stopped at max_matches]" if truncated else "]"
+        return "\n".join(output + [summary])